@@ -1,9 +1,12 @@
 '''
 API for the Securitybot database.
 '''
+from datetime import datetime
+
 # Securitybot imports
+import securitybot.archive as archive
 from securitybot.sql import SQLEngine, SQLEngineException, init_sql
-from securitybot.util import create_new_alert
+from securitybot.util import NewAlert, create_new_alerts
 
 # Typing
 from typing import Any, Dict, List, Sequence
@@ -66,6 +69,11 @@ def build_where(condition, has_where):
     s = 'AND' if has_where else 'WHERE'
     return '{0} {1}\n'.format(s, condition)
 
+def to_datetime(timestamp):
+    # type: (Any) -> datetime
+    '''Converts an optional unix timestamp to a naive UTC datetime.'''
+    return None if timestamp is None else datetime.utcfromtimestamp(float(timestamp))
+
 def build_query_dict(fields, results):
     # type: (List[str], Sequence[Sequence[Any]]) -> List[Dict[str, Any]]
     '''Builds a list of dictionaries from the results of a query.'''
@@ -73,8 +81,9 @@ def build_query_dict(fields, results):
 
 # Querying alerts
 
+# Formatted with the table to query, either alerts or an archive table
 ALERTS_QUERY = '''
-SELECT HEX(alerts.hash),
+SELECT HEX(hash),
        title,
        ldap,
        reason,
@@ -85,9 +94,7 @@ SELECT HEX(alerts.hash),
        authenticated,
        status,
        event_time
-FROM alerts
-JOIN user_responses ON alerts.hash = user_responses.hash
-JOIN alert_status ON alerts.hash = alert_status.hash
+FROM {0}
 '''
 
 ALERTS_FIELDS = ['hash',
@@ -121,6 +128,7 @@ DEFAULT_QUERY_ARGUMENTS = {
     'authenticated': None,  # authenticated status of alerts to return
     'after': None,  # starting time of alerts to return, as a unix timestamp
     'before': None,  # ending time of alerts to return, as a unix timestamp
+    'include_archive': False,  # whether to also search archived alerts
 }
 
 def query(**kwargs):
@@ -141,41 +149,49 @@ def query(**kwargs):
     build_arguments(DEFAULT_QUERY_ARGUMENTS, args, response)
 
     # Build query
-    query = ALERTS_QUERY
+    where = ''
     params = [] # type: List[Any]
     has_where = False
 
     # Add possible where statements
     if args['status'] is not None:
-        query += build_where(STATUS_WHERE, has_where)
+        where += build_where(STATUS_WHERE, has_where)
         params.append(args['status'])
         has_where = True
 
     if args['performed'] is not None:
-        query += build_where(PERFORMED_WHERE, has_where)
+        where += build_where(PERFORMED_WHERE, has_where)
         params.append(args['performed'])
         has_where = True
 
     if args['titles'] is not None:
-        query += build_where(build_in(TITLE_IN, len(args['titles'])), has_where)
+        where += build_where(build_in(TITLE_IN, len(args['titles'])), has_where)
         params.extend(args['titles'])
         has_where = True
 
     if args['ldap'] is not None:
-        query += build_where(build_in(LDAP_IN, len(args['ldap'])), has_where)
+        where += build_where(build_in(LDAP_IN, len(args['ldap'])), has_where)
         params.extend(args['ldap'])
         has_where = True
 
     # Add time bounds
     if args['before'] is not None:
-        query += build_where(BEFORE, has_where)
+        where += build_where(BEFORE, has_where)
         params.append(args['before'])
         has_where = True
     if args['after'] is not None:
-        query += build_where(AFTER, has_where)
+        where += build_where(AFTER, has_where)
         params.append(args['after'])
         has_where = True
 
+    # Search the same way through archive tables that may hold matching alerts
+    tables = ['alerts']
+    if args['include_archive']:
+        tables.extend(archive.get_archives(to_datetime(args['after']),
+                                           to_datetime(args['before'])))
+    query = 'UNION ALL\n'.join(ALERTS_QUERY.format(table) + where for table in tables)
+    params = params * len(tables)
+
     # Add limit
     query += 'ORDER BY event_time DESC\n'
     query += LIMIT
@@ -183,7 +199,7 @@ def query(**kwargs):
 
     # Make SQL query
     try:
-        raw_results = SQLEngine.execute(query, params)
+        raw_results = SQLEngine.execute(query, params, tag='api')
     except SQLEngineException:
         response['error'] = 'Invalid parameters'
         return response
@@ -200,9 +216,11 @@ def query(**kwargs):
 
 # Querying ignored
 
+# Expired ignores are only deleted periodically
 IGNORED_QUERY = '''
 SELECT ldap, title, reason, until
 FROM ignored
+WHERE until > NOW()
 '''
 
 IGNORED_ORDER_BY = 'ORDER BY until DESC\n'
@@ -232,7 +250,7 @@ def ignored(**kwargs):
     params = [] # type: List[Any]
 
     if args['ldap'] is not None:
-        query += build_where(build_in(LDAP_IN, len(args['ldap'])), False)
+        query += build_where(build_in(LDAP_IN, len(args['ldap'])), True)
         params.extend(args['ldap'])
 
     query += IGNORED_ORDER_BY
@@ -240,7 +258,7 @@ def ignored(**kwargs):
     params.append(args['limit'])
 
     try:
-        raw_results = SQLEngine.execute(query, params)
+        raw_results = SQLEngine.execute(query, params, tag='api')
     except SQLEngineException:
         response['error'] = 'Invalid parameters'
         return response
@@ -284,7 +302,7 @@ def blacklist(**kwargs):
     args = kwargs
     build_arguments(DEFAULT_BLACKLIST_ARGUMENTS, args, response)
     try:
-        raw_results = SQLEngine.execute(BLACKLIST_QUERY, (args['limit'],))
+        raw_results = SQLEngine.execute(BLACKLIST_QUERY, (args['limit'],), tag='api')
     except SQLEngineException:
         response['error'] = 'Invalid parameters'
         return response
@@ -310,9 +328,39 @@ def create_alert(ldap, title, description, reason):
     '''
     response = build_response()
     try:
-        create_new_alert(title, ldap, description, reason)
+        create_new_alerts([NewAlert(title, ldap, description, reason)])
     except SQLEngineException:
         response['error'] = 'Invalid parameters'
         return response
     response['ok'] = True
     return response
+
+# Database statistics
+def sql_stats(tag=None, limit=50):
+    # type: (str, int) -> Dict[str, Any]
+    '''
+    Returns latency statistics for the statements run by the frontend, those
+    taking the most database time overall first. The bot logs its own
+    statistics periodically.
+    Args:
+        tag: Only return statements run by this part of securitybot, e.g. "api"
+        limit: The maximum number of statements to return
+    Content:
+        {
+            "queries": List[Dict]: statistics for each statement
+            "slow": List[Dict]: the most recent slow statements, oldest first
+        }
+        Each item in "queries" has a tag, fingerprint, count, total_time,
+        max_time, rows and histogram of [upper bound in seconds, count] pairs.
+        Each item in "slow" has a time, tag, fingerprint, elapsed and rows.
+    '''
+    response = build_response()
+    queries = SQLEngine.stats()
+    slow = SQLEngine.slow_queries()
+    if tag is not None:
+        queries = [q for q in queries if q['tag'] == tag]
+        slow = [q for q in slow if q['tag'] == tag]
+    response['content']['queries'] = queries[:limit]
+    response['content']['slow'] = slow
+    response['ok'] = True
+    return response
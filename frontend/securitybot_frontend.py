@@ -4,11 +4,14 @@ Front-end for the Securitybot database.
 '''
 # Python includes
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from csv import reader
+from datetime import timedelta
 import logging
 import os
 
 # Tornado includes
+from tornado import gen
 import tornado.httpserver
 import tornado.ioloop
 import tornado.netutil
@@ -18,8 +21,36 @@ import tornado.web
 import securitybot_api as api
 
 # Typing
-from typing import Sequence
+from typing import Any, Callable, Dict, Sequence
 
+# Number of threads making API calls. Each may hold a database connection, so
+# there's no point in having more than SQLEngine has connections.
+MAX_WORKERS = 8
+# How long to wait for an API call before giving up on it
+REQUEST_TIMEOUT = timedelta(seconds=10)
+
+@gen.coroutine
+def call_api(executor, callback, **kwargs):
+    # type: (ThreadPoolExecutor, Callable[..., Dict[str, Any]], **Any) -> Any
+    '''
+    Makes a blocking API call on a worker thread, so the IOLoop can keep
+    serving other requests in the meantime.
+
+    Returns:
+        A future resolving to the API response, or an error response if the
+        call takes longer than REQUEST_TIMEOUT.
+    '''
+    future = executor.submit(callback, **kwargs)
+    try:
+        response = yield gen.with_timeout(REQUEST_TIMEOUT, future)
+    except gen.TimeoutError:
+        # Calls which haven't started yet don't need to run at all
+        future.cancel()
+        response = api.build_response()
+        response['error'] = 'Request timed out'
+    raise gen.Return(response)
+
+@gen.coroutine
 def get_endpoint(handler, defaults, callback):
     '''
     Makes a call to an API endpoint, using parameters from default.
@@ -32,10 +63,18 @@ def get_endpoint(handler, defaults, callback):
                 args[name] = default
             else:
                 args[name] = parser(arg)
-        handler.write(callback(**args))
+        response = yield call_api(handler.executor, callback, **args)
+        handler.write(response)
     except Exception as e:
         handler.write(api.exception_response(e))
 
+class APIHandler(tornado.web.RequestHandler):
+    '''A handler making API calls on a shared thread pool.'''
+
+    def initialize(self, executor):
+        # type: (ThreadPoolExecutor) -> None
+        self.executor = executor
+
 # List of tuples of name, default, parser
 QUERY_ARGUMENTS = [
     ('limit', 50, int),
@@ -46,30 +85,45 @@ QUERY_ARGUMENTS = [
     ('authenticated', None, int),
     ('after', None, int),
     ('before', None, int),
+    ('include_archive', False, lambda s: s.lower() in ['1', 'true']),
 ]
 
-class QueryHandler(tornado.web.RequestHandler):
+class QueryHandler(APIHandler):
+    @gen.coroutine
     def get(self):
-        get_endpoint(self, QUERY_ARGUMENTS, api.query)
+        yield get_endpoint(self, QUERY_ARGUMENTS, api.query)
 
 IGNORED_ARGUMENTS = [
     ('limit', 50, int),
     ('ldap', None, lambda s: list(reader([s]))[0]),
 ]
 
-class IgnoredHandler(tornado.web.RequestHandler):
+class IgnoredHandler(APIHandler):
+    @gen.coroutine
     def get(self):
-        get_endpoint(self, IGNORED_ARGUMENTS, api.ignored)
+        yield get_endpoint(self, IGNORED_ARGUMENTS, api.ignored)
 
 BLACKLIST_ARGUMENTS = [
     ('limit', 50, int),
 ]
 
-class BlacklistHandler(tornado.web.RequestHandler):
+class BlacklistHandler(APIHandler):
+    @gen.coroutine
+    def get(self):
+        yield get_endpoint(self, BLACKLIST_ARGUMENTS, api.blacklist)
+
+SQL_STATS_ARGUMENTS = [
+    ('tag', None, str),
+    ('limit', 50, int),
+]
+
+class SQLStatsHandler(APIHandler):
+    @gen.coroutine
     def get(self):
-        get_endpoint(self, BLACKLIST_ARGUMENTS, api.blacklist)
+        yield get_endpoint(self, SQL_STATS_ARGUMENTS, api.sql_stats)
 
-class NewAlertHandler(tornado.web.RequestHandler):
+class NewAlertHandler(APIHandler):
+    @gen.coroutine
     def post(self):
         response = api.build_response()
         args = {}
@@ -78,12 +132,8 @@ class NewAlertHandler(tornado.web.RequestHandler):
             if args[name] is None:
                 response['error'] += 'ERROR: {} must be specified!\n'.format(name)
         if all(v is not None for v in args.values()):
-            self.write(api.create_alert(args['ldap'],
-                                        args['title'],
-                                        args['description'],
-                                        args['reason']))
-        else:
-            self.write(response)
+            response = yield call_api(self.executor, api.create_alert, **args)
+        self.write(response)
 
 class IndexHandler(tornado.web.RequestHandler):
     def get(self):
@@ -95,17 +145,20 @@ class IndexHandler(tornado.web.RequestHandler):
 class SecuritybotService(object):
     '''Registers handlers and kicks off the HTTPServer and IOLoop'''
 
-    def __init__(self, port):
-        # type: (str, str, bool) -> None
+    def __init__(self, port, max_workers=MAX_WORKERS):
+        # type: (int, int) -> None
         self.requests = 0
         self.port = port
+        self.executor = ThreadPoolExecutor(max_workers)
         static_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'static/')
+        api_args = {'executor': self.executor}
         self._app = tornado.web.Application([
             (r'/', IndexHandler),
-            (r'/api/query', QueryHandler),
-            (r'/api/ignored', IgnoredHandler),
-            (r'/api/blacklist', BlacklistHandler),
-            (r'/api/create', NewAlertHandler),
+            (r'/api/query', QueryHandler, api_args),
+            (r'/api/ignored', IgnoredHandler, api_args),
+            (r'/api/blacklist', BlacklistHandler, api_args),
+            (r'/api/create', NewAlertHandler, api_args),
+            (r'/api/sql_stats', SQLStatsHandler, api_args),
         ],
         xsrf_cookie=True,
         static_path=static_path,
@@ -127,6 +180,7 @@ class SecuritybotService(object):
         # type: () -> None
         logging.info('Stopping.')
         self.server.stop()
+        self.executor.shutdown(wait=False)
 
     def get_socket(self):
         # type: () -> Sequence[str]
@@ -139,11 +193,11 @@ def init():
 
     api.init_api()
 
-def main(port):
-    # type: (int) -> None
+def main(port, workers):
+    # type: (int, int) -> None
     logging.info('Starting up!')
     try:
-        service = SecuritybotService(port)
+        service = SecuritybotService(port, workers)
 
         def shutdown():
             logging.info('Shutting down!')
@@ -161,6 +215,8 @@ if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='Securitybot frontent')
     parser.add_argument('--port', dest='port', default='8888', type=int)
+    parser.add_argument('--workers', dest='workers', default=MAX_WORKERS, type=int,
+                        help='Number of threads making database queries.')
     args = parser.parse_args()
 
-    main(args.port)
+    main(args.port, args.workers)
@@ -1,11 +1,22 @@
 #!/usr/bin/env python
+import argparse
+import atexit
 import logging
+import signal
+import sys
 
 from securitybot.bot import SecurityBot
 from securitybot.chat.slack import Slack
 from securitybot.tasker.sql_tasker import SQLTasker
+from securitybot.tasker.sharded_sql_tasker import ShardedSQLTasker
+from securitybot.tasker.memory_tasker import MemoryTasker
 from securitybot.auth.duo import DuoAuth
+from securitybot.blacklist.memory_blacklist import MemoryBlacklist
 from securitybot.sql import init_sql
+import securitybot.ignore_rules as ignore_rules
+import securitybot.ignored_alerts as ignored_alerts
+import securitybot.journal as journal
+import securitybot.write_behind as write_behind
 import duo_client
 
 CONFIG = {}
@@ -14,8 +25,13 @@ DUO_INTEGRATION = 'duo_integration_key'
 DUO_SECRET = 'duo_secret_key'
 DUO_ENDPOINT = 'duo_endpoint'
 REPORTING_CHANNEL = 'some_slack_channel_id'
+JOURNAL_PATH = '/var/lib/securitybot/journal'
 ICON_URL = 'https://dl.dropboxusercontent.com/s/t01pwfrqzbz3gzu/securitybot.png'
 
+def exit_on_sigterm(signum, frame):
+    logging.info('Received SIGTERM, shutting down.')
+    sys.exit(0)
+
 def init():
     # Setup logging
     logging.basicConfig(level=logging.DEBUG,
@@ -23,10 +39,39 @@ def init():
     logging.getLogger('requests').setLevel(logging.WARNING)
     logging.getLogger('usllib3').setLevel(logging.WARNING)
 
-def main():
-    init()
+    # atexit handlers don't run when killed by a signal, so exit normally
+    # on SIGTERM to flush queued writes and close the journal
+    signal.signal(signal.SIGTERM, exit_on_sigterm)
+
+def init_database(args):
     init_sql()
 
+    # Journal writes made while the database is down and replay them once
+    # it's back. Registered first so it's stopped after the write-behind
+    # queue has been flushed into it.
+    if args.journal:
+        journal.start(args.journal)
+        atexit.register(journal.stop)
+
+    # Write task updates in the background, flushing them on exit
+    write_behind.start()
+    atexit.register(write_behind.stop)
+
+    # Delete expired ignores in the background
+    ignored_alerts.start_sweeper()
+    atexit.register(ignored_alerts.stop_sweeper)
+
+def main(args):
+    init()
+    if args.memory:
+        # Keep everything in memory and don't touch the database at all
+        ignored_alerts.use_memory()
+        ignore_rules.use_memory()
+        blacklist = MemoryBlacklist()
+    else:
+        init_database(args)
+        blacklist = None
+
     # Create components needed for Securitybot
     duo_api = duo_client.Auth(
         ikey=DUO_INTEGRATION,
@@ -36,10 +81,35 @@ def main():
     duo_builder = lambda name: DuoAuth(duo_api, name)
 
     chat = Slack('securitybot', SLACK_KEY, ICON_URL)
-    tasker = SQLTasker()
+    if args.memory:
+        tasker = MemoryTasker()
+    elif args.worker is not None:
+        tasker = ShardedSQLTasker(args.worker)
+    else:
+        tasker = SQLTasker()
 
-    sb = SecurityBot(chat, tasker, duo_builder, REPORTING_CHANNEL, 'config/bot.yaml')
-    sb.run()
+    sb = SecurityBot(chat, tasker, duo_builder, REPORTING_CHANNEL, 'config/bot.yaml',
+                     blacklist=blacklist)
+    if args.event_driven:
+        sb.run_event_driven()
+    else:
+        sb.run()
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Securitybot')
+    parser.add_argument('--event-driven', dest='event_driven', action='store_true',
+                        help='Wake the bot only on chat, task, 2FA, and escalation events ' +
+                             'instead of polling in a loop.')
+    parser.add_argument('--worker', dest='worker', default=None,
+                        help='Run as one of several bot workers under this unique name, ' +
+                             'splitting users between all live workers.')
+    parser.add_argument('--memory', dest='memory', action='store_true',
+                        help='Keep tasks, ignores and the blacklist in memory rather than ' +
+                             'the database, e.g. for staging. They are lost on exit.')
+    parser.add_argument('--journal', dest='journal', default=JOURNAL_PATH,
+                        help='Path of the journal for writes made while the database is ' +
+                             'down. Pass an empty path to not journal writes. Defaults to ' +
+                             '{0}.'.format(JOURNAL_PATH))
+    args = parser.parse_args()
+
+    main(args)
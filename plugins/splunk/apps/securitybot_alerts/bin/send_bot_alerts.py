@@ -7,28 +7,21 @@ import logging
 
 import json
 
-from securitybot.sql import SQLEngine, init_sql
-from securitybot.util import create_new_alert
+import securitybot.journal as journal
+from securitybot.sql import init_sql
+from securitybot.util import NewAlert, create_new_alerts
 
-def create_securitybot_task(search_name, hash, username, description, reason, url):
+# Alerts are journaled here while the database is down, to be created by the
+# bot once it's back. Must match the journal path the bot uses.
+JOURNAL_PATH = '/var/lib/securitybot/journal'
+
+def build_securitybot_task(search_name, hash, username, description, reason, url):
     '''
-    Creates a new Maniphest task with the securitybot tag so that the bot can
-    reach out to the relevant people.
+    Builds a new alert for the bot to reach out to the relevant people about.
     '''
     logging.info('Creating new task about {} for {}'.format(description,
                                                             username))
-
-    # Check for collision
-    rows = SQLEngine.execute('SELECT title FROM alerts WHERE hash=UNHEX(%s)', (hash,))
-    if rows:
-        raise CollisionException(
-'''We found a collision with {0} for {1}.
-Most likely the Splunk alert with configured incorrectly.
-However, if this is a geniune collision, then you have a paper to write. Good luck.
-'''.format(rows, hash))
-
-    # Insert that into the database as a new alert
-    create_new_alert(search_name, username, description, reason, url, hash)
+    return NewAlert(search_name, username, description, reason, url, hash)
 
 class CollisionException(Exception):
     pass
@@ -51,20 +44,27 @@ def send_bot_alerts(payload):
     try:
         with gzip.open(results_file, 'rb') as alert_file:
             reader = csv.DictReader(alert_file)
-            for row in reader:
-                # TODO: eventually group by username and concat event_info
-                create_securitybot_task(alert_name,
-                                        row['hash'],
-                                        row['ldap'],
-                                        title,
-                                        row['event_info'],
-                                        splunk_url
-                )
+            # TODO: eventually group by username and concat event_info
+            collisions = create_new_alerts(build_securitybot_task(alert_name,
+                                                                  row['hash'],
+                                                                  row['ldap'],
+                                                                  title,
+                                                                  row['event_info'],
+                                                                  splunk_url)
+                                           for row in reader)
 
     except Exception:
         # Can't fix anything, so just re-raise and move on
         raise
 
+    # Every other alert has been created, so report collisions last
+    if collisions:
+        raise CollisionException(
+'''We found collisions for {0}.
+Most likely the Splunk alert with configured incorrectly.
+However, if this is a geniune collision, then you have a paper to write. Good luck.
+'''.format(collisions))
+
 def main():
     logging.basicConfig(level=logging.INFO,
                         format='%(asctime)s %(levelname)s %(message)s')
@@ -76,8 +76,12 @@ def main():
 
         # initialize SQL
         init_sql()
+        journal.start(JOURNAL_PATH, replay=False)
 
-        send_bot_alerts(payload)
+        try:
+            send_bot_alerts(payload)
+        finally:
+            journal.stop()
 
         logging.info('Alert {} fired successfully.\n'.format(payload['search_name']))
     except Exception as e:
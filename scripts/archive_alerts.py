@@ -0,0 +1,37 @@
+#!/usr/bin/python
+'''
+Moves old closed alerts out of the alerts table into monthly archive tables.
+Meant to be run periodically, e.g. from cron.
+'''
+import argparse
+import logging
+from datetime import timedelta
+
+import securitybot.archive as archive
+from securitybot.sql import SQLEngine
+
+from typing import Any
+
+def main(args):
+    # type: (Any) -> None
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s %(levelname)s] %(message)s')
+    SQLEngine('localhost', 'root', '', 'securitybot')
+
+    archive.archive(timedelta(days=args.age[0]), args.batch_size[0], args.pause[0])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archive old Securitybot alerts')
+
+    parser.add_argument('--age', dest='age', type=int, nargs=1,
+                        default=[archive.ARCHIVE_AGE.days],
+                        help='Archive closed alerts older than this many days. ' +
+                             'Defaults to {0}.'.format(archive.ARCHIVE_AGE.days))
+    parser.add_argument('--batch-size', dest='batch_size', type=int, nargs=1,
+                        default=[archive.ARCHIVE_BATCH_SIZE],
+                        help='Number of alerts to move per transaction.')
+    parser.add_argument('--pause', dest='pause', type=float, nargs=1,
+                        default=[archive.ARCHIVE_PAUSE],
+                        help='Seconds to wait between batches.')
+
+    args = parser.parse_args()
+    main(args)
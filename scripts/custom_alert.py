@@ -4,7 +4,7 @@ Creates a custom Securitybot alert for a specified user.
 '''
 import argparse
 from securitybot.sql import SQLEngine
-from securitybot.util import create_new_alert
+from securitybot.util import NewAlert, create_new_alerts
 
 from typing import Any
 
@@ -12,7 +12,7 @@ def main(args):
     # type: (Any) -> None
     SQLEngine('localhost', 'root', '', 'securitybot')
 
-    create_new_alert('custom_alert', args.name[0], args.title[0], args.reason[0])
+    create_new_alerts([NewAlert('custom_alert', args.name[0], args.title[0], args.reason[0])])
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Send a custom Securitybot alert')
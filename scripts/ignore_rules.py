@@ -0,0 +1,60 @@
+#!/usr/bin/python
+'''
+Manages rules ignoring whole families of Securitybot alerts, e.g. during an
+alert storm. Running bots pick up changes on their next poll.
+'''
+import argparse
+from datetime import timedelta
+
+import securitybot.ignore_rules as ignore_rules
+from securitybot.sql import SQLEngine
+
+from typing import Any
+
+def main(args):
+    # type: (Any) -> None
+    SQLEngine('localhost', 'root', '', 'securitybot')
+
+    if args.command == 'add':
+        ignore_rules.add_rule(args.users, args.title, args.reason,
+                              timedelta(hours=args.hours))
+    elif args.command == 'remove':
+        ignore_rules.remove_rule(args.users, args.title)
+    elif args.command == 'group-add':
+        ignore_rules.add_to_group(args.group, args.name)
+    elif args.command == 'group-remove':
+        ignore_rules.remove_from_group(args.group, args.name)
+    else:
+        for rule in ignore_rules.get_rules():
+            print('{0}\t{1}\t{2}\t{3}'.format(rule.users, rule.title, rule.until, rule.reason))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage Securitybot ignore rules')
+    commands = parser.add_subparsers(dest='command')
+
+    users_help = ('Username the rule applies to, a group name prefixed with ' +
+                  '"{0}", or "{1}" for everyone.'.format(ignore_rules.GROUP_PREFIX,
+                                                         ignore_rules.EVERYONE))
+    title_help = 'Alert title to ignore, which may be a glob such as "okta_*".'
+
+    add = commands.add_parser('add', help='Add or replace a rule.')
+    add.add_argument('users', help=users_help)
+    add.add_argument('title', help=title_help)
+    add.add_argument('reason', help='Why matching alerts are ignored.')
+    add.add_argument('--hours', dest='hours', type=float, default=4,
+                     help='How long to ignore matching alerts for. Defaults to 4.')
+
+    remove = commands.add_parser('remove', help='Remove a rule.')
+    remove.add_argument('users', help=users_help)
+    remove.add_argument('title', help=title_help)
+
+    for name, description in [('group-add', 'Add a user to a group.'),
+                              ('group-remove', 'Remove a user from a group.')]:
+        group = commands.add_parser(name, help=description)
+        group.add_argument('group', help='Group name, without a prefix.')
+        group.add_argument('name', help='Username.')
+
+    commands.add_parser('list', help='List unexpired rules.')
+
+    args = parser.parse_args()
+    main(args)
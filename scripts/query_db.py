@@ -7,7 +7,7 @@ import re
 
 from securitybot.sql import SQLEngine
 
-from typing import Any, Dict, List, Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Sequence
 
 BLACKLIST_QUERY = '''
 SELECT ldap
@@ -17,6 +17,7 @@ FROM blacklist
 IGNORED_QUERY = '''
 SELECT ldap, title, reason, until
 FROM ignored
+WHERE until > NOW()
 '''
 
 IGNORED_FIELDS = ['ldap', 'title', 'reason', 'until']
@@ -34,8 +35,6 @@ SELECT HEX(alerts.hash),
        status,
        event_time
 FROM alerts
-JOIN user_responses ON alerts.hash = user_responses.hash
-JOIN alert_status ON alerts.hash = alert_status.hash
 '''
 
 QUERY_FIELDS = ['hash',
@@ -88,12 +87,12 @@ def main(args):
 def blacklist(args):
     # type: (Any) -> Sequence[Any]
     fields = ['ldap']
-    results = SQLEngine.execute(BLACKLIST_QUERY)
+    results = SQLEngine.iterate(BLACKLIST_QUERY)
     return fields, [list(row) for row in results]
 
 def ignored(alerts):
     # type: (Any) -> Sequence[Any]
-    results = SQLEngine.execute(IGNORED_QUERY)
+    results = SQLEngine.iterate(IGNORED_QUERY)
     return IGNORED_FIELDS, [list(row) for row in results]
 
 def alerts(args):
@@ -129,10 +128,6 @@ def alerts(args):
     query += LIMIT
     params += args.limit
 
-    # Perform query
-    raw_results = SQLEngine.execute(query, params)
-    results = build_query_dict(raw_results)
-
     to_remove = [] # type: List[str]
 
     # Set extra fields to remove
@@ -159,13 +154,11 @@ def alerts(args):
     if args.anon:
         to_remove.append('ldap')
 
-    # Remove columns
-    for row in results:
-        for col in to_remove:
-            row.pop(col, None)
-
-    # Grab list of fields and convert to list of lists
+    # Grab list of fields to keep
     fields = [field for field in QUERY_FIELDS if field not in to_remove]
+
+    # Perform query, streaming rows straight into a list of lists
+    results = build_query_dict(SQLEngine.iterate(query, params))
     matrix = [[row[field] for field in fields] for row in results]
 
     return fields, matrix
@@ -209,9 +202,9 @@ def parse_time(time):
     return int(m.group(1))
 
 def build_query_dict(results):
-    # type: (Sequence[Sequence[Any]]) -> List[Dict[str, Any]]
-    '''Builds a list of dictionaries from the results of a query.'''
-    return [{field: value for field, value in zip(QUERY_FIELDS, row)} for row in results]
+    # type: (Iterable[Sequence[Any]]) -> Iterator[Dict[str, Any]]
+    '''Lazily builds dictionaries from the results of a query.'''
+    return ({field: value for field, value in zip(QUERY_FIELDS, row)} for row in results)
 
 def pretty_print(fields, matrix):
     # type: (List[str], List[List[Any]]) -> None
@@ -0,0 +1,194 @@
+'''
+Archival of closed alerts.
+
+Alerts which have been waiting for verification for longer than some age are
+moved out of `alerts` into monthly archive tables, named after the month of
+their event time, e.g. `alerts_archive_201607`. Each archive table is
+recorded in `alert_archives` along with the range of event times it covers,
+so queries over older time ranges can find the tables they need.
+
+Alerts are moved a batch at a time, each batch in its own short transaction,
+so archiving never holds locks on `alerts` for long.
+'''
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from securitybot.sql import SQLEngine
+from securitybot.tasker.tasker import STATUS_LEVELS
+import securitybot.migrations as migrations
+
+from typing import Any, Dict, List, Tuple
+
+# Alerts which have been closed for longer than this are archived
+ARCHIVE_AGE = timedelta(days=90)
+# Number of alerts to move per transaction
+ARCHIVE_BATCH_SIZE = 500
+# Seconds to wait between batches, letting other writers in
+ARCHIVE_PAUSE = 0.1
+
+ARCHIVE_TABLE_FORMAT = 'alerts_archive_{0:%Y%m}'
+
+# Columns copied into archive tables, in order
+ARCHIVE_COLUMNS = ['hash', 'ldap', 'title', 'description', 'reason', 'url', 'event_time',
+                   'seq', 'status', 'comment', 'performed', 'authenticated']
+
+CREATE_ARCHIVE_TABLE = '''
+CREATE TABLE IF NOT EXISTS {0} (
+    hash BINARY(32) NOT NULL,
+    ldap VARCHAR(255) NOT NULL,
+    title VARCHAR(255) NOT NULL,
+    description VARCHAR(255) NOT NULL,
+    reason TEXT NOT NULL,
+    url VARCHAR(511) NOT NULL,
+    event_time DATETIME NOT NULL,
+    seq BIGINT UNSIGNED NOT NULL,
+    status TINYINT UNSIGNED NOT NULL,
+    comment TEXT,
+    performed BOOL,
+    authenticated BOOL,
+    PRIMARY KEY ( hash )
+)
+'''
+
+GET_ARCHIVES = '''
+SELECT table_name, start_time, end_time
+FROM alert_archives
+'''
+
+GET_ARCHIVABLE = '''
+SELECT HEX(hash), event_time
+FROM alerts
+WHERE status = %s
+AND event_time < %s
+ORDER BY seq
+LIMIT %s
+'''
+
+COPY_TO_ARCHIVE = '''
+INSERT INTO {0} ({1})
+SELECT {1}
+FROM alerts
+WHERE hash IN ({2})
+AND status = %s
+'''
+
+DELETE_ARCHIVED = '''
+DELETE FROM alerts
+WHERE hash IN ({0})
+AND status = %s
+'''
+
+def month_range(time):
+    # type: (datetime) -> Tuple[datetime, datetime]
+    '''Returns the start of the month containing a time and of the next month.'''
+    start = datetime(time.year, time.month, 1)
+    if time.month == 12:
+        end = datetime(time.year + 1, 1, 1)
+    else:
+        end = datetime(time.year, time.month + 1, 1)
+    return start, end
+
+def get_archives(after=None, before=None):
+    # type: (datetime, datetime) -> List[str]
+    '''
+    Returns the names of all archive tables which may hold alerts with event
+    times in a range.
+
+    Args:
+        after (datetime): An optional lower bound on event times.
+        before (datetime): An optional upper bound on event times.
+    '''
+    tables = []
+    for table, start, end in SQLEngine.execute(GET_ARCHIVES, tag='archive'):
+        if after is not None and end <= after:
+            continue
+        if before is not None and start > before:
+            continue
+        tables.append(table)
+    return sorted(tables)
+
+def ensure_archive(time):
+    # type: (datetime) -> str
+    '''
+    Creates the archive table for the month containing a time if it doesn't
+    already exist.
+
+    Returns:
+        str: The name of the archive table.
+    '''
+    start, end = month_range(time)
+    table = ARCHIVE_TABLE_FORMAT.format(start)
+    SQLEngine.execute(CREATE_ARCHIVE_TABLE.format(table), tag='archive', idempotent=True)
+    migrations.add_index(table, table + '_event_time_idx', ['event_time'])
+    migrations.add_index(table, table + '_ldap_idx', ['ldap'])
+    on_duplicate = SQLEngine.dialect().on_duplicate(['table_name'], [])
+    SQLEngine.execute('''
+    INSERT INTO alert_archives (table_name, start_time, end_time)
+    VALUES (%s, %s, %s)
+    {0}
+    '''.format(on_duplicate), (table, start, end), tag='archive', idempotent=True)
+    return table
+
+def archive_batch(cutoff, batch_size=ARCHIVE_BATCH_SIZE, tables=None):
+    # type: (datetime, int, Dict[str, str]) -> int
+    '''
+    Moves one batch of closed alerts older than a cutoff into the archive.
+
+    Args:
+        cutoff (datetime): Alerts with event times before this are archived.
+        batch_size (int): The maximum number of alerts to move.
+        tables (Dict[str, str]): Archive tables known to exist, by month.
+            Updated with any tables created.
+    Returns:
+        int: The number of alerts found to archive. Zero means there are none left.
+    '''
+    if tables is None:
+        tables = {}
+    rows = SQLEngine.execute(GET_ARCHIVABLE,
+                             (STATUS_LEVELS.VERIFICATION, cutoff, batch_size), tag='archive')
+    if not rows:
+        return 0
+
+    # Group hashes by the archive table they belong in
+    by_table = OrderedDict() # type: OrderedDict[str, List[str]]
+    for hsh, event_time in rows:
+        month = '{0:%Y%m}'.format(event_time)
+        if month not in tables:
+            tables[month] = ensure_archive(event_time)
+        by_table.setdefault(tables[month], []).append(hsh)
+
+    columns = ', '.join(ARCHIVE_COLUMNS)
+    with SQLEngine.transaction(tag='archive') as txn:
+        for table, hashes in by_table.items():
+            hash_in = ','.join(['UNHEX(%s)' for _ in hashes])
+            params = list(hashes) # type: List[Any]
+            params.append(STATUS_LEVELS.VERIFICATION)
+            txn.execute(COPY_TO_ARCHIVE.format(table, columns, hash_in), params)
+            txn.execute(DELETE_ARCHIVED.format(hash_in), params)
+    return len(rows)
+
+def archive(age=ARCHIVE_AGE, batch_size=ARCHIVE_BATCH_SIZE, pause=ARCHIVE_PAUSE):
+    # type: (timedelta, int, float) -> int
+    '''
+    Moves all closed alerts older than some age into the archive.
+
+    Args:
+        age (timedelta): Alerts with event times older than this are archived.
+        batch_size (int): The maximum number of alerts to move per transaction.
+        pause (float): Seconds to wait between batches.
+    Returns:
+        int: The number of alerts archived.
+    '''
+    cutoff = datetime.utcnow() - age
+    tables = {} # type: Dict[str, str]
+    total = 0
+    while True:
+        moved = archive_batch(cutoff, batch_size, tables)
+        total += moved
+        if moved < batch_size:
+            break
+        time.sleep(pause)
+    logging.info('Archived {0} alerts.'.format(total))
+    return total
@@ -41,3 +41,11 @@ class Blacklist(object):
             name (str): The name to remove from the blacklist.
         '''
         pass
+
+    def refresh(self):
+        # type: () -> None
+        '''
+        Picks up changes made to the blacklist elsewhere. Does nothing unless
+        the blacklist is shared. Should be called periodically.
+        '''
+        pass
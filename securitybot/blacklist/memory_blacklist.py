@@ -0,0 +1,44 @@
+'''
+A blacklist kept only in memory, for running without a database.
+'''
+from securitybot.blacklist.blacklist import Blacklist
+
+from typing import Set
+
+class MemoryBlacklist(Blacklist):
+    def __init__(self):
+        # type: () -> None
+        '''
+        Creates a new, empty blacklist. Names added are lost on exit.
+        '''
+        self._blacklist = set() # type: Set[str]
+
+    def is_present(self, name):
+        # type: (str) -> bool
+        '''
+        Checks if a name is on the blacklist.
+
+        Args:
+            name (str): The name to check.
+        '''
+        return name in self._blacklist
+
+    def add(self, name):
+        # type: (str) -> None
+        '''
+        Adds a name to the blacklist.
+
+        Args:
+            name (str): The name to add to the blacklist.
+        '''
+        self._blacklist.add(name)
+
+    def remove(self, name):
+        # type: (str) -> None
+        '''
+        Removes a name from the blacklist.
+
+        Args:
+            name (str): The name to remove from the blacklist.
+        '''
+        self._blacklist.discard(name)
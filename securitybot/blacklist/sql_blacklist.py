@@ -4,19 +4,65 @@ A MySQL-based blacklist class.
 __author__ = 'Alex Bertsch'
 __email__ = 'abertsch@dropbox.com'
 
+import logging
+
 from securitybot.blacklist.blacklist import Blacklist
 from securitybot.sql import SQLEngine
 
+from typing import Set
+
+GET_VERSION = 'SELECT version FROM blacklist_version'
+
+# Changes are logged by triggers on the blacklist table, see migrations.py
+GET_CHANGES = '''
+SELECT version, ldap, present
+FROM blacklist_changes
+WHERE version > %s
+ORDER BY version
+'''
+
 class SQLBlacklist(Blacklist):
     def __init__(self):
         # type: () -> None
         '''
         Creates a new blacklist tied to a table named "blacklist".
         '''
-        # Load from table
-        names = SQLEngine.execute('SELECT * FROM blacklist')
-        # Break tuples into names
-        self._blacklist = {name[0] for name in names}
+        self._blacklist = set() # type: Set[str]
+        # Version of the blacklist held in memory
+        self._version = 0
+        self._load()
+
+    def _load(self):
+        # type: () -> None
+        '''Loads the whole blacklist along with its version.'''
+        with SQLEngine.transaction(read_only=True, tag='blacklist') as txn:
+            version = txn.execute(GET_VERSION)[0][0]
+            # Break tuples into names
+            names = {row[0] for row in txn.execute('SELECT ldap FROM blacklist')}
+        self._blacklist = names
+        self._version = version
+
+    def refresh(self):
+        # type: () -> None
+        '''
+        Applies changes made since the blacklist was last refreshed, by this
+        or any other process. Only checks the version if nothing has changed.
+        '''
+        version = SQLEngine.execute(GET_VERSION, tag='blacklist')[0][0]
+        if version == self._version:
+            return
+        changes = SQLEngine.execute(GET_CHANGES, (self._version,), tag='blacklist')
+        if not changes or changes[0][0] != self._version + 1:
+            # The changes we need have been deleted from the log
+            logging.info('Reloading blacklist from version {0}.'.format(self._version))
+            self._load()
+            return
+        for change_version, name, present in changes:
+            if present:
+                self._blacklist.add(name)
+            else:
+                self._blacklist.discard(name)
+            self._version = change_version
 
     def is_present(self, name):
         # type: (str) -> bool
@@ -37,7 +83,7 @@ class SQLBlacklist(Blacklist):
             name (str): The name to add to the blacklist.
         '''
         self._blacklist.add(name)
-        SQLEngine.execute('INSERT INTO blacklist (ldap) VALUES (%s)', (name,))
+        SQLEngine.execute('INSERT INTO blacklist (ldap) VALUES (%s)', (name,), tag='blacklist')
 
     def remove(self, name):
         # type: (str) -> None
@@ -48,4 +94,5 @@ class SQLBlacklist(Blacklist):
             name (str): The name to remove from the blacklist.
         '''
         self._blacklist.remove(name)
-        SQLEngine.execute('DELETE FROM blacklist WHERE ldap = %s', (name,))
+        SQLEngine.execute('DELETE FROM blacklist WHERE ldap = %s', (name,), tag='blacklist',
+                          idempotent=True)
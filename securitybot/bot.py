@@ -8,6 +8,8 @@ __email__ = 'abertsch@dropbox.com'
 import logging
 from securitybot.user import User
 import time
+from collections import OrderedDict
+from itertools import islice
 from datetime import datetime, timedelta
 import pytz
 import shlex
@@ -15,15 +17,26 @@ import yaml
 import string
 
 import securitybot.commands as bot_commands
+import securitybot.ignore_rules as ignore_rules
+import securitybot.ignored_alerts as ignored_alerts
+import securitybot.write_behind as write_behind
+from securitybot.blacklist.blacklist import Blacklist
 from securitybot.blacklist.sql_blacklist import SQLBlacklist
 from securitybot.chat.chat import Chat
 from securitybot.tasker.tasker import Task, Tasker
 from securitybot.auth.auth import Auth
+from securitybot.event_loop import BotEventLoop
+from securitybot.scheduler import DeadlineScheduler
+from securitybot.sql import SQLEngine, SQLEngineException
 
-from typing import Any, Callable, Dict, List, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple
 
 TASK_POLL_TIME = timedelta(minutes=1)
 REPORTING_TIME = timedelta(hours=1)
+# Number of in progress tasks to recover at a time on startup
+RECOVERY_BATCH_SIZE = 500
+# Number of statements taking the most database time to report on
+REPORTED_QUERIES = 5
 
 DEFAULT_COMMAND = {
     'fn': lambda b, u, a: logging.warn('No function provided for this command.'),
@@ -68,8 +81,9 @@ class SecurityBot(object):
     It's always dangerous naming classes the same name as the project...
     '''
 
-    def __init__(self, chat, tasker, auth_builder, reporting_channel, config_path):
-        # type: (Chat, Tasker, Callable[[str], Auth], str, str) -> None
+    def __init__(self, chat, tasker, auth_builder, reporting_channel, config_path,
+                 blacklist=None):
+        # type: (Chat, Tasker, Callable[[str], Auth], str, str, Blacklist) -> None
         '''
         Args:
             chat (Chat): The chat object to use for messaging.
@@ -78,6 +92,8 @@ class SecurityBot(object):
                                  It should take in only a username as a parameter.
             reporting_channel (str): Channel ID to report alerts in need of verification to.
             config_path (str): Path to configuration file
+            blacklist (Blacklist): The blacklist to use. Defaults to the one
+                                   in SQL.
         '''
         logging.info('Creating securitybot.')
         self.tasker = tasker
@@ -92,7 +108,7 @@ class SecurityBot(object):
         chat.connect()
 
         # Load blacklist from SQL
-        self.blacklist = SQLBlacklist()
+        self.blacklist = blacklist if blacklist is not None else SQLBlacklist()
 
         # A dictionary to be populated with all members of the team
         self.users = {} # type: Dict[str, User]
@@ -102,6 +118,18 @@ class SecurityBot(object):
         # Dictionary of users who have outstanding tasks
         self.active_users = {} # type: Dict[str, User]
 
+        # Escalation deadlines of active users, keyed by user ID
+        self.escalations = DeadlineScheduler()
+
+        # IDs of active users who need to be stepped on the next pass
+        self.dirty_users = set() # type: Set[str]
+        # IDs of active users with an outstanding 2FA request
+        self.auth_users = set() # type: Set[str]
+
+        # Number of user steps skipped on the last pass and in total
+        self.skipped_steps = 0
+        self.total_skipped_steps = 0
+
         # Recover tasks
         self.recover_in_progress_tasks()
 
@@ -174,13 +202,43 @@ class SecurityBot(object):
             now = datetime.now(tz=pytz.utc)
             if now - self._last_task_poll > TASK_POLL_TIME:
                 self._last_task_poll = now
-                self.handle_new_tasks()
-                self.handle_in_progress_tasks()
-                self.handle_verifying_tasks()
+                self.handle_tasks()
+            self.handle_reporting()
             self.handle_messages()
             self.handle_users()
             time.sleep(.1)
 
+    def run_event_driven(self):
+        # type: () -> None
+        '''
+        Event-driven main loop for the bot. Rather than polling on a fixed
+        interval, the bot sleeps until a message arrives, tasks need to be
+        polled, a 2FA request needs checking, or an escalation deadline passes.
+        '''
+        BotEventLoop(self, TASK_POLL_TIME).start()
+
+    def handle_tasks(self):
+        # type: () -> None
+        '''
+        Polls the tasker for new, in progress, and verifying tasks. If the
+        database can't be reached, the poll is skipped so the bot can keep
+        talking to users until the next one. Ignores, ignore rules and
+        blacklist changes made elsewhere are picked up first, so they apply
+        to the new tasks.
+        '''
+        try:
+            ignored_alerts.refresh()
+            ignore_rules.refresh()
+            self.blacklist.refresh()
+        except SQLEngineException as e:
+            logging.warn('Unable to refresh ignored alerts and blacklist: {0}'.format(e))
+        try:
+            self.handle_new_tasks()
+            self.handle_in_progress_tasks()
+            self.handle_verifying_tasks()
+        except SQLEngineException as e:
+            logging.error('Skipping task poll: {0}'.format(e))
+
     def handle_messages(self):
         # type: () -> None
         '''
@@ -194,6 +252,10 @@ class SecurityBot(object):
             text = message['text']
             user = self.user_lookup(user_id)
 
+            # Leave users belonging to another bot worker to that worker
+            if user_id not in self.active_users and not self.tasker.owns(user['name']):
+                continue
+
             # Parse each received line as a command, otherwise send an error message
             if self.is_command(text):
                 self.handle_command(user, text)
@@ -208,7 +270,12 @@ class SecurityBot(object):
         key, args = self.parse_command(command)
         logging.info('Handling command {0} for {1}'.format(key, user['name']))
         cmd = self.commands[key]
-        if cmd['fn'](self, user, args):
+        try:
+            success = cmd['fn'](self, user, args)
+        except SQLEngineException as e:
+            logging.error('Command {0} failed: {1}'.format(key, e))
+            success = False
+        if success:
             if cmd['success_msg']:
                 self.chat.message_user(user, cmd['success_msg'])
         else:
@@ -229,46 +296,67 @@ class SecurityBot(object):
             logging.warn('{}'.format(e))
             return False
 
-    def _add_task(self, task):
-        # type: (Task) -> None
+    def _add_tasks(self, tasks):
+        # type: (Iterable[Task]) -> None
         '''
-        Adds a new task to the user specified by that task.
+        Adds new tasks to the users specified by those tasks. Status changes
+        are made for all of the tasks at once.
 
         Args:
-            task (Task): the task to add.
-        '''
-        username = task.username
-        if self.valid_user(username):
-            # Ignore blacklisted users
-            if self.blacklist.is_present(username):
-                logging.info('Ignoring task for blacklisted {0}'.format(username))
-                task.comment = 'blacklisted'
-                task.set_verifying()
+            tasks (Iterable[Task]): the tasks to add.
+        '''
+        to_verify = [] # type: List[Task]
+        tasks_by_user = OrderedDict() # type: Dict[str, List[Task]]
+        for task in tasks:
+            username = task.username
+            if self.valid_user(username):
+                # Ignore blacklisted users
+                if self.blacklist.is_present(username):
+                    logging.info('Ignoring task for blacklisted {0}'.format(username))
+                    task.comment = 'blacklisted'
+                    to_verify.append(task)
+                else:
+                    tasks_by_user.setdefault(username, []).append(task)
             else:
-                user = self.user_lookup_by_name(username)
-                user_id = user['id']
-                if user_id not in self.active_users:
-                    logging.debug('Adding {} to active users'.format(username))
-                    self.active_users[user_id] = user
-                    self.greet_user(user)
-                user.add_task(task)
-                task.set_in_progress()
-        else:
-            # Escalate if no valid user is found
-            logging.warn('Invalid user: {0}'.format(username))
-            task.comment = 'invalid user'
-            task.set_verifying()
+                # Escalate if no valid user is found
+                logging.warn('Invalid user: {0}'.format(username))
+                task.comment = 'invalid user'
+                to_verify.append(task)
+
+        if to_verify:
+            self.tasker.set_verifying(to_verify)
+
+        in_progress = [task for user_tasks in tasks_by_user.values() for task in user_tasks]
+        if in_progress:
+            self.tasker.set_in_progress(in_progress)
+
+        # Look up ignored alerts for every user in the batch at once
+        try:
+            ignored = ignored_alerts.get_ignored_for_users(tasks_by_user.keys())
+        except SQLEngineException as e:
+            logging.warn('Unable to look up ignored alerts: {0}'.format(e))
+            ignored = {username: {} for username in tasks_by_user}
+
+        for username, user_tasks in tasks_by_user.items():
+            user = self.user_lookup_by_name(username)
+            user_id = user['id']
+            if user_id not in self.active_users:
+                logging.debug('Adding {} to active users'.format(username))
+                self.active_users[user_id] = user
+                self.greet_user(user)
+            user.add_tasks(user_tasks, ignored[username])
 
     def handle_new_tasks(self):
         # type: () -> None
         '''
         Handles all new tasks.
         '''
-        for task in self.tasker.get_new_tasks():
+        tasks = self.tasker.get_new_tasks()
+        for task in tasks:
             # Log new task
             logging.info('Handling new task for {0}'.format(task.username))
 
-            self._add_task(task)
+        self._add_tasks(tasks)
 
     def handle_in_progress_tasks(self):
         # type: () -> None
@@ -282,11 +370,16 @@ class SecurityBot(object):
         '''
         Recovers in progress tasks from a previous run.
         '''
-        for task in self.tasker.get_active_tasks():
-            # Log new task
-            logging.info('Recovering task for {0}'.format(task.username))
+        tasks = self.tasker.iter_active_tasks()
+        while True:
+            batch = list(islice(tasks, RECOVERY_BATCH_SIZE))
+            if not batch:
+                break
+            for task in batch:
+                # Log new task
+                logging.info('Recovering task for {0}'.format(task.username))
 
-            self._add_task(task)
+            self._add_tasks(batch)
 
 
     def handle_verifying_tasks(self):
@@ -296,14 +389,96 @@ class SecurityBot(object):
         '''
         pass
 
-    def handle_users(self):
+    def handle_users(self, poll_auth=True):
+        # type: (bool) -> bool
+        '''
+        Handles all users that may be able to make progress: those marked as
+        dirty, those whose escalation deadline has passed, and optionally
+        those waiting on 2FA. All other users are waiting on a reply and are
+        skipped.
+
+        Args:
+            poll_auth (bool): Whether to step users waiting on 2FA.
+        Returns:
+            (bool): Whether any user changed state, in which case the users
+                    should be stepped again.
+        '''
+        to_step = self.dirty_users
+        self.dirty_users = set()
+        to_step.update(self.escalations.pop_due(datetime.now(tz=pytz.utc)))
+        if poll_auth:
+            to_step.update(self.auth_users)
+
+        changed = False
+        for user_id in to_step:
+            user = self.active_users.get(user_id)
+            if user is None:
+                continue
+            if user.step():
+                changed = True
+                self.dirty_users.add(user_id)
+            if user.waiting_on_auth():
+                self.auth_users.add(user_id)
+            else:
+                self.auth_users.discard(user_id)
+
+        self.skipped_steps = max(len(self.active_users) - len(to_step), 0)
+        self.total_skipped_steps += self.skipped_steps
+        return changed
+
+    def mark_dirty(self, user):
+        # type: (User) -> None
+        '''
+        Marks a user as needing to be stepped, e.g. because they responded or
+        were given a new task.
+        '''
+        self.dirty_users.add(user['id'])
+
+    def handle_reporting(self):
         # type: () -> None
         '''
-        Handles all users.
+        Periodically logs statistics about the bot's workload.
         '''
-        for user_id in self.active_users.keys():
-            user = self.active_users[user_id]
-            user.step()
+        now = datetime.now(tz=pytz.utc)
+        if now - self._last_report > REPORTING_TIME:
+            self._last_report = now
+            logging.info('{0} active users, {1} user steps skipped since last report'
+                         .format(len(self.active_users), self.total_skipped_steps))
+            logging.info('Write-behind queue: {0}'.format(write_behind.stats()))
+            for stats in SQLEngine.stats()[:REPORTED_QUERIES]:
+                logging.info('Query from {tag}: {count} runs, {total_time:.3f}s total, '
+                             '{max_time:.3f}s max, {rows} rows: {fingerprint}'.format(**stats))
+            self.total_skipped_steps = 0
+
+    def schedule_escalation(self, user, deadline):
+        # type: (User, datetime) -> None
+        '''
+        Schedules a user to be woken up once their pending task should be
+        auto-escalated.
+
+        Args:
+            user (User): The user to wake up.
+            deadline (datetime): The time after which to escalate.
+        '''
+        self.escalations.schedule(user['id'], deadline)
+
+    def cancel_escalation(self, user):
+        # type: (User) -> None
+        '''Cancels any scheduled escalation for a user.'''
+        self.escalations.cancel(user['id'])
+
+    def next_escalation_time(self):
+        # type: () -> datetime
+        '''
+        Returns the earliest time at which an active user's pending task will
+        be auto-escalated, or None if there are no pending escalations.
+        '''
+        return self.escalations.next_deadline()
+
+    def needs_auth_poll(self):
+        # type: () -> bool
+        '''Checks if any active user is waiting on a 2FA response.'''
+        return bool(self.auth_users)
 
     def cleanup_user(self, user):
         # type: (User) -> None
@@ -313,6 +488,9 @@ class SecurityBot(object):
         '''
         logging.debug('Removing {} from active users'.format(user['name']))
         self.active_users.pop(user['id'], None)
+        self.escalations.cancel(user['id'])
+        self.dirty_users.discard(user['id'])
+        self.auth_users.discard(user['id'])
 
     def alert_user(self, user, task):
         # type: (User, Task) -> None
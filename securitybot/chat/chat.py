@@ -22,6 +22,18 @@ class Chat(object):
         '''Connects to the chat system.'''
         pass
 
+    def fileno(self):
+        # type: () -> int
+        '''
+        Returns a file descriptor that becomes readable whenever new messages
+        may be available, which allows an event loop to sleep until the chat
+        system has something for the bot. Chat systems that can only be
+        polled should return None. A chat system whose connection drops
+        should raise a ChatException from `get_messages`, after which it's
+        reconnected and this is called again.
+        '''
+        return None
+
     @abstractmethod
     def get_users(self):
         # type: () -> List[Dict[str, Any]]
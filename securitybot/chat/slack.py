@@ -5,7 +5,9 @@ __author__ = 'Alex Bertsch'
 __email__ = 'abertsch@dropbox.com'
 
 import logging
+import socket
 from slackclient import SlackClient
+from websocket import WebSocketException
 import json
 
 from securitybot.user import User
@@ -67,6 +69,11 @@ class Slack(Chat):
         else:
             raise ChatException('Unable to start Slack RTM session')
 
+    def fileno(self):
+        # type: () -> int
+        '''Returns the file descriptor of the RTM websocket.'''
+        return self._slack.server.websocket.fileno()
+
     def get_users(self):
         # type: () -> List[Dict[str, Any]]
         '''
@@ -99,7 +106,10 @@ class Slack(Chat):
             "text": The text of the received message.
         }
         '''
-        events = self._slack.rtm_read()
+        try:
+            events = self._slack.rtm_read()
+        except (WebSocketException, socket.error) as e:
+            raise ChatException('Lost Slack RTM connection: {0}'.format(e))
         messages = [e for e in events if e['type'] == 'message']
         return [m for m in messages if 'user' in m and m['channel'].startswith('D')]
 
@@ -11,7 +11,7 @@ import re
 from datetime import timedelta
 
 import securitybot.ignored_alerts as ignored_alerts
-from securitybot.util import create_new_alert
+from securitybot.util import NewAlert
 
 def hi(bot, user, args):
     '''Says hello to a user.'''
@@ -94,6 +94,7 @@ def ignore(bot, user, args):
 
 def test(bot, user, args):
     '''Creates a new test alert in Maniphest for a user.'''
-    create_new_alert('testing_alert', user['name'], 'Testing alert', 'Testing Securitybot')
+    bot.tasker.add_alerts([NewAlert('testing_alert', user['name'], 'Testing alert',
+                                    'Testing Securitybot')])
 
     return True
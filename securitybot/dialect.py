@@ -0,0 +1,344 @@
+'''
+SQL dialects for the databases SQLEngine can run on.
+
+Queries throughout securitybot are written in the subset of SQL shared by
+MySQL and SQLite, using `%s` placeholders. The few constructs that differ
+between the two, such as upserts and date arithmetic, are built by the
+dialect in use. The SQLite dialect also provides the MySQL functions that
+queries rely on (UNHEX, NOW and FROM_UNIXTIME), so a single-node deployment
+can run without a MySQL server.
+'''
+import re
+import sqlite3
+from abc import ABCMeta, abstractmethod
+from datetime import datetime
+
+from typing import Any, List, Sequence, Tuple, Type
+
+class Dialect(object):
+    '''
+    A database driver along with the SQL syntax it understands.
+    '''
+    __metaclass__ = ABCMeta
+
+    # A human readable name for the database
+    name = None # type: str
+    # Base class of all errors raised by the driver
+    Error = Exception # type: Type[Exception]
+    # Errors which may mean a connection was lost; see `lost_connection`
+    lost_connection_errors = () # type: Tuple[Type[Exception], ...]
+
+    def lost_connection(self, e):
+        # type: (Exception) -> bool
+        '''
+        Returns whether a driver error means the connection was lost, so it
+        should be discarded and the statement retried on a fresh one.
+        '''
+        return isinstance(e, self.lost_connection_errors)
+
+    def deadlock(self, e):
+        # type: (Exception) -> bool
+        '''
+        Returns whether a driver error means a statement was rolled back to
+        resolve lock contention, so its transaction may be tried again.
+        '''
+        return False
+
+    @abstractmethod
+    def connect(self):
+        # type: () -> Any
+        '''
+        Opens a new connection in autocommit mode.
+        '''
+        pass
+
+    def ping(self, conn):
+        # type: (Any) -> None
+        '''
+        Checks that a connection is still usable, raising an error if not.
+        '''
+        pass
+
+    def prepare(self, query):
+        # type: (str) -> str
+        '''
+        Converts a query written with `%s` placeholders to the driver's
+        parameter style.
+        '''
+        return query
+
+    def streaming_cursor(self, conn):
+        # type: (Any) -> Any
+        '''
+        Returns a cursor that fetches rows from the server as they're read
+        rather than all at once.
+        '''
+        return conn.cursor()
+
+    def begin(self, read_only=False):
+        # type: (bool) -> str
+        '''
+        Returns a statement starting a transaction.
+        '''
+        return 'START TRANSACTION READ ONLY' if read_only else 'START TRANSACTION'
+
+    @abstractmethod
+    def on_duplicate(self, keys, columns):
+        # type: (Sequence[str], Sequence[str]) -> str
+        '''
+        Returns a clause to follow an INSERT ... VALUES statement, turning
+        rows that collide with an existing row into updates.
+
+        Args:
+            keys (List[str]): The columns of the unique key rows collide on.
+            columns (List[str]): The columns to overwrite with the inserted
+                values. If empty, colliding rows are skipped.
+        '''
+        pass
+
+    @abstractmethod
+    def add_seconds(self, time, seconds):
+        # type: (str, str) -> str
+        '''
+        Returns an expression adding a number of seconds to a datetime.
+
+        Args:
+            time (str): A datetime expression, e.g. `NOW()`.
+            seconds (str): An expression for the number of seconds to add,
+                which may be negative.
+        '''
+        pass
+
+    @abstractmethod
+    def add_column(self, table, column, definition, online=True):
+        # type: (str, str, str, bool) -> str
+        '''
+        Returns a statement adding a column to a table.
+
+        Args:
+            online (bool): Whether the column should be added without
+                blocking reads or writes, where supported.
+        '''
+        pass
+
+    @abstractmethod
+    def add_index(self, table, index, columns, unique=False):
+        # type: (str, str, Sequence[str], bool) -> str
+        '''
+        Returns a statement adding an index to a table without blocking reads
+        or writes, where supported.
+        '''
+        pass
+
+    # Queries taking a table and a column or index name, returning a row if
+    # the column or index exists
+    column_exists = None # type: str
+    index_exists = None # type: str
+
+# MySQL client errors for a connection that couldn't be made or was lost:
+# can't connect, server has gone away, lost connection during query, and
+# lost connection during a packet read
+LOST_CONNECTION_CODES = frozenset([2003, 2006, 2013, 2055])
+# MySQL server errors for a deadlock and a lock wait timeout
+DEADLOCK_CODES = frozenset([1213, 1205])
+
+def _error_code(e):
+    # type: (Exception) -> Any
+    return e.args[0] if e.args else None
+
+class MySQLDialect(Dialect):
+    name = 'MySQL'
+
+    def __init__(self, host, user, passwd, db):
+        # type: (str, str, str, str) -> None
+        '''
+        Args:
+            host (str): The hostname of the SQL server.
+            user (str): The username to use.
+            passwd (str): Password for MySQL user.
+            db (str): The name of the database to connect to.
+        '''
+        # Only needed if MySQL is actually used
+        import MySQLdb
+        import MySQLdb.cursors
+        self._mysql = MySQLdb
+        self._params = {'host': host, 'user': user, 'passwd': passwd, 'db': db}
+        self.Error = MySQLdb.Error
+        # OperationalError also covers deadlocks and some bad statements,
+        # so is narrowed down by error code
+        self.lost_connection_errors = (MySQLdb.OperationalError,)
+
+    def lost_connection(self, e):
+        # type: (Exception) -> bool
+        return (isinstance(e, self.lost_connection_errors) and
+                _error_code(e) in LOST_CONNECTION_CODES)
+
+    def deadlock(self, e):
+        # type: (Exception) -> bool
+        return isinstance(e, self.lost_connection_errors) and _error_code(e) in DEADLOCK_CODES
+
+    def connect(self):
+        # type: () -> Any
+        conn = self._mysql.connect(**self._params)
+        # Single statements commit themselves; units of work that need more
+        # than one statement use SQLEngine.transaction
+        conn.autocommit(True)
+        return conn
+
+    def ping(self, conn):
+        # type: (Any) -> None
+        conn.ping()
+
+    def streaming_cursor(self, conn):
+        # type: (Any) -> Any
+        return conn.cursor(self._mysql.cursors.SSCursor)
+
+    def on_duplicate(self, keys, columns):
+        # type: (Sequence[str], Sequence[str]) -> str
+        if not columns:
+            # MySQL has no way of doing nothing, so update a key to itself
+            return 'ON DUPLICATE KEY UPDATE {0}={0}'.format(keys[0])
+        return 'ON DUPLICATE KEY UPDATE ' + ', '.join(
+            '{0}=VALUES({0})'.format(column) for column in columns)
+
+    def add_seconds(self, time, seconds):
+        # type: (str, str) -> str
+        return 'DATE_ADD({0}, INTERVAL {1} SECOND)'.format(time, seconds)
+
+    def add_column(self, table, column, definition, online=True):
+        # type: (str, str, str, bool) -> str
+        query = 'ALTER TABLE {0} ADD COLUMN {1} {2}'.format(table, column, definition)
+        if online:
+            query += ', ALGORITHM=INPLACE, LOCK=NONE'
+        return query
+
+    def add_index(self, table, index, columns, unique=False):
+        # type: (str, str, Sequence[str], bool) -> str
+        return 'ALTER TABLE {0} ADD {1} {2} ( {3} ), ALGORITHM=INPLACE, LOCK=NONE'.format(
+            table, 'UNIQUE KEY' if unique else 'INDEX', index, ', '.join(columns))
+
+    column_exists = '''
+    SELECT 1
+    FROM information_schema.columns
+    WHERE table_schema = DATABASE()
+    AND table_name = %s
+    AND column_name = %s
+    '''
+
+    index_exists = '''
+    SELECT 1
+    FROM information_schema.statistics
+    WHERE table_schema = DATABASE()
+    AND table_name = %s
+    AND index_name = %s
+    '''
+
+# Format MySQL uses for DATETIME values
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Placeholders and escaped percent signs in a query
+PLACEHOLDER_REGEX = re.compile(r'%[s%]')
+
+def _unhex(value):
+    # type: (str) -> Any
+    return None if value is None else buffer(value.decode('hex'))
+
+# Datetimes are stored in naive UTC, like those written by the rest of
+# securitybot and by MySQL running in UTC
+
+def _now():
+    # type: () -> str
+    return datetime.utcnow().strftime(DATETIME_FORMAT)
+
+def _from_unixtime(timestamp):
+    # type: (float) -> str
+    return None if timestamp is None else \
+        datetime.utcfromtimestamp(float(timestamp)).strftime(DATETIME_FORMAT)
+
+def _convert_datetime(value):
+    # type: (str) -> datetime
+    '''Parses a DATETIME column, with or without fractional seconds.'''
+    if '.' in value:
+        return datetime.strptime(value, DATETIME_FORMAT + '.%f')
+    return datetime.strptime(value, DATETIME_FORMAT)
+
+sqlite3.register_converter('DATETIME', _convert_datetime)
+
+class SQLiteDialect(Dialect):
+    name = 'SQLite'
+    Error = sqlite3.Error
+    # SQLite reports syntax errors as OperationalErrors, and there's no
+    # connection to lose, so nothing is worth retrying
+    lost_connection_errors = ()
+
+    def __init__(self, path, timeout=30):
+        # type: (str, float) -> None
+        '''
+        Args:
+            path (str): Path to the database file. It's created if missing.
+                Every connection to `:memory:` is a separate database, so an
+                on-disk file is needed.
+            timeout (float): Seconds to wait for another connection's write
+                lock before giving up.
+        '''
+        self._path = path
+        self._timeout = timeout
+
+    def connect(self):
+        # type: () -> Any
+        # Connections are handed between threads by the pool, but only ever
+        # used by one thread at a time. isolation_level=None means autocommit.
+        conn = sqlite3.connect(self._path, timeout=self._timeout, isolation_level=None,
+                               detect_types=sqlite3.PARSE_DECLTYPES,
+                               check_same_thread=False)
+        conn.create_function('UNHEX', 1, _unhex)
+        conn.create_function('NOW', 0, _now)
+        conn.create_function('FROM_UNIXTIME', 1, _from_unixtime)
+        # Let readers continue while another connection writes
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def prepare(self, query):
+        # type: (str) -> str
+        return PLACEHOLDER_REGEX.sub(lambda m: '?' if m.group(0) == '%s' else '%', query)
+
+    def begin(self, read_only=False):
+        # type: (bool) -> str
+        # Take the write lock up front, as upgrading a read lock part way
+        # through can fail immediately rather than waiting
+        return 'BEGIN' if read_only else 'BEGIN IMMEDIATE'
+
+    def on_duplicate(self, keys, columns):
+        # type: (Sequence[str], Sequence[str]) -> str
+        target = 'ON CONFLICT ( {0} )'.format(', '.join(keys))
+        if not columns:
+            return target + ' DO NOTHING'
+        return target + ' DO UPDATE SET ' + ', '.join(
+            '{0}=excluded.{0}'.format(column) for column in columns)
+
+    def add_seconds(self, time, seconds):
+        # type: (str, str) -> str
+        return "datetime({0}, {1} || ' seconds')".format(time, seconds)
+
+    def add_column(self, table, column, definition, online=True):
+        # type: (str, str, str, bool) -> str
+        return 'ALTER TABLE {0} ADD COLUMN {1} {2}'.format(table, column, definition)
+
+    def add_index(self, table, index, columns, unique=False):
+        # type: (str, str, Sequence[str], bool) -> str
+        return 'CREATE {0} {1} ON {2} ( {3} )'.format(
+            'UNIQUE INDEX' if unique else 'INDEX', index, table, ', '.join(columns))
+
+    column_exists = '''
+    SELECT 1
+    FROM pragma_table_info(%s)
+    WHERE name = %s
+    '''
+
+    index_exists = '''
+    SELECT 1
+    FROM sqlite_master
+    WHERE type = 'index'
+    AND tbl_name = %s
+    AND name = %s
+    '''
@@ -0,0 +1,170 @@
+'''
+An event-driven main loop for securitybot built on top of Tornado's IOLoop.
+
+Rather than spinning and sleeping, the bot only wakes up when one of its
+event sources fires:
+    * the chat system's connection becomes readable,
+    * the tasker is due to be polled for new tasks,
+    * an outstanding 2FA request needs its status checked, or
+    * a pending task's escalation deadline passes.
+'''
+import logging
+import pytz
+from datetime import datetime, timedelta
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from securitybot.chat.chat import ChatException
+
+from typing import Any
+
+# How often to check on outstanding 2FA requests
+AUTH_POLL_TIME = timedelta(seconds=1)
+# How often to poll chat systems which can't provide a file descriptor
+CHAT_POLL_TIME = timedelta(milliseconds=100)
+
+def to_millis(delta):
+    # type: (timedelta) -> float
+    return delta.total_seconds() * 1000
+
+class BotEventLoop(object):
+    '''
+    Drives a SecurityBot from an IOLoop, making a pass over the bot's dirty
+    users only after something has happened that could change their state.
+    '''
+
+    def __init__(self, bot, task_poll_time, io_loop=None):
+        # type: (Any, timedelta, IOLoop) -> None
+        '''
+        Args:
+            bot (SecurityBot): The bot to drive.
+            task_poll_time (timedelta): How often to poll the bot's tasker.
+            io_loop (IOLoop): An optional IOLoop to use instead of the current one.
+        '''
+        self.bot = bot
+        self.io_loop = io_loop if io_loop is not None else IOLoop.current()
+        self._task_poll_time = task_poll_time
+
+        # Whether a pass over the users has already been scheduled
+        self._wake_scheduled = False
+        # Whether the next pass should check on outstanding 2FA requests
+        self._poll_auth = False
+        # Timeouts for the next escalation deadline and 2FA check
+        self._deadline_timeout = None # type: Any
+        self._deadline = None # type: datetime
+        self._auth_timeout = None # type: Any
+        # File descriptor of the chat connection being watched, if any
+        self._chat_fd = None # type: int
+
+    def start(self):
+        # type: () -> None
+        '''Registers all event sources and runs the IOLoop forever.'''
+        fd = self.bot.chat.fileno()
+        if fd is not None:
+            self._chat_fd = fd
+            self.io_loop.add_handler(fd, self._on_chat_readable, IOLoop.READ)
+        else:
+            logging.info('Chat has no file descriptor, falling back to polling.')
+            PeriodicCallback(self._on_chat_readable, to_millis(CHAT_POLL_TIME),
+                             io_loop=self.io_loop).start()
+
+        PeriodicCallback(self._on_task_poll, to_millis(self._task_poll_time),
+                         io_loop=self.io_loop).start()
+        self.io_loop.add_callback(self._on_task_poll)
+
+        logging.info('Starting event loop.')
+        self.io_loop.start()
+
+    def stop(self):
+        # type: () -> None
+        self.io_loop.stop()
+
+    def wake(self):
+        # type: () -> None
+        '''Schedules a pass over the bot's users, coalescing repeated wake-ups.'''
+        if not self._wake_scheduled:
+            self._wake_scheduled = True
+            self.io_loop.add_callback(self._process_users)
+
+    # Event sources
+
+    def _on_chat_readable(self, *args):
+        # type: (*Any) -> None
+        try:
+            self.bot.handle_messages()
+        except ChatException as e:
+            logging.error('{0}'.format(e))
+            self._reconnect_chat()
+            return
+        self.wake()
+
+    def _reconnect_chat(self):
+        # type: () -> None
+        '''
+        Stops watching a dropped chat connection, which would otherwise stay
+        readable forever, and watches a new one instead. Stops the loop if
+        the chat system can't be reconnected to.
+        '''
+        if self._chat_fd is not None:
+            self.io_loop.remove_handler(self._chat_fd)
+            self._chat_fd = None
+        try:
+            self.bot.chat.connect()
+        except ChatException as e:
+            logging.error('Unable to reconnect to chat, stopping: {0}'.format(e))
+            self.stop()
+            return
+        fd = self.bot.chat.fileno()
+        if fd is not None:
+            self._chat_fd = fd
+            self.io_loop.add_handler(fd, self._on_chat_readable, IOLoop.READ)
+
+    def _on_task_poll(self):
+        # type: () -> None
+        self.bot.handle_tasks()
+        self.bot.handle_reporting()
+        self.wake()
+
+    def _on_auth_poll(self):
+        # type: () -> None
+        self._auth_timeout = None
+        self._poll_auth = True
+        self.wake()
+
+    def _on_deadline(self):
+        # type: () -> None
+        self._deadline_timeout = None
+        self._deadline = None
+        self.wake()
+
+    # Processing
+
+    def _process_users(self):
+        # type: () -> None
+        self._wake_scheduled = False
+        poll_auth, self._poll_auth = self._poll_auth, False
+        if self.bot.handle_users(poll_auth=poll_auth):
+            # Users progress one state per step, so keep going until they settle
+            self.wake()
+        self._arm_deadline()
+        self._arm_auth_poll()
+
+    def _arm_deadline(self):
+        # type: () -> None
+        '''Sets a timeout for the earliest escalation deadline.'''
+        deadline = self.bot.next_escalation_time()
+        if deadline == self._deadline:
+            return
+        if self._deadline_timeout is not None:
+            self.io_loop.remove_timeout(self._deadline_timeout)
+            self._deadline_timeout = None
+        self._deadline = deadline
+        if deadline is not None:
+            delay = (deadline - datetime.now(tz=pytz.utc)).total_seconds()
+            self._deadline_timeout = self.io_loop.call_later(max(delay, 0), self._on_deadline)
+
+    def _arm_auth_poll(self):
+        # type: () -> None
+        '''Sets a timeout to check on 2FA requests if any are outstanding.'''
+        if self._auth_timeout is None and self.bot.needs_auth_poll():
+            self._auth_timeout = self.io_loop.call_later(AUTH_POLL_TIME.total_seconds(),
+                                                         self._on_auth_poll)
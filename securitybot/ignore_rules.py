@@ -0,0 +1,279 @@
+'''
+Ignore rules covering whole families of alerts.
+
+Unlike the ignores in `ignored_alerts`, which are for one user and one alert
+title, a rule applies to everyone, a single user or a group of users, and
+matches titles with a glob such as `okta_*`. Rules are compiled into a trie
+keyed on the literal prefix of each pattern, so matching a title walks it
+once however many rules there are. The trie is rebuilt whenever rules or
+groups change: straight away for changes made by this process, and on the
+next `refresh` for those made elsewhere, which it checks for with a single
+cheap query.
+'''
+import fnmatch
+import logging
+import pytz
+import re
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from securitybot.sql import SQLEngine
+
+from typing import Any, Dict, FrozenSet, List, Set, Tuple
+
+# Users of a rule applying to everyone
+EVERYONE = '*'
+# Prefix of a rule's users naming a group
+GROUP_PREFIX = '@'
+# Characters which start a wildcard in a title pattern
+WILDCARDS = '*?['
+
+IgnoreRule = namedtuple('IgnoreRule', ['users', 'title', 'reason', 'until'])
+
+GET_RULES = '''
+SELECT users, title, reason, until
+FROM ignore_rules
+WHERE until > NOW()
+'''
+
+GET_GROUPS = '''
+SELECT group_name, ldap
+FROM ignore_groups
+'''
+
+# Changes whenever a rule or group member is added, changed or removed
+GET_VERSION = '''
+SELECT (SELECT COUNT(*) FROM ignore_rules),
+       (SELECT MAX(updated) FROM ignore_rules),
+       (SELECT COUNT(*) FROM ignore_groups),
+       (SELECT MAX(updated) FROM ignore_groups)
+'''
+
+DELETE_RULE = '''
+DELETE FROM ignore_rules
+WHERE users = %s AND title = %s
+'''
+
+DELETE_EXPIRED = '''
+DELETE FROM ignore_rules
+WHERE until <= NOW()
+'''
+
+ADD_MEMBER = '''
+INSERT INTO ignore_groups (group_name, ldap, updated)
+VALUES (%s, %s, NOW())
+{0}
+'''
+
+DELETE_MEMBER = '''
+DELETE FROM ignore_groups
+WHERE group_name = %s AND ldap = %s
+'''
+
+def split_pattern(pattern):
+    # type: (str) -> Tuple[str, str]
+    '''
+    Splits a title pattern into its literal prefix and the rest, which is
+    empty for patterns without wildcards.
+    '''
+    for i, c in enumerate(pattern):
+        if c in WILDCARDS:
+            return pattern[:i], pattern[i:]
+    return pattern, ''
+
+class _Node(object):
+    '''A node in the trie of title prefixes.'''
+    __slots__ = ('children', 'exact', 'partial')
+
+    def __init__(self):
+        # type: () -> None
+        self.children = {} # type: Dict[str, _Node]
+        # Rules matching titles which end here
+        self.exact = [] # type: List[Tuple[FrozenSet[str], str, datetime]]
+        # Rules matching titles which continue from here, with a regex the
+        # rest of the title must match, or None if anything may follow
+        self.partial = [] # type: List[Tuple[Any, Tuple[FrozenSet[str], str, datetime]]]
+
+class RuleMatcher(object):
+    '''
+    Finds the rule, if any, ignoring a user's alert. Built once from every
+    rule and group, and then only read.
+    '''
+
+    def __init__(self, rules=(), groups=None):
+        # type: (List[IgnoreRule], Dict[str, Set[str]]) -> None
+        '''
+        Args:
+            rules (List[IgnoreRule]): The rules to match.
+            groups (Dict[str, Set[str]]): The members of each group.
+        '''
+        self._root = _Node()
+        groups = groups or {}
+        for rule in rules:
+            self._add(rule, groups)
+
+    def _add(self, rule, groups):
+        # type: (IgnoreRule, Dict[str, Set[str]]) -> None
+        if rule.users == EVERYONE:
+            users = None
+        elif rule.users.startswith(GROUP_PREFIX):
+            users = frozenset(groups.get(rule.users[len(GROUP_PREFIX):], ()))
+        else:
+            users = frozenset([rule.users])
+        entry = (users, rule.reason, rule.until)
+
+        prefix, rest = split_pattern(rule.title)
+        node = self._root
+        for c in prefix:
+            node = node.children.setdefault(c, _Node())
+        if not rest:
+            node.exact.append(entry)
+        elif rest == '*':
+            node.partial.append((None, entry))
+        else:
+            node.partial.append((re.compile(fnmatch.translate(rest)), entry))
+
+    def match(self, ldap, title, now=None):
+        # type: (str, str, datetime) -> str
+        '''
+        Finds a rule ignoring an alert.
+
+        Args:
+            ldap (str): The user the alert is for.
+            title (str): The alert's title.
+            now (datetime): The current time in naive UTC. Defaults to now.
+        Returns:
+            str: The reason given by a matching rule, or None if none match.
+        '''
+        if now is None:
+            now = datetime.utcnow()
+
+        def applies(entry):
+            # type: (Tuple[FrozenSet[str], str, datetime]) -> bool
+            users, _, until = entry
+            return (users is None or ldap in users) and until > now
+
+        node = self._root
+        for i in range(len(title) + 1):
+            for regex, entry in node.partial:
+                if (regex is None or regex.match(title, i)) and applies(entry):
+                    return entry[1]
+            if i == len(title):
+                break
+            node = node.children.get(title[i])
+            if node is None:
+                return None
+        for entry in node.exact:
+            if applies(entry):
+                return entry[1]
+        return None
+
+# The matcher for the current rules, and the version of the rules it was
+# built from, or None if they haven't been loaded
+_matcher = RuleMatcher()
+_version = None # type: Tuple[Any, ...]
+_lock = threading.Lock()
+# Whether there's no database to load rules from, so none apply
+_memory = False
+
+def use_memory():
+    # type: () -> None
+    '''Applies no rules, for running without a database.'''
+    global _memory
+    _memory = True
+
+def _load(version):
+    # type: (Tuple[Any, ...]) -> None
+    '''Rebuilds the matcher from the database.'''
+    global _matcher, _version
+    rules = [IgnoreRule(*row) for row in SQLEngine.execute(GET_RULES, tag='ignored')]
+    groups = {} # type: Dict[str, Set[str]]
+    for group, ldap in SQLEngine.execute(GET_GROUPS, tag='ignored'):
+        groups.setdefault(group, set()).add(ldap)
+    matcher = RuleMatcher(rules, groups)
+    with _lock:
+        _matcher, _version = matcher, version
+    logging.info('Loaded {0} ignore rules.'.format(len(rules)))
+
+def _get_version():
+    # type: () -> Tuple[Any, ...]
+    return tuple(SQLEngine.execute(GET_VERSION, tag='ignored')[0])
+
+def refresh():
+    # type: () -> None
+    '''
+    Rebuilds the matcher if any rules or groups have changed since it was
+    last built. Should be called periodically.
+    '''
+    if _memory:
+        return
+    version = _get_version()
+    if version != _version:
+        _load(version)
+
+def get_matcher():
+    # type: () -> RuleMatcher
+    '''Returns the matcher for the current rules, loading them on first use.'''
+    if _version is None and not _memory:
+        _load(_get_version())
+    return _matcher
+
+def reset():
+    # type: () -> None
+    '''Forgets the loaded rules, so the next lookup reloads them.'''
+    global _matcher, _version
+    with _lock:
+        _matcher, _version = RuleMatcher(), None
+
+def get_rules():
+    # type: () -> List[IgnoreRule]
+    '''Returns every unexpired rule.'''
+    return [IgnoreRule(*row) for row in SQLEngine.execute(GET_RULES, tag='ignored')]
+
+def add_rule(users, title, reason, ttl):
+    # type: (str, str, str, timedelta) -> None
+    '''
+    Adds a rule, or replaces the rule with the same users and title.
+
+    Args:
+        users (str): The username the rule applies to, a group name prefixed
+            with GROUP_PREFIX, or EVERYONE.
+        title (str): The alert title to ignore, which may be a glob.
+        reason (str): Why matching alerts are ignored.
+        ttl (timedelta): How long to ignore matching alerts for.
+    '''
+    until = datetime.now(tz=pytz.utc) + ttl
+    on_duplicate = SQLEngine.dialect().on_duplicate(['users', 'title'],
+                                                    ['reason', 'until', 'updated'])
+    SQLEngine.execute('''INSERT INTO ignore_rules (users, title, reason, until, updated)
+    VALUES (%s, %s, %s, %s, NOW())
+    {0}
+    '''.format(on_duplicate), (users, title, reason, until.strftime('%Y-%m-%d %H:%M:%S')),
+                      tag='ignored', idempotent=True)
+    _load(_get_version())
+
+def remove_rule(users, title):
+    # type: (str, str) -> None
+    '''Removes the rule with the given users and title.'''
+    SQLEngine.execute(DELETE_RULE, (users, title), tag='ignored', idempotent=True)
+    _load(_get_version())
+
+def add_to_group(group, ldap):
+    # type: (str, str) -> None
+    '''Adds a user to a group.'''
+    on_duplicate = SQLEngine.dialect().on_duplicate(['group_name', 'ldap'], ['updated'])
+    SQLEngine.execute(ADD_MEMBER.format(on_duplicate), (group, ldap), tag='ignored',
+                      idempotent=True)
+    _load(_get_version())
+
+def remove_from_group(group, ldap):
+    # type: (str, str) -> None
+    '''Removes a user from a group.'''
+    SQLEngine.execute(DELETE_MEMBER, (group, ldap), tag='ignored', idempotent=True)
+    _load(_get_version())
+
+def sweep():
+    # type: () -> None
+    '''Deletes expired rules. There are few enough to do in one statement.'''
+    SQLEngine.execute(DELETE_EXPIRED, tag='ignored', idempotent=True)
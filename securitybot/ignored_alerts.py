@@ -1,32 +1,314 @@
 '''
 A small file for keeping track of ignored alerts in the database.
+
+Ignores are read from an in-process cache rather than the database. Ignores
+made by this process are written through to the cache, and ignores made
+elsewhere are picked up by `refresh`, which loads only those changed since
+the last refresh. Expired ignores are dropped from the cache in order of
+expiry using a min-heap.
+
+Readers only look at ignores which haven't expired, so expired rows are
+deleted from the table by a background sweeper rather than on every read.
 '''
+import heapq
+import logging
 import pytz
+import threading
+import time
 from datetime import datetime, timedelta
 from securitybot.sql import SQLEngine
-from typing import Dict
+import securitybot.ignore_rules as ignore_rules
+import securitybot.write_behind as write_behind
+from typing import Dict, Iterable, List, Tuple
+
+# How far back before the newest change seen to look for changes on each
+# refresh, to catch writes which committed out of order
+REFRESH_OVERLAP = timedelta(minutes=1)
+
+# How often to delete expired ignores from the table
+SWEEP_INTERVAL = timedelta(minutes=10)
+# Number of expired ignores to delete per statement
+SWEEP_BATCH_SIZE = 500
+# Seconds to wait between deletes, so the sweeper doesn't hog the table
+SWEEP_PAUSE = 0.1
+
+GET_CHANGED = '''
+SELECT ldap, title, reason, until, updated
+FROM ignored
+WHERE updated >= %s
+AND until > NOW()
+'''
+
+# Oldest first, using the index on until
+GET_EXPIRED = '''
+SELECT ldap, title
+FROM ignored
+WHERE until <= NOW()
+ORDER BY until
+LIMIT %s
+'''
+
+# Formatted with a condition matching each ignore's key. Checks expiry again
+# in case an ignore was extended after being selected.
+DELETE_EXPIRED = '''
+DELETE FROM ignored
+WHERE until <= NOW()
+AND ( {0} )
+'''
+
+def _utcnow():
+    # type: () -> datetime
+    '''Returns the current time in the naive UTC used for `until`.'''
+    return datetime.utcnow()
+
+class IgnoredCache(object):
+    '''
+    Unexpired ignores, indexed by user and then by alert title, along with a
+    heap of when each expires.
+    '''
+
+    def __init__(self):
+        # type: () -> None
+        # Reasons and expiry times of ignored titles for each user
+        self._ignored = {} # type: Dict[str, Dict[str, Tuple[str, datetime]]]
+        # Heap of (expiry time, ldap, title). Entries left behind when an
+        # ignore is extended are skipped when popped.
+        self._expiry = [] # type: List[Tuple[datetime, str, str]]
+        # Newest change loaded from the database, or None if nothing has been
+        self._watermark = None # type: datetime
+        self._lock = threading.Lock()
 
-def __update_ignored_list():
+    def loaded(self):
+        # type: () -> bool
+        '''Returns whether ignores have been loaded from the database.'''
+        return self._watermark is not None
+
+    def put(self, ldap, title, reason, until):
+        # type: (str, str, str, datetime) -> None
+        '''
+        Adds or replaces an ignore.
+
+        Args:
+            until (datetime): When the ignore expires, in naive UTC.
+        '''
+        with self._lock:
+            titles = self._ignored.setdefault(ldap, {})
+            if titles.get(title) == (reason, until):
+                # Refreshes reload recent changes, often ones already seen
+                return
+            titles[title] = (reason, until)
+            heapq.heappush(self._expiry, (until, ldap, title))
+
+    def expire(self, now=None):
+        # type: (datetime) -> int
+        '''
+        Drops ignores which have expired.
+
+        Args:
+            now (datetime): The current time in naive UTC. Defaults to now.
+        Returns:
+            int: The number of ignores dropped.
+        '''
+        if now is None:
+            now = _utcnow()
+        expired = 0
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                until, ldap, title = heapq.heappop(self._expiry)
+                titles = self._ignored.get(ldap, {})
+                # Skip entries for ignores which have since been extended
+                if title in titles and titles[title][1] == until:
+                    del titles[title]
+                    if not titles:
+                        del self._ignored[ldap]
+                    expired += 1
+        return expired
+
+    def get(self, ldap):
+        # type: (str) -> Dict[str, str]
+        '''Returns a mapping of a user's ignored titles to reasons.'''
+        return self.get_many([ldap])[ldap]
+
+    def get_many(self, ldaps):
+        # type: (Iterable[str]) -> Dict[str, Dict[str, str]]
+        '''Returns a mapping of each user to their ignored titles and reasons.'''
+        self.expire()
+        with self._lock:
+            return {ldap: {title: reason for title, (reason, _)
+                           in self._ignored.get(ldap, {}).items()}
+                    for ldap in ldaps}
+
+    def refresh(self):
+        # type: () -> int
+        '''
+        Loads ignores changed in the database since the last refresh, or all
+        of them on the first.
+
+        Returns:
+            int: The number of ignores loaded.
+        '''
+        since = datetime.min
+        if self._watermark is not None and self._watermark > datetime.min + REFRESH_OVERLAP:
+            since = self._watermark - REFRESH_OVERLAP
+        rows = SQLEngine.execute(GET_CHANGED, (since,), tag='ignored')
+        watermark = self._watermark or datetime.min
+        for ldap, title, reason, until, updated in rows:
+            self.put(ldap, title, reason, until)
+            if updated is not None and updated > watermark:
+                watermark = updated
+        self._watermark = watermark
+        self.expire()
+        return len(rows)
+
+# The cache shared by the whole process
+_cache = IgnoredCache()
+# Whether ignores are kept only in the cache, without a database
+_memory = False
+
+def use_memory():
     # type: () -> None
+    '''Keeps ignores only in memory, for running without a database.'''
+    global _memory
+    _memory = True
+
+def reset_cache():
+    # type: () -> None
+    '''Forgets all cached ignores, so the next lookup reloads them.'''
+    global _cache
+    _cache = IgnoredCache()
+
+def sweep_batch(batch_size=SWEEP_BATCH_SIZE):
+    # type: (int) -> int
     '''
-    Prunes the ignored table of old ignored alerts.
+    Deletes one batch of expired ignores from the table.
+
+    Returns:
+        int: The number of expired ignores found. Fewer than `batch_size`
+            means there are none left.
+    '''
+    rows = SQLEngine.execute(GET_EXPIRED, (batch_size,), tag='ignored')
+    if not rows:
+        return 0
+    condition = ' OR '.join(['(ldap = %s AND title = %s)' for _ in rows])
+    params = [value for row in rows for value in row]
+    SQLEngine.execute(DELETE_EXPIRED.format(condition), params, tag='ignored', idempotent=True)
+    return len(rows)
+
+def sweep(batch_size=SWEEP_BATCH_SIZE, pause=SWEEP_PAUSE):
+    # type: (int, float) -> int
+    '''
+    Deletes all expired ignores from the table, a batch at a time.
+
+    Args:
+        batch_size (int): The number of ignores to delete per statement.
+        pause (float): Seconds to wait between batches.
+    Returns:
+        int: The number of expired ignores found.
+    '''
+    total = 0
+    while True:
+        found = sweep_batch(batch_size)
+        total += found
+        if found < batch_size:
+            break
+        time.sleep(pause)
+    if total:
+        logging.info('Swept {0} expired ignores.'.format(total))
+    return total
+
+class IgnoredSweeper(object):
+    '''
+    Periodically sweeps expired ignores and ignore rules from a background
+    thread.
+    '''
+
+    def __init__(self, interval=SWEEP_INTERVAL):
+        # type: (timedelta) -> None
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ignored-sweeper')
+        self._thread.daemon = True
+
+    def start(self):
+        # type: () -> None
+        self._thread.start()
+
+    def stop(self):
+        # type: () -> None
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        # type: () -> None
+        while not self._stopped.wait(self._interval.total_seconds()):
+            try:
+                sweep()
+                ignore_rules.sweep()
+            except Exception:
+                logging.exception('Failed to sweep expired ignores.')
+
+# The sweeper in use, if it's been started
+_sweeper = None # type: IgnoredSweeper
+
+def start_sweeper(interval=SWEEP_INTERVAL):
+    # type: (timedelta) -> None
+    '''Starts deleting expired ignores in the background.'''
+    global _sweeper
+    if _sweeper is None:
+        _sweeper = IgnoredSweeper(interval)
+        _sweeper.start()
+
+def stop_sweeper():
+    # type: () -> None
+    global _sweeper
+    if _sweeper is not None:
+        sweeper, _sweeper = _sweeper, None
+        sweeper.stop()
+
+def refresh():
+    # type: () -> None
     '''
-    SQLEngine.execute('''DELETE FROM ignored WHERE until <= NOW()''')
+    Loads any ignores made by other processes into the cache. Should be
+    called periodically.
+    '''
+    if _memory:
+        return
+    loaded = _cache.refresh()
+    if loaded:
+        logging.debug('Loaded {0} changed ignores.'.format(loaded))
 
 def get_ignored(username):
     # type: (str) -> Dict[str, str]
     '''
     Returns a dictionary of ignored alerts to reasons why
-    the ignored are ignored.
+    the ignored are ignored. Only the first lookup in a process reads the
+    database; after that ignores come from the cache.
 
     Args:
         username (str): The username of the user to retrieve ignored alerts for.
     Returns:
         Dict[str, str]: A mapping of ignored alert titles to reasons
     '''
-    __update_ignored_list()
-    rows = SQLEngine.execute('''SELECT title, reason FROM ignored WHERE ldap = %s''', (username,))
-    return {row[0]: row[1] for row in rows}
+    if not _memory and not _cache.loaded():
+        _cache.refresh()
+    return _cache.get(username)
+
+def get_ignored_for_users(usernames):
+    # type: (Iterable[str]) -> Dict[str, Dict[str, str]]
+    '''
+    Looks up ignored alerts for several users at once. Like `get_ignored`,
+    only the first lookup in a process reads the database, in a single query
+    for every user.
+
+    Args:
+        usernames (Iterable[str]): The usernames to retrieve ignored alerts for.
+    Returns:
+        Dict[str, Dict[str, str]]: A mapping of each username to a mapping
+            of their ignored alert titles to reasons.
+    '''
+    if not _memory and not _cache.loaded():
+        _cache.refresh()
+    return _cache.get_many(usernames)
 
 def ignore_task(username, title, reason, ttl):
     # type: (str, str, str, timedelta) -> None
@@ -42,8 +324,13 @@ def ignore_task(username, title, reason, ttl):
         msg (str): An optional string specifying why an alert was ignored
     '''
     expiry_time = datetime.now(tz=pytz.utc) + ttl
-    # NB: Non-standard MySQL specific query
-    SQLEngine.execute('''INSERT INTO ignored (ldap, title, reason, until)
-    VALUES (%s, %s, %s, %s)
-    ON DUPLICATE KEY UPDATE reason=VALUES(reason), until=VALUES(until)
-    ''', (username, title, reason, expiry_time.strftime('%Y-%m-%d %H:%M:%S')))
+    _cache.put(username, title, reason, expiry_time.replace(tzinfo=None))
+    if _memory:
+        return
+    on_duplicate = SQLEngine.dialect().on_duplicate(['ldap', 'title'],
+                                                    ['reason', 'until', 'updated'])
+    statement = ('''INSERT INTO ignored (ldap, title, reason, until, updated)
+    VALUES (%s, %s, %s, %s, NOW())
+    {0}
+    '''.format(on_duplicate), (username, title, reason, expiry_time.strftime('%Y-%m-%d %H:%M:%S')))
+    write_behind.submit([statement], tag='ignored', idempotent=True)
@@ -0,0 +1,430 @@
+'''
+A local journal for database writes made while the database is down.
+
+Once started, writes that can't reach the database are appended to a file
+instead of being dropped, and a background replayer applies them once the
+database comes back. Records are replayed strictly in the order they were
+appended, and while any are waiting, new writes are journaled behind them
+so nothing is reordered. Several processes may append to the same journal,
+e.g. the bot and the Splunk alert action, but only one should replay it.
+
+Each record is a length and CRC32 checksum followed by a JSON payload.
+Appends are written immediately but only fsynced every `SYNC_INTERVAL`,
+so producers never wait on the disk. A record torn by a crash part way
+through being written fails its checksum and is discarded along with
+anything after it.
+'''
+import fcntl
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from datetime import datetime
+
+from securitybot.sql import SQLEngine, SQLEngineException, SQLEngineUnavailable
+
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+# Longest time, in seconds, appended records may go without being fsynced
+SYNC_INTERVAL = 0.05
+# How often, in seconds, to check for records to replay
+REPLAY_INTERVAL = 1
+# Maximum number of records to replay between reads of the journal
+REPLAY_BATCH_SIZE = 100
+
+# Length of the payload and its CRC32, both unsigned and big-endian
+HEADER = struct.Struct('>II')
+# Format of datetime parameters, which both MySQL and SQLite accept
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+class JournalException(Exception):
+    pass
+
+def _encode_param(value):
+    # type: (Any) -> Any
+    if isinstance(value, datetime):
+        return value.strftime(DATETIME_FORMAT)
+    raise TypeError('Unable to journal parameter {0!r}'.format(value))
+
+def encode_record(statements, tag, idempotent):
+    # type: (Sequence[Tuple[str, Sequence[Any]]], str, bool) -> str
+    '''
+    Encodes a write as a journal record.
+
+    Args:
+        statements (List[Tuple[str, Tuple[str]]]): Pairs of queries and their
+            parameters, to be applied as one transaction.
+        tag (str): The part of securitybot making the write.
+        idempotent (bool): Whether the write is safe to apply twice.
+    Returns:
+        str: The record, including its header.
+    '''
+    payload = json.dumps({
+        'statements': [[query, list(params or ())] for query, params in statements],
+        'tag': tag,
+        'idempotent': idempotent,
+    }, default=_encode_param)
+    return HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff) + payload
+
+def read_records(f, limit):
+    # type: (Any, int) -> Tuple[List[Dict[str, Any]], List[int], bool]
+    '''
+    Reads up to `limit` records from a file's current position, stopping
+    early at the end of the file or the first incomplete or corrupt record.
+
+    Args:
+        f (file): The file to read from.
+        limit (int): The maximum number of records to read.
+    Returns:
+        Tuple[List[Dict], List[int], bool]: The records, the offset in the
+            file just after each one, and whether reading stopped at an
+            incomplete or corrupt record.
+    '''
+    records = [] # type: List[Dict[str, Any]]
+    ends = [] # type: List[int]
+    while len(records) < limit:
+        header = f.read(HEADER.size)
+        if not header:
+            break
+        if len(header) < HEADER.size:
+            return records, ends, True
+        length, crc = HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) & 0xffffffff != crc:
+            return records, ends, True
+        try:
+            records.append(json.loads(payload))
+        except ValueError:
+            return records, ends, True
+        ends.append(f.tell())
+    return records, ends, False
+
+class Journal(object):
+    '''
+    An append-only file of writes waiting to be applied, along with how far
+    it has been replayed. The replay position is kept in a second file next
+    to the journal, which is reset once everything has been replayed.
+    '''
+
+    def __init__(self, path, sync_interval=SYNC_INTERVAL):
+        # type: (str, float) -> None
+        '''
+        Args:
+            path (str): Path to the journal file. It's created if missing.
+            sync_interval (float): Longest time, in seconds, to go without
+                fsyncing appended records.
+        '''
+        self._path = path
+        self._offset_path = path + '.offset'
+        self._sync_interval = sync_interval
+        # Appends always go to the end, even after another process truncates
+        self._file = open(path, 'ab')
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._closed = threading.Event()
+        self._syncer = threading.Thread(target=self._sync_loop, name='journal-sync')
+        self._syncer.daemon = True
+        self._syncer.start()
+
+    def append(self, statements, tag=None, idempotent=False):
+        # type: (Sequence[Tuple[str, Sequence[Any]]], str, bool) -> None
+        '''
+        Appends a write to the journal. Returns without waiting for it to be
+        fsynced, which happens within `sync_interval`.
+
+        Args:
+            statements (List[Tuple[str, Tuple[str]]]): Pairs of queries and
+                their parameters, to be applied as one transaction.
+            tag (str): The part of securitybot making the write.
+            idempotent (bool): Whether the write is safe to apply twice.
+        '''
+        record = encode_record(statements, tag, idempotent)
+        with self._lock:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                # Reset an offset left past the end by a crash, before
+                # appending makes it look like it lands on a record
+                if self._stored_offset() > os.fstat(self._file.fileno()).st_size:
+                    self._write_offset(0)
+                self._file.write(record)
+                self._file.flush()
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._dirty = True
+
+    def sync(self):
+        # type: () -> None
+        '''
+        Fsyncs everything appended so far. The disk is flushed outside the
+        lock, through a duplicate of the file descriptor, so appends don't
+        wait on it.
+        '''
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            fd = os.dup(self._file.fileno())
+        try:
+            os.fsync(fd)
+        except OSError:
+            with self._lock:
+                self._dirty = True
+            raise
+        finally:
+            os.close(fd)
+
+    def _sync_loop(self):
+        # type: () -> None
+        while not self._closed.wait(self._sync_interval):
+            self.sync()
+
+    def _stored_offset(self):
+        # type: () -> int
+        try:
+            with open(self._offset_path, 'rb') as f:
+                return int(f.read() or 0)
+        except (IOError, ValueError):
+            return 0
+
+    def _read_offset(self):
+        # type: () -> int
+        '''
+        Returns how far the journal has been replayed. A crash between
+        truncating a replayed journal and resetting its offset leaves the
+        offset past the end of the journal, in which case nothing has been.
+        '''
+        offset = self._stored_offset()
+        try:
+            if offset > os.path.getsize(self._path):
+                return 0
+        except OSError:
+            return 0
+        return offset
+
+    def _write_offset(self, offset):
+        # type: (int) -> None
+        # Written to a temporary file and renamed over the old one, so a crash
+        # leaves either the old or the new offset behind
+        tmp_path = self._offset_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self._offset_path)
+
+    def pending(self):
+        # type: () -> bool
+        '''Returns whether any records are waiting to be replayed.'''
+        try:
+            return os.path.getsize(self._path) > self._read_offset()
+        except OSError:
+            return False
+
+    def _read(self, offset):
+        # type: (int) -> Tuple[List[Dict[str, Any]], List[int]]
+        '''
+        Reads the next batch of records after an offset, discarding the rest
+        of the journal if a corrupt or incomplete record is found. Appends
+        are made under the same lock, so an incomplete record can only have
+        been torn by a crash. Only the records in the batch are read.
+
+        Returns:
+            Tuple[List[Dict], List[int]]: The records and the offset after each.
+        '''
+        with open(self._path, 'r+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(offset)
+                records, ends, corrupt = read_records(f, REPLAY_BATCH_SIZE)
+                if corrupt:
+                    good = ends[-1] if ends else offset
+                    logging.error('Discarding {0} bytes of corrupt journal at offset {1}.'
+                                  .format(os.fstat(f.fileno()).st_size - good, good))
+                    f.truncate(good)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return records, ends
+
+    def _reset_if_replayed(self, offset):
+        # type: (int) -> None
+        '''Empties the journal if everything in it has been replayed.'''
+        with open(self._path, 'r+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_size == offset:
+                    f.truncate(0)
+                    self._write_offset(0)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def replay(self, apply_fn):
+        # type: (Callable[[Dict[str, Any]], None]) -> int
+        '''
+        Applies records in order, recording progress after each batch and
+        whenever a record fails, so nothing is applied twice unless the
+        process dies part way through a batch.
+
+        Args:
+            apply_fn (function): Applies one record. Raising stops the replay
+                with that record still waiting.
+        Returns:
+            int: The number of records applied.
+        '''
+        applied = 0
+        offset = self._read_offset()
+        while True:
+            records, ends = self._read(offset)
+            if not records:
+                break
+            replayed = offset
+            try:
+                for record, end in zip(records, ends):
+                    apply_fn(record)
+                    offset = end
+                    applied += 1
+            finally:
+                if offset != replayed:
+                    self._write_offset(offset)
+        self._reset_if_replayed(offset)
+        return applied
+
+    def close(self):
+        # type: () -> None
+        '''Fsyncs everything appended so far and closes the journal.'''
+        self._closed.set()
+        self._syncer.join()
+        self.sync()
+        self._file.close()
+
+def apply_record(record):
+    # type: (Dict[str, Any]) -> None
+    '''
+    Applies a journal record to the database. Records the database rejects
+    are logged and skipped, so one bad write can't hold up the journal, but
+    records are kept while the database is unavailable.
+    '''
+    try:
+        SQLEngine.execute_all([(query, params) for query, params in record['statements']],
+                              record['tag'], record['idempotent'])
+    except SQLEngineUnavailable:
+        raise
+    except SQLEngineException as e:
+        logging.error('Dropping journaled write {0}: {1}'.format(record['statements'], e))
+
+class JournalReplayer(object):
+    '''
+    Periodically replays a journal into the database from a background
+    thread, for as long as the database accepts the writes.
+    '''
+
+    def __init__(self, journal, interval=REPLAY_INTERVAL):
+        # type: (Journal, float) -> None
+        self._journal = journal
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='journal-replay')
+        self._thread.daemon = True
+
+    def start(self):
+        # type: () -> None
+        self._thread.start()
+
+    def stop(self):
+        # type: () -> None
+        self._stopped.set()
+        self._thread.join()
+
+    def replay(self):
+        # type: () -> int
+        '''
+        Replays everything waiting in the journal, stopping early if the
+        database is unavailable.
+
+        Returns:
+            int: The number of records replayed.
+        '''
+        if not self._journal.pending():
+            return 0
+        try:
+            applied = self._journal.replay(apply_record)
+        except SQLEngineUnavailable:
+            return 0
+        logging.info('Replayed {0} journaled writes.'.format(applied))
+        return applied
+
+    def _run(self):
+        # type: () -> None
+        while not self._stopped.wait(self._interval):
+            try:
+                self.replay()
+            except Exception:
+                logging.exception('Failed to replay journal.')
+
+# The journal in use and its replayer, if the journal has been started
+_journal = None # type: Journal
+_replayer = None # type: JournalReplayer
+
+def start(path, replay=True):
+    # type: (str, bool) -> None
+    '''
+    Starts journaling writes made while the database is down. If the
+    journal can't be opened, e.g. because its directory doesn't exist, a
+    warning is logged and writes are not journaled.
+
+    Args:
+        path (str): Path to the journal file.
+        replay (bool): Whether this process should replay the journal into
+            the database. Only one process sharing a journal should.
+    '''
+    global _journal, _replayer
+    if _journal is None:
+        try:
+            _journal = Journal(path)
+        except (IOError, OSError) as e:
+            logging.warn('Unable to open journal, writes made while the database is down '
+                         'will be lost: {0}'.format(e))
+            return
+        if replay:
+            _replayer = JournalReplayer(_journal)
+            _replayer.start()
+
+def stop():
+    # type: () -> None
+    '''Stops replaying and fsyncs the journal.'''
+    global _journal, _replayer
+    if _replayer is not None:
+        replayer, _replayer = _replayer, None
+        replayer.stop()
+    if _journal is not None:
+        journal, _journal = _journal, None
+        journal.close()
+
+def enabled():
+    # type: () -> bool
+    '''Returns whether writes can be journaled.'''
+    return _journal is not None
+
+def pending():
+    # type: () -> bool
+    '''
+    Returns whether journaled writes are waiting to be replayed, in which
+    case new writes should be journaled behind them to keep them in order.
+    '''
+    return _journal is not None and _journal.pending()
+
+def append(statements, tag=None, idempotent=False):
+    # type: (Sequence[Tuple[str, Sequence[Any]]], str, bool) -> None
+    '''
+    Journals a write to be applied once the database is available.
+
+    Args:
+        statements (List[Tuple[str, Tuple[str]]]): Pairs of queries and
+            their parameters, to be applied as one transaction.
+        tag (str): The part of securitybot making the write.
+        idempotent (bool): Whether the write is safe to apply twice.
+    '''
+    if _journal is None:
+        raise JournalException('The journal has not been started.')
+    _journal.append(statements, tag, idempotent)
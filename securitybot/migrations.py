@@ -0,0 +1,373 @@
+'''
+Versioned schema migrations for the securitybot database.
+
+Each migration has a version number and is recorded in the `schema_version`
+table once applied, so running `migrate` only applies migrations that are
+new to the database. Migrations are additive and written to be safe to run
+against a live database: tables are created only if missing, and columns and
+indexes are added online, only if they don't already exist. A migration that
+was interrupted part way through can therefore simply be run again.
+'''
+import logging
+
+from securitybot.dialect import SQLiteDialect
+from securitybot.sql import SQLEngine
+
+from typing import Callable, List, Set, Tuple
+
+CREATE_SCHEMA_VERSION = '''
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INT UNSIGNED NOT NULL,
+    description VARCHAR(255) NOT NULL,
+    applied DATETIME NOT NULL,
+    PRIMARY KEY ( version )
+)
+'''
+
+GET_VERSIONS = 'SELECT version FROM schema_version'
+
+# Formatted with a clause skipping versions which another process has
+# applied concurrently
+RECORD_VERSION = '''
+INSERT INTO schema_version (version, description, applied)
+VALUES (%s, %s, NOW())
+{0}
+'''
+
+class MigrationException(Exception):
+    pass
+
+# All migrations as (version, description, function), in order
+MIGRATIONS = [] # type: List[Tuple[int, str, Callable[[], None]]]
+
+def migration(version, description):
+    # type: (int, str) -> Callable[[Callable[[], None]], Callable[[], None]]
+    '''
+    Registers a function as the migration to a schema version.
+
+    Args:
+        version (int): The version this migration brings the schema to.
+            Must be higher than every previously registered version.
+        description (str): A short description of the migration.
+    '''
+    def register(fn):
+        # type: (Callable[[], None]) -> Callable[[], None]
+        if MIGRATIONS and MIGRATIONS[-1][0] >= version:
+            raise MigrationException('Migration {0} is out of order.'.format(version))
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+# Helpers for writing idempotent migrations
+
+def column_exists(table, column):
+    # type: (str, str) -> bool
+    return bool(SQLEngine.execute(SQLEngine.dialect().column_exists, (table, column)))
+
+def index_exists(table, index):
+    # type: (str, str) -> bool
+    return bool(SQLEngine.execute(SQLEngine.dialect().index_exists, (table, index)))
+
+def add_column(table, column, definition, online=True):
+    # type: (str, str, str, bool) -> None
+    '''
+    Adds a column to a table unless it already exists.
+
+    Args:
+        table (str): The table to alter.
+        column (str): The name of the new column.
+        definition (str): The column's type and attributes.
+        online (bool): Whether the column can be added without locking the
+            table. Some columns, such as AUTO_INCREMENT ones, can't be.
+    '''
+    if column_exists(table, column):
+        return
+    logging.info('Adding column {0}.{1}'.format(table, column))
+    SQLEngine.execute(SQLEngine.dialect().add_column(table, column, definition, online))
+
+def add_index(table, index, columns, unique=False):
+    # type: (str, str, List[str], bool) -> None
+    '''
+    Adds an index to a table unless it already exists. Where supported, the
+    index is built online, so the table stays readable and writable while
+    it's built.
+
+    Args:
+        table (str): The table to index.
+        index (str): The name of the new index.
+        columns (List[str]): The columns to index, in order.
+        unique (bool): Whether the index is a unique key.
+    '''
+    if index_exists(table, index):
+        return
+    logging.info('Adding index {0} on {1}'.format(index, table))
+    SQLEngine.execute(SQLEngine.dialect().add_index(table, index, columns, unique))
+
+# Running migrations
+
+def applied_versions():
+    # type: () -> Set[int]
+    '''Returns the versions of all migrations applied to the database.'''
+    SQLEngine.execute(CREATE_SCHEMA_VERSION)
+    return {row[0] for row in SQLEngine.execute(GET_VERSIONS)}
+
+def pending_migrations():
+    # type: () -> List[Tuple[int, str, Callable[[], None]]]
+    '''Returns all migrations not yet applied to the database, in order.'''
+    applied = applied_versions()
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+def migrate():
+    # type: () -> None
+    '''Applies all pending migrations in order.'''
+    pending = pending_migrations()
+    if not pending:
+        logging.info('Schema is up to date.')
+        return
+    record_version = RECORD_VERSION.format(SQLEngine.dialect().on_duplicate(['version'], []))
+    for version, description, fn in pending:
+        logging.info('Migrating to version {0}: {1}'.format(version, description))
+        fn()
+        SQLEngine.execute(record_version, (version, description))
+    logging.info('Schema is now at version {0}.'.format(pending[-1][0]))
+
+# Migrations
+
+@migration(1, 'Create base tables')
+def create_base_tables():
+    # type: () -> None
+    SQLEngine.execute('''
+    CREATE TABLE IF NOT EXISTS blacklist (
+        ldap VARCHAR(255) NOT NULL,
+        PRIMARY KEY ( ldap )
+    )
+    ''')
+
+    SQLEngine.execute('''
+    CREATE TABLE IF NOT EXISTS ignored (
+        ldap VARCHAR(255) NOT NULL,
+        title VARCHAR(255) NOT NULL,
+        reason VARCHAR(255) NOT NULL,
+        until DATETIME NOT NULL,
+        CONSTRAINT ignored_ID PRIMARY KEY ( ldap, title )
+    )
+    ''')
+
+    SQLEngine.execute('''
+    CREATE TABLE IF NOT EXISTS alerts (
+        hash BINARY(32) NOT NULL,
+        ldap VARCHAR(255) NOT NULL,
+        title VARCHAR(255) NOT NULL,
+        description VARCHAR(255) NOT NULL,
+        reason TEXT NOT NULL,
+        url VARCHAR(511) NOT NULL,
+        event_time DATETIME NOT NULL,
+        PRIMARY KEY ( hash )
+    )
+    ''')
+
+    SQLEngine.execute('''
+    CREATE TABLE IF NOT EXISTS alert_status (
+        hash BINARY(32) NOT NULL,
+        status TINYINT UNSIGNED NOT NULL,
+        PRIMARY KEY ( hash )
+    )
+    ''')
+
+    SQLEngine.execute('''
+    CREATE TABLE IF NOT EXISTS user_responses(
+        hash BINARY(32) NOT NULL,
+        comment TEXT,
+        performed BOOL,
+        authenticated BOOL,
+        PRIMARY KEY ( hash )
+    )
+    ''')
+
+@migration(2, 'Add alert sequence numbers and worker leases')
+def add_sequence_and_leases():
+    # type: () -> None
+    if isinstance(SQLEngine.dialect(), SQLiteDialect):
+        # SQLite only auto-increments primary keys, but every row already
+        # has an increasing rowid to copy
+        add_column('alerts', 'seq', 'INTEGER')
+        add_index('alerts', 'seq', ['seq'], unique=True)
+        SQLEngine.execute('''
+        CREATE TRIGGER IF NOT EXISTS alerts_seq AFTER INSERT ON alerts
+        BEGIN
+            UPDATE alerts SET seq = NEW.rowid WHERE rowid = NEW.rowid;
+        END
+        ''')
+        SQLEngine.execute('UPDATE alerts SET seq = rowid WHERE seq IS NULL')
+    else:
+        # Adding an AUTO_INCREMENT column numbers existing rows, which MySQL
+        # can't do while allowing concurrent writes
+        add_column('alerts', 'seq', 'BIGINT UNSIGNED NOT NULL AUTO_INCREMENT UNIQUE KEY',
+                   online=False)
+    add_column('alert_status', 'owner', 'VARCHAR(255)')
+    add_column('alert_status', 'lease_expiry', 'DATETIME')
+
+    SQLEngine.execute('''
+    CREATE TABLE IF NOT EXISTS workers (
+        worker_id VARCHAR(255) NOT NULL,
+        heartbeat DATETIME NOT NULL,
+        PRIMARY KEY ( worker_id )
+    )
+    ''')
+
+@migration(3, 'Add indexes for tasker polls, the frontend and ignore pruning')
+def add_secondary_indexes():
+    # type: () -> None
+    # Every tasker poll looks up alerts by status
+    add_index('alert_status', 'status_idx', ['status'])
+    # The frontend filters and sorts alerts by these
+    add_index('alerts', 'event_time_idx', ['event_time'])
+    add_index('alerts', 'ldap_idx', ['ldap'])
+    # Expired ignores are pruned on every lookup
+    add_index('ignored', 'until_idx', ['until'])
+
+# Number of alerts to copy state for per statement
+BACKFILL_BATCH_SIZE = 1000
+
+BACKFILL_ALERT_STATE = '''
+UPDATE alerts
+JOIN alert_status ON alerts.hash = alert_status.hash
+JOIN user_responses ON alerts.hash = user_responses.hash
+SET alerts.status = alert_status.status,
+    alerts.owner = alert_status.owner,
+    alerts.lease_expiry = alert_status.lease_expiry,
+    alerts.comment = user_responses.comment,
+    alerts.performed = user_responses.performed,
+    alerts.authenticated = user_responses.authenticated
+WHERE alerts.seq > %s AND alerts.seq <= %s
+'''
+
+@migration(4, 'Store alert status and responses on the alert row')
+def merge_alert_state():
+    # type: () -> None
+    '''
+    Copies each alert's status, lease and user response from `alert_status`
+    and `user_responses` onto the alert itself, so reads no longer need to
+    join three tables. The copy is made a chunk of alerts at a time to keep
+    each statement's locks short. Bots should be stopped while this runs so
+    that no updates are made to the old tables after they've been copied.
+    The old tables are left in place.
+    '''
+    add_column('alerts', 'status', 'TINYINT UNSIGNED NOT NULL DEFAULT 0')
+    add_column('alerts', 'comment', 'TEXT')
+    add_column('alerts', 'performed', 'BOOL')
+    add_column('alerts', 'authenticated', 'BOOL')
+    add_column('alerts', 'owner', 'VARCHAR(255)')
+    add_column('alerts', 'lease_expiry', 'DATETIME')
+
+    # SQLite databases were never written with the old layout, so only MySQL
+    # has anything to copy
+    if isinstance(SQLEngine.dialect(), SQLiteDialect):
+        max_seq = 0
+    else:
+        max_seq = SQLEngine.execute('SELECT MAX(seq) FROM alerts')[0][0] or 0
+    for start in range(0, max_seq, BACKFILL_BATCH_SIZE):
+        SQLEngine.execute(BACKFILL_ALERT_STATE, (start, start + BACKFILL_BATCH_SIZE))
+
+    # Tasker polls look up alerts by status in sequence order
+    add_index('alerts', 'status_seq_idx', ['status', 'seq'])
+
+@migration(5, 'Track alert archive tables')
+def create_archive_registry():
+    # type: () -> None
+    # One row per monthly archive table, covering event times in
+    # [start_time, end_time)
+    SQLEngine.execute('''
+    CREATE TABLE IF NOT EXISTS alert_archives (
+        table_name VARCHAR(64) NOT NULL,
+        start_time DATETIME NOT NULL,
+        end_time DATETIME NOT NULL,
+        PRIMARY KEY ( table_name )
+    )
+    ''')
+
+@migration(6, 'Track when ignores change')
+def add_ignored_updated():
+    # type: () -> None
+    # Bots keep ignores cached and reload only those changed since they last
+    # looked
+    add_column('ignored', 'updated', 'DATETIME')
+    SQLEngine.execute('UPDATE ignored SET updated = NOW() WHERE updated IS NULL')
+    add_index('ignored', 'updated_idx', ['updated'])
+
+@migration(7, 'Add pattern-based ignore rules')
+def create_ignore_rules():
+    # type: () -> None
+    # Rules ignore alerts with titles matching a glob, for everyone, a single
+    # user or a group of users
+    SQLEngine.execute('''
+    CREATE TABLE IF NOT EXISTS ignore_rules (
+        users VARCHAR(255) NOT NULL,
+        title VARCHAR(255) NOT NULL,
+        reason VARCHAR(255) NOT NULL,
+        until DATETIME NOT NULL,
+        updated DATETIME NOT NULL,
+        PRIMARY KEY ( users, title )
+    )
+    ''')
+
+    SQLEngine.execute('''
+    CREATE TABLE IF NOT EXISTS ignore_groups (
+        group_name VARCHAR(255) NOT NULL,
+        ldap VARCHAR(255) NOT NULL,
+        updated DATETIME NOT NULL,
+        PRIMARY KEY ( group_name, ldap )
+    )
+    ''')
+
+# Triggers recording each change to the blacklist, formatted with the change
+# made, as the name of the trigger, the event and whether the user is now
+# blacklisted. Bumping the version locks its row until the change commits,
+# so changes commit in version order.
+BLACKLIST_CHANGE_TRIGGER = '''
+CREATE TRIGGER {0} AFTER {1} ON blacklist
+FOR EACH ROW
+BEGIN
+    UPDATE blacklist_version SET version = version + 1;
+    INSERT INTO blacklist_changes (version, ldap, present, changed)
+    SELECT version, {2}.ldap, {3}, NOW() FROM blacklist_version;
+END
+'''
+
+@migration(8, 'Log blacklist changes')
+def create_blacklist_changes():
+    # type: () -> None
+    '''
+    Versions the blacklist and logs every change to it, so bots can pick up
+    changes made by other bots, or directly in the database, without
+    reloading the whole blacklist.
+    '''
+    SQLEngine.execute('''
+    CREATE TABLE IF NOT EXISTS blacklist_version (
+        id TINYINT UNSIGNED NOT NULL,
+        version BIGINT UNSIGNED NOT NULL,
+        PRIMARY KEY ( id )
+    )
+    ''')
+    record_start = '''
+    INSERT INTO blacklist_version (id, version)
+    VALUES (1, 0)
+    {0}
+    '''.format(SQLEngine.dialect().on_duplicate(['id'], []))
+    SQLEngine.execute(record_start)
+
+    SQLEngine.execute('''
+    CREATE TABLE IF NOT EXISTS blacklist_changes (
+        version BIGINT UNSIGNED NOT NULL,
+        ldap VARCHAR(255) NOT NULL,
+        present BOOL NOT NULL,
+        changed DATETIME NOT NULL,
+        PRIMARY KEY ( version )
+    )
+    ''')
+
+    # Not every MySQL version can create triggers only if they're missing
+    for name, event, row, present in [('blacklist_insert', 'INSERT', 'NEW', 1),
+                                      ('blacklist_delete', 'DELETE', 'OLD', 0)]:
+        SQLEngine.execute('DROP TRIGGER IF EXISTS {0}'.format(name))
+        SQLEngine.execute(BLACKLIST_CHANGE_TRIGGER.format(name, event, row, present))
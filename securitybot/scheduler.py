@@ -0,0 +1,79 @@
+'''
+A small deadline scheduler used to wake users up only when one of their
+deadlines, such as auto-escalating a task, has passed.
+'''
+import heapq
+import itertools
+from datetime import datetime
+
+from typing import Any, Dict, List, Tuple
+
+class DeadlineScheduler(object):
+    '''
+    Keeps at most one deadline per key in a min-heap. Rescheduling or
+    cancelling a key doesn't touch the heap; stale entries are skipped when
+    they reach the top instead. Finding due keys therefore costs time
+    proportional to the number of due (and stale) entries rather than to the
+    total number of scheduled keys.
+    '''
+
+    def __init__(self):
+        # type: () -> None
+        self._heap = [] # type: List[Tuple[datetime, int, Any]]
+        # Maps keys to the sequence number of their live heap entry
+        self._live = {} # type: Dict[Any, int]
+        self._counter = itertools.count()
+
+    def __len__(self):
+        # type: () -> int
+        return len(self._live)
+
+    def __contains__(self, key):
+        # type: (Any) -> bool
+        return key in self._live
+
+    def schedule(self, key, deadline):
+        # type: (Any, datetime) -> None
+        '''
+        Schedules a deadline for a key, replacing any existing deadline.
+
+        Args:
+            key (Any): A hashable key identifying what to wake up.
+            deadline (datetime): The time after which the key is due.
+        '''
+        seq = next(self._counter)
+        self._live[key] = seq
+        heapq.heappush(self._heap, (deadline, seq, key))
+
+    def cancel(self, key):
+        # type: (Any) -> None
+        '''Cancels the deadline for a key if one exists.'''
+        self._live.pop(key, None)
+
+    def pop_due(self, now):
+        # type: (datetime) -> List[Any]
+        '''
+        Removes and returns all keys whose deadlines are strictly before `now`.
+
+        Args:
+            now (datetime): The current time.
+        Returns:
+            List[Any]: The due keys, earliest deadline first.
+        '''
+        due = []
+        while self._heap and self._heap[0][0] < now:
+            deadline, seq, key = heapq.heappop(self._heap)
+            if self._live.get(key) == seq:
+                del self._live[key]
+                due.append(key)
+        return due
+
+    def next_deadline(self):
+        # type: () -> datetime
+        '''Returns the earliest live deadline, or None if nothing is scheduled.'''
+        while self._heap:
+            deadline, seq, key = self._heap[0]
+            if self._live.get(key) == seq:
+                return deadline
+            heapq.heappop(self._heap)
+        return None
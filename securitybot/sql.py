@@ -1,93 +1,752 @@
 '''
 A wrapper for the securitybot to access its database.
 '''
-import MySQLdb
 import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
 
-from typing import Any, Sequence
+from securitybot.dialect import Dialect, MySQLDialect, SQLiteDialect
+from securitybot.sql_stats import QueryStats
+
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
+
+# Maximum number of open connections
+MAX_CONNECTIONS = 8
+# Idle connections older than this, in seconds, are closed rather than reused
+MAX_IDLE_TIME = 300
+# Idle connections older than this, in seconds, are pinged before being reused
+PING_IDLE_TIME = 5
+# How long to wait, in seconds, for a connection when all are in use
+CHECKOUT_TIMEOUT = 30
+# Number of rows to fetch at a time when streaming results
+ITERATE_CHUNK_SIZE = 1000
+# Maximum number of times to try a statement when the connection is lost
+MAX_ATTEMPTS = 4
+# Backoff, in seconds, before the first retry, doubling after each one
+RETRY_BASE_DELAY = 0.1
+# Longest backoff, in seconds, between retries
+RETRY_MAX_DELAY = 5
+# Number of connection failures in a row after which the database is
+# considered down
+FAILURE_THRESHOLD = 5
+# How long, in seconds, to fail fast once the database is considered down
+# before trying it again
+RESET_TIMEOUT = 30
+# Statements starting with these only read, so can always be retried
+READ_ONLY_STATEMENTS = ('SELECT', 'SHOW')
+
+class RetryPolicy(object):
+    '''
+    How many times to try a statement after losing the connection to the
+    database, and how long to wait in between. Waits grow exponentially with
+    random jitter, so a fleet of clients doesn't reconnect in lockstep.
+    '''
+
+    def __init__(self, max_attempts=MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY,
+                 max_delay=RETRY_MAX_DELAY):
+        # type: (int, float, float) -> None
+        '''
+        Args:
+            max_attempts (int): The maximum number of tries, including the first.
+            base_delay (float): Seconds to wait before the first retry.
+            max_delay (float): The longest to wait between any two tries.
+        '''
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        # type: (int) -> float
+        '''
+        Returns how long to wait after a failed try.
+
+        Args:
+            attempt (int): The number of tries so far, starting at 1.
+        '''
+        cap = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        # Full jitter: anywhere between no wait and the exponential cap
+        return random.uniform(0, cap)
+
+class CircuitBreaker(object):
+    '''
+    Fails fast while the database is down instead of having every caller
+    wait out its own retries. After enough connection failures in a row the
+    circuit opens and all statements raise SQLEngineUnavailable straight
+    away. Once the reset timeout passes, a single trial statement is let
+    through: if it succeeds the circuit closes again, and if not it stays
+    open for another timeout. A trial which ends without reaching the
+    database either way, e.g. because the caller raised, is ended with
+    `end_trial` so another can be let through.
+    '''
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        # type: (int, float) -> None
+        '''
+        Args:
+            failure_threshold (int): Failures in a row after which to open.
+            reset_timeout (float): Seconds to stay open before a trial.
+        '''
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        # When the circuit opened, or None if it's closed
+        self._opened_at = None # type: float
+        # Whether a trial statement is in flight
+        self._trial = False
+
+    def is_open(self):
+        # type: () -> bool
+        '''Returns whether statements are currently being failed fast.'''
+        with self._lock:
+            return self._opened_at is not None
+
+    def retry_after(self):
+        # type: () -> float
+        '''Returns the number of seconds until the next trial is allowed.'''
+        with self._lock:
+            if self._opened_at is None:
+                return 0
+            return max(0, self._opened_at + self._reset_timeout - time.time())
+
+    def before_call(self):
+        # type: () -> bool
+        '''
+        Raises SQLEngineUnavailable unless a statement may be run now.
+
+        Returns:
+            bool: Whether the statement is the trial, in which case the
+                caller must call `end_trial` once it's done.
+        '''
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            if not self._trial and time.time() - self._opened_at >= self._reset_timeout:
+                self._trial = True
+                return True
+        raise SQLEngineUnavailable('Database is unavailable, failing fast.')
+
+    def end_trial(self):
+        # type: () -> None
+        '''
+        Ends the trial. If neither a success nor a failure was recorded, the
+        circuit stays open and the next statement becomes the trial.
+        '''
+        with self._lock:
+            self._trial = False
+
+    def record_success(self):
+        # type: () -> None
+        '''Records that the database answered, closing the circuit.'''
+        with self._lock:
+            if self._opened_at is not None:
+                logging.info('Database is available again.')
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        # type: () -> None
+        '''Records that the database couldn't be reached.'''
+        with self._lock:
+            self._failures += 1
+            if self._trial or (self._opened_at is None and
+                               self._failures >= self._failure_threshold):
+                if not self._trial:
+                    logging.error('Database is unavailable, failing fast for {0}s.'
+                                  .format(self._reset_timeout))
+                self._opened_at = time.time()
+                self._trial = False
+
+class _Attempt(object):
+    '''Tracks whether a failed try may have changed the database.'''
+
+    def __init__(self):
+        # type: () -> None
+        # Whether a write was sent without hearing whether it was applied
+        self.uncertain = False
+
+class ConnectionPool(object):
+    '''
+    A bounded, thread-safe pool of database connections. Connections which
+    have sat idle for a while are health checked when checked out, and closed
+    once they've been idle for too long.
+    '''
+
+    def __init__(self, dialect, max_size=MAX_CONNECTIONS, max_idle_time=MAX_IDLE_TIME,
+                 timeout=CHECKOUT_TIMEOUT, ping_idle_time=PING_IDLE_TIME):
+        # type: (Dialect, int, float, float, float) -> None
+        '''
+        Args:
+            dialect (Dialect): Opens and checks on connections.
+            max_size (int): The maximum number of open connections.
+            max_idle_time (float): Seconds after which idle connections are closed.
+            timeout (float): Seconds to wait for a connection before giving up.
+            ping_idle_time (float): Seconds after which idle connections are
+                pinged before being reused.
+        '''
+        self._dialect = dialect
+        self._max_size = max_size
+        self._max_idle_time = max_idle_time
+        self._ping_idle_time = ping_idle_time
+        self._timeout = timeout
+
+        # Stack of idle connections and when they were checked in
+        self._idle = [] # type: List[Tuple[Any, float]]
+        # Number of open connections, both idle and checked out
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def _take(self):
+        # type: () -> Tuple[Any, float]
+        '''
+        Takes an idle connection, waiting for one if the pool is full.
+
+        Returns:
+            An idle connection and how many seconds it was idle for, or
+            (None, 0) if the caller may open a new one.
+        '''
+        deadline = time.time() + self._timeout
+        with self._cond:
+            while True:
+                while self._idle:
+                    conn, checked_in = self._idle.pop()
+                    idle_time = time.time() - checked_in
+                    if idle_time <= self._max_idle_time:
+                        return conn, idle_time
+                    self._size -= 1
+                    _close(conn)
+                if self._size < self._max_size:
+                    self._size += 1
+                    return None, 0
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise SQLEngineException('Timed out waiting for a database connection.')
+                self._cond.wait(remaining)
+
+    def checkout(self):
+        # type: () -> Any
+        '''
+        Checks out a connection from the pool, opening one if needed. Only
+        connections idle for longer than `ping_idle_time` are pinged first;
+        those used moments ago are handed straight out, and one that has died
+        since is discarded when the statement run on it fails. Every
+        connection checked out must be returned with `checkin`.
+        '''
+        while True:
+            conn, idle_time = self._take()
+            if conn is None:
+                try:
+                    return self._dialect.connect()
+                except Exception:
+                    self._release()
+                    raise
+            if idle_time <= self._ping_idle_time:
+                return conn
+            try:
+                self._dialect.ping(conn)
+                return conn
+            except self._dialect.Error:
+                logging.warn('Discarding dead {0} connection.'.format(self._dialect.name))
+                self._release()
+                _close(conn)
+
+    def checkin(self, conn, broken=False):
+        # type: (Any, bool) -> None
+        '''
+        Returns a connection to the pool.
+
+        Args:
+            conn: The connection to return.
+            broken (bool): Whether the connection should be closed instead of reused.
+        '''
+        if broken:
+            self._release()
+            _close(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    def _release(self):
+        # type: () -> None
+        '''Frees up the slot of a connection which has been closed.'''
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        # type: () -> Iterator[Any]
+        '''
+        Checks out a connection for the duration of a `with` block. Connections
+        that see a connection error are discarded rather than returned.
+        '''
+        conn = self.checkout()
+        broken = False
+        try:
+            yield conn
+        except self._dialect.Error as e:
+            broken = self._dialect.lost_connection(e)
+            raise
+        finally:
+            # Also reached when a generator holding a connection is closed early
+            self.checkin(conn, broken)
+
+    def close(self):
+        # type: () -> None
+        '''Closes all idle connections.'''
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            _close(conn)
+
+def _close(conn):
+    # type: (Any) -> None
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+def _raise_engine_exception(e):
+    # type: (Exception) -> None
+    name = SQLEngine.dialect().name
+    try:
+        raise SQLEngineException('{0} error [{1}]: {2}'.format(name, e.args[0], e.args[1]))
+    except IndexError:
+        raise SQLEngineException('{0} error: {1}'.format(name, e))
 
 class SQLEngine(object):
-    # Whether the singleton has been instantiated
-    _host = None # type: str
-    _user = None # type: str
-    _passwd = None # type: str
-    _db = None # type: str
-    _created = False # type: bool
-    _conn = None
-    _cursor = None
+    # The dialect of the database in use
+    _dialect = None # type: Dialect
+    # The connection pool shared by the whole process
+    _pool = None # type: ConnectionPool
+    # Latency statistics for every statement run by the process
+    _stats = QueryStats()
+    # How to retry statements after losing the connection
+    _retry_policy = RetryPolicy()
+    # Tracks whether the database is reachable
+    _breaker = CircuitBreaker()
 
-    def __init__(self, host, user, passwd, db):
-        # type: (str, str, str, str) -> None
+    def __init__(self, host, user, passwd, db, max_connections=MAX_CONNECTIONS):
+        # type: (str, str, str, str, int) -> None
         '''
-        Initializes the SQL connection to be used for the bot.
+        Initializes the MySQL connection pool to be used for the bot.
 
         Args:
             host (str): The hostname of the SQL server.
             user (str): The username to use.
             passwd (str): Password for MySQL user.
             db (str): The name of the database to connect to.
+            max_connections (int): The maximum number of open connections.
         '''
-        if not SQLEngine._created:
-            SQLEngine._host = host
-            SQLEngine._user = user
-            SQLEngine._passwd = passwd
-            SQLEngine._db = db
-            SQLEngine._create_engine(host, user, passwd, db)
-            SQLEngine._created = True
+        if SQLEngine._pool is None:
+            SQLEngine.configure(MySQLDialect(host, user, passwd, db), max_connections)
 
     @staticmethod
-    def _create_engine(host, user, passwd, db):
-        # type: (str, str, str, str) -> None
+    def configure(dialect, max_connections=MAX_CONNECTIONS, retry_policy=None, breaker=None):
+        # type: (Dialect, int, RetryPolicy, CircuitBreaker) -> None
         '''
+        Sets the database to use, replacing any previously configured one.
+
         Args:
-            host (str): The hostname of the SQL server.
-            user (str): The username to use.
-            passwd (str): Password for MySQL user.
-            db (str): The name of the database to connect to.
+            dialect (Dialect): The dialect of the database, which knows how to
+                connect to it.
+            max_connections (int): The maximum number of open connections.
+            retry_policy (RetryPolicy): How to retry after losing the
+                connection. Defaults to a RetryPolicy with default settings.
+            breaker (CircuitBreaker): Decides when to fail fast. Defaults to
+                a CircuitBreaker with default settings.
         '''
-        SQLEngine._conn = MySQLdb.connect(host=host,
-                                        user=user,
-                                        passwd=passwd,
-                                        db=db)
-        SQLEngine._cursor = SQLEngine._conn.cursor()
+        if SQLEngine._pool is not None:
+            SQLEngine._pool.close()
+        SQLEngine._dialect = dialect
+        SQLEngine._pool = ConnectionPool(dialect, max_connections)
+        SQLEngine._retry_policy = retry_policy or RetryPolicy()
+        SQLEngine._breaker = breaker or CircuitBreaker()
 
     @staticmethod
-    def execute(query, params=None):
-        # type: (str, Sequence[Any]) -> Sequence[Sequence[Any]]
+    def available():
+        # type: () -> bool
+        '''
+        Returns whether the database is believed to be up, i.e. statements
+        aren't being failed fast with SQLEngineUnavailable.
+        '''
+        return not SQLEngine._breaker.is_open()
+
+    @staticmethod
+    def retry_after():
+        # type: () -> float
+        '''
+        Returns the number of seconds until statements will be tried against
+        the database again, or zero if it's believed to be up.
+        '''
+        return SQLEngine._breaker.retry_after()
+
+    @staticmethod
+    def dialect():
+        # type: () -> Dialect
+        '''
+        Returns the dialect of the database in use, for building queries
+        that differ between databases.
+        '''
+        if SQLEngine._dialect is None:
+            raise SQLEngineException('SQL has not been initialized.')
+        return SQLEngine._dialect
+
+    @staticmethod
+    def connection():
+        # type: () -> Any
         '''
-        Executes a given SQL query with some possible params.
+        Returns a context manager checking out a connection from the pool.
+        '''
+        if SQLEngine._pool is None:
+            raise SQLEngineException('SQL has not been initialized.')
+        return SQLEngine._pool.connection()
+
+    @staticmethod
+    def stats():
+        # type: () -> List[Dict[str, Any]]
+        '''
+        Returns latency statistics for every statement run so far, grouped by
+        caller and statement. See `QueryStats.stats`.
+        '''
+        return SQLEngine._stats.stats()
+
+    @staticmethod
+    def slow_queries():
+        # type: () -> List[Dict[str, Any]]
+        '''
+        Returns the most recent statements that took longer than
+        `set_slow_query_time`. See `QueryStats.slow_queries`.
+        '''
+        return SQLEngine._stats.slow_queries()
+
+    @staticmethod
+    def set_slow_query_time(seconds):
+        # type: (float) -> None
+        '''Sets how long a statement may take before it's logged as slow.'''
+        SQLEngine._stats.slow_query_time = seconds
+
+    @staticmethod
+    def reset_stats():
+        # type: () -> None
+        '''Forgets all latency statistics recorded so far.'''
+        SQLEngine._stats.reset()
+
+    @staticmethod
+    def _with_retries(attempt_fn, idempotent):
+        # type: (Callable[[_Attempt], Any], bool) -> Any
+        '''
+        Calls a function running statements, retrying it according to the
+        retry policy if the connection is lost or it's rolled back by a
+        deadlock, and converting driver errors to SQLEngineExceptions.
+        Running out of retries after losing the connection raises
+        SQLEngineUnavailable.
+
+        Args:
+            attempt_fn (function): Makes one try, marking the _Attempt it's
+                given as uncertain while waiting to hear whether a write
+                was applied.
+            idempotent (bool): Whether it's safe to run the writes again if
+                they might already have been applied.
+        Returns:
+            Whatever `attempt_fn` returns.
+        '''
+        dialect = SQLEngine.dialect()
+        attempts = 0
+        while True:
+            trial = SQLEngine._breaker.before_call()
+            attempt = _Attempt()
+            attempts += 1
+            try:
+                result = attempt_fn(attempt)
+            except dialect.Error as e:
+                if not dialect.lost_connection(e):
+                    # The database answered, even if it didn't like the statement
+                    SQLEngine._breaker.record_success()
+                    if not dialect.deadlock(e) or \
+                       attempts >= SQLEngine._retry_policy.max_attempts:
+                        _raise_engine_exception(e)
+                    # Nothing was applied, so it's safe to run again
+                    delay = SQLEngine._retry_policy.delay(attempts)
+                    logging.warn('{0} deadlock, retrying in {1:.2f}s.'.format(dialect.name, delay))
+                    time.sleep(delay)
+                    continue
+                SQLEngine._breaker.record_failure()
+                if attempt.uncertain and not idempotent:
+                    # Running it again could apply the writes twice
+                    raise SQLEngineException('Lost {0} connection, writes may not have '
+                                             'been applied: {1}'.format(dialect.name, e))
+                if attempts >= SQLEngine._retry_policy.max_attempts or \
+                   not SQLEngine.available():
+                    raise SQLEngineUnavailable('Unable to reach {0}: {1}'.format(dialect.name, e))
+                delay = SQLEngine._retry_policy.delay(attempts)
+                logging.warn('Lost {0} connection, retrying in {1:.2f}s.'
+                             .format(dialect.name, delay))
+                time.sleep(delay)
+                continue
+            else:
+                SQLEngine._breaker.record_success()
+                return result
+            finally:
+                if trial:
+                    SQLEngine._breaker.end_trial()
+
+    @staticmethod
+    def execute(query, params=None, tag=None, idempotent=None):
+        # type: (str, Sequence[Any], str, bool) -> Sequence[Sequence[Any]]
+        '''
+        Executes a given SQL query with some possible params. The query runs
+        with autocommit on a pooled connection, which is only pinged first if
+        it has sat idle for a while, so a read usually costs a single round
+        trip and writes are committed immediately. Use `transaction` to group several statements.
+
+        If the connection is lost, the query is retried on a new one with
+        backoff. A write that was sent before the connection was lost may or
+        may not have been applied, so is only retried if it's idempotent.
 
         Args:
             query (str): The query to perform.
             params (Tuple[str]): Optional parameters to pass to the query.
+            tag (str): The part of securitybot running the query, which its
+                latency statistics are recorded under.
+            idempotent (bool): Whether running the query twice has the same
+                effect as running it once. Defaults to True for SELECT and
+                SHOW statements, and False for everything else.
         Returns:
             Tuple[Tuple[str]]: The output from the SQL query.
         '''
         if params is None:
             params = ()
+        if idempotent is None:
+            idempotent = query.lstrip().upper().startswith(READ_ONLY_STATEMENTS)
+        dialect = SQLEngine.dialect()
+
+        def attempt_fn(attempt):
+            # type: (_Attempt) -> Sequence[Sequence[Any]]
+            with SQLEngine.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    start = time.time()
+                    attempt.uncertain = True
+                    cursor.execute(dialect.prepare(query), params)
+                    rows = cursor.fetchall()
+                    SQLEngine._stats.record(tag, query, time.time() - start, len(rows))
+                    return rows
+                finally:
+                    cursor.close()
+
+        return SQLEngine._with_retries(attempt_fn, idempotent)
+
+    @staticmethod
+    def iterate(query, params=None, chunk_size=ITERATE_CHUNK_SIZE, tag=None):
+        # type: (str, Sequence[Any], int, str) -> Iterator[Sequence[Any]]
+        '''
+        Executes a given SQL query and yields its rows one at a time. Rows are
+        streamed from the server with a server-side cursor and fetched in
+        chunks, so memory use doesn't grow with the size of the result.
+
+        A connection is checked out for as long as the iterator is alive, so
+        either exhaust it or close it. Unlike `execute`, a lost connection
+        can't be transparently recovered from part way through a result and
+        is raised as an SQLEngineUnavailable instead, after which the query
+        should be retried from the start.
+
+        Args:
+            query (str): The query to perform.
+            params (Tuple[str]): Optional parameters to pass to the query.
+            chunk_size (int): The number of rows to fetch from the server at a time.
+            tag (str): The part of securitybot running the query. Only time
+                spent fetching rows counts towards its latency, not time
+                spent by the caller between rows.
+        Returns:
+            Iterator[Tuple[str]]: The rows output by the SQL query.
+        '''
+        if params is None:
+            params = ()
+        dialect = SQLEngine.dialect()
+        trial = SQLEngine._breaker.before_call()
         try:
-            SQLEngine._cursor.execute(query, params)
-            rows = SQLEngine._cursor.fetchall()
-            SQLEngine._conn.commit()
-        except (AttributeError, MySQLdb.OperationalError):
-            # Recover from lost connection
-            logging.warn('Recovering from lost MySQL connection.')
-            SQLEngine._create_engine(SQLEngine._host,
-                                     SQLEngine._user,
-                                     SQLEngine._passwd,
-                                     SQLEngine._db)
-            return SQLEngine.execute(query, params)
-        except MySQLdb.Error as e:
+            with SQLEngine.connection() as conn:
+                cursor = dialect.streaming_cursor(conn)
+                elapsed = 0.0
+                count = 0
+                try:
+                    start = time.time()
+                    cursor.execute(dialect.prepare(query), params)
+                    while True:
+                        rows = cursor.fetchmany(chunk_size)
+                        elapsed += time.time() - start
+                        if not rows:
+                            break
+                        count += len(rows)
+                        for row in rows:
+                            yield row
+                        start = time.time()
+                    SQLEngine._stats.record(tag, query, elapsed, count)
+                finally:
+                    # Closing an unbuffered cursor discards any unread rows
+                    cursor.close()
+        except dialect.Error as e:
+            if dialect.lost_connection(e):
+                SQLEngine._breaker.record_failure()
+                raise SQLEngineUnavailable('Lost {0} connection: {1}'.format(dialect.name, e))
+            SQLEngine._breaker.record_success()
+            _raise_engine_exception(e)
+        else:
+            SQLEngine._breaker.record_success()
+        finally:
+            # Also covers callers raising or abandoning the iterator
+            if trial:
+                SQLEngine._breaker.end_trial()
+
+    @staticmethod
+    @contextmanager
+    def _transaction(read_only=False, tag=None, attempt=None):
+        # type: (bool, str, _Attempt) -> Iterator[Transaction]
+        '''
+        Like `transaction`, but leaves driver errors alone. If given an
+        _Attempt, marks it as uncertain once COMMIT has been sent.
+        '''
+        dialect = SQLEngine.dialect()
+        with SQLEngine.connection() as conn:
+            txn = Transaction(conn, dialect, tag)
+            txn.execute(dialect.begin(read_only))
             try:
-                raise SQLEngineException('MySQL error [{0}]: {1}'.format(e.args[0], e.args[1]))
-            except IndexError:
-                raise SQLEngineException('MySQL error: {0}'.format(e))
-        return rows
+                yield txn
+                if attempt is not None:
+                    attempt.uncertain = True
+                txn.execute('COMMIT')
+            except BaseException:
+                try:
+                    txn.execute('ROLLBACK')
+                except dialect.Error:
+                    pass
+                raise
+
+    @staticmethod
+    @contextmanager
+    def transaction(read_only=False, tag=None):
+        # type: (bool, str) -> Iterator[Transaction]
+        '''
+        Runs the body of a `with` block as a single unit of work on one
+        connection. Everything executed through the yielded Transaction is
+        committed together when the block exits, or rolled back if it raises.
+
+            with SQLEngine.transaction() as txn:
+                txn.execute(...)
+                txn.execute(...)
+
+        Args:
+            read_only (bool): Whether the transaction only reads, which lets
+                MySQL skip some bookkeeping and gives its reads a single
+                consistent snapshot.
+            tag (str): The part of securitybot running the transaction,
+                which the latency statistics of its statements are recorded
+                under.
+        '''
+        dialect = SQLEngine.dialect()
+        trial = SQLEngine._breaker.before_call()
+        try:
+            with SQLEngine._transaction(read_only, tag) as txn:
+                yield txn
+        except dialect.Error as e:
+            if dialect.lost_connection(e):
+                SQLEngine._breaker.record_failure()
+                raise SQLEngineUnavailable('Lost {0} connection: {1}'.format(dialect.name, e))
+            SQLEngine._breaker.record_success()
+            _raise_engine_exception(e)
+        else:
+            SQLEngine._breaker.record_success()
+        finally:
+            # Also covers the body raising something other than a driver error
+            if trial:
+                SQLEngine._breaker.end_trial()
+
+    @staticmethod
+    def execute_all(statements, tag=None, idempotent=False):
+        # type: (Sequence[Tuple[str, Sequence[Any]]], str, bool) -> None
+        '''
+        Executes several statements as a single transaction, committing only
+        once all of them have succeeded.
+
+        If the connection is lost before COMMIT is sent, the transaction was
+        rolled back and is retried with backoff. If it's lost while waiting
+        to hear back from COMMIT, it's only retried if it's idempotent.
+
+        Args:
+            statements (List[Tuple[str, Tuple[str]]]): Pairs of queries and
+                their parameters.
+            tag (str): The part of securitybot running the statements.
+            idempotent (bool): Whether applying the statements twice has the
+                same effect as applying them once.
+        '''
+        def attempt_fn(attempt):
+            # type: (_Attempt) -> None
+            with SQLEngine._transaction(tag=tag, attempt=attempt) as txn:
+                for query, params in statements:
+                    txn.execute(query, params)
+
+        SQLEngine._with_retries(attempt_fn, idempotent)
+
+class Transaction(object):
+    '''
+    A handle for executing statements inside of `SQLEngine.transaction`.
+    '''
+
+    def __init__(self, conn, dialect, tag=None):
+        # type: (Any, Dialect, str) -> None
+        self._conn = conn
+        self._dialect = dialect
+        self._tag = tag
+
+    def execute(self, query, params=None):
+        # type: (str, Sequence[Any]) -> Sequence[Sequence[Any]]
+        '''
+        Executes a given SQL query as part of this transaction.
+
+        Args:
+            query (str): The query to perform.
+            params (Tuple[str]): Optional parameters to pass to the query.
+        Returns:
+            Tuple[Tuple[str]]: The output from the SQL query.
+        '''
+        if params is None:
+            params = ()
+        cursor = self._conn.cursor()
+        try:
+            start = time.time()
+            cursor.execute(self._dialect.prepare(query), params)
+            rows = cursor.fetchall()
+            SQLEngine._stats.record(self._tag, query, time.time() - start, len(rows))
+            return rows
+        finally:
+            cursor.close()
 
 class SQLEngineException(Exception):
     pass
 
+class SQLEngineUnavailable(SQLEngineException):
+    '''
+    Raised when the database can't be reached: when the connection is lost
+    and can't be retried, or straight away while it's believed to be down.
+    '''
+    pass
+
 def init_sql():
     # type: () -> None
     '''Initializes SQL.'''
     SQLEngine('localhost', 'root', '', 'securitybot')
+
+def init_sqlite(path):
+    # type: (str) -> None
+    '''
+    Initializes SQL on top of an SQLite database file instead of a MySQL
+    server. The schema can be created with `securitybot.migrations.migrate`.
+    '''
+    SQLEngine.configure(SQLiteDialect(path))
@@ -0,0 +1,153 @@
+'''
+Latency statistics for the queries run by SQLEngine.
+
+Statements are grouped by their fingerprint, which is the query text with
+whitespace collapsed and lists of placeholders folded together, so that e.g.
+every batch size of an `IN (...)` lookup counts as one statement. Each
+statement is also tagged with the part of securitybot that ran it.
+'''
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+from typing import Any, Dict, List, Tuple
+
+# Upper bounds, in seconds, of the latency histogram buckets. Anything
+# slower falls into a final unbounded bucket.
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5]
+# Statements taking longer than this, in seconds, are logged as slow
+SLOW_QUERY_TIME = 0.5
+# Number of slow statements to remember
+SLOW_LOG_SIZE = 100
+# Tag for statements whose caller didn't give one
+UNTAGGED = 'untagged'
+
+WHITESPACE_REGEX = re.compile(r'\s+')
+# A parenthesized list of placeholders, each optionally wrapped in a
+# function call, e.g. `(UNHEX(%s), UNHEX(%s))` or `(%s, %s, %s)`
+PLACEHOLDER_LIST_REGEX = re.compile(r'\(\s*(\w+\(%s\)|%s)(\s*,\s*(\w+\(%s\)|%s))+\s*\)')
+# Several rows of values, as built by bulk inserts
+VALUES_LIST_REGEX = re.compile(r'\(\.\.\.\)(\s*,\s*\(\.\.\.\))+')
+
+def fingerprint(query):
+    # type: (str) -> str
+    '''
+    Normalizes a query so that statements which only differ in formatting or
+    the number of parameters they're given are grouped together.
+
+    Args:
+        query (str): The query as passed to SQLEngine.
+    Returns:
+        str: The normalized query.
+    '''
+    query = WHITESPACE_REGEX.sub(' ', query).strip()
+    query = PLACEHOLDER_LIST_REGEX.sub('(...)', query)
+    return VALUES_LIST_REGEX.sub('(...)', query)
+
+class QueryStats(object):
+    '''
+    Thread-safe counters for how often each statement runs, how long it takes
+    and how many rows it returns, along with a log of the slowest runs.
+    '''
+
+    def __init__(self, slow_query_time=SLOW_QUERY_TIME, slow_log_size=SLOW_LOG_SIZE):
+        # type: (float, int) -> None
+        '''
+        Args:
+            slow_query_time (float): Seconds above which a statement is slow.
+            slow_log_size (int): The number of slow statements to remember.
+        '''
+        self.slow_query_time = slow_query_time
+        self._slow_log_size = slow_log_size
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # type: () -> None
+        '''Forgets all statistics recorded so far.'''
+        with self._lock:
+            # Per (tag, fingerprint): [count, total time, max time, rows, histogram]
+            self._stats = {} # type: Dict[Tuple[str, str], List[Any]]
+            self._slow = deque(maxlen=self._slow_log_size) # type: deque
+
+    def record(self, tag, query, elapsed, rows):
+        # type: (str, str, float, int) -> None
+        '''
+        Records a single run of a statement.
+
+        Args:
+            tag (str): The part of securitybot that ran the statement.
+            query (str): The query that was run.
+            elapsed (float): How long the statement took, in seconds.
+            rows (int): The number of rows returned.
+        '''
+        tag = tag or UNTAGGED
+        key = (tag, fingerprint(query))
+        bucket = len(LATENCY_BUCKETS)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                bucket = i
+                break
+        slow = elapsed >= self.slow_query_time
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = [0, 0.0, 0.0, 0, [0] * (len(LATENCY_BUCKETS) + 1)]
+                self._stats[key] = stats
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            stats[3] += rows
+            stats[4][bucket] += 1
+            if slow:
+                self._slow.append({
+                    'time': time.time(),
+                    'tag': tag,
+                    'fingerprint': key[1],
+                    'elapsed': elapsed,
+                    'rows': rows,
+                })
+        if slow:
+            logging.warn('Slow query from {0} took {1:.3f}s: {2}'.format(tag, elapsed, key[1]))
+
+    def stats(self):
+        # type: () -> List[Dict[str, Any]]
+        '''
+        Returns the statistics for every statement, those taking the most
+        time overall first.
+
+        Returns:
+            List[Dict[str, Any]]: For each statement its tag, fingerprint,
+                count, total_time, max_time, rows and a histogram of latencies.
+                The histogram is a list of bucket bounds in seconds, None for
+                the last unbounded bucket, and counts.
+        '''
+        with self._lock:
+            items = [(key, list(stats[:4]) + [list(stats[4])])
+                     for key, stats in self._stats.items()]
+        bounds = LATENCY_BUCKETS + [None] # type: List[Any]
+        results = [{
+            'tag': tag,
+            'fingerprint': fp,
+            'count': count,
+            'total_time': total,
+            'max_time': longest,
+            'rows': rows,
+            'histogram': zip(bounds, histogram),
+        } for (tag, fp), (count, total, longest, rows, histogram) in items]
+        results.sort(key=lambda s: s['total_time'], reverse=True)
+        return results
+
+    def slow_queries(self):
+        # type: () -> List[Dict[str, Any]]
+        '''
+        Returns the most recent slow statements, oldest first.
+
+        Returns:
+            List[Dict[str, Any]]: For each statement the time it finished,
+                its tag, fingerprint, how long it took and the rows returned.
+        '''
+        with self._lock:
+            return list(self._slow)
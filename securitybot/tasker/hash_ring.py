@@ -0,0 +1,50 @@
+'''
+A consistent hash ring for splitting users between bot workers.
+'''
+import bisect
+import hashlib
+
+from typing import List, Sequence
+
+# Number of points each node is given on the ring
+REPLICAS = 64
+
+def _hash(key):
+    # type: (str) -> int
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+class HashRing(object):
+    '''
+    Maps keys onto a set of nodes such that adding or removing a node only
+    moves the keys that hashed to that node.
+    '''
+
+    def __init__(self, nodes, replicas=REPLICAS):
+        # type: (Sequence[str], int) -> None
+        '''
+        Args:
+            nodes (List[str]): The names of all nodes on the ring.
+            replicas (int): The number of points to give each node.
+        '''
+        self.nodes = sorted(set(nodes)) # type: List[str]
+        points = sorted((_hash('{0}:{1}'.format(node, i)), node)
+                        for node in self.nodes for i in range(replicas))
+        self._points = [point for point, _ in points] # type: List[int]
+        self._owners = [node for _, node in points] # type: List[str]
+
+    def get_node(self, key):
+        # type: (str) -> str
+        '''
+        Finds the node responsible for a key.
+
+        Args:
+            key (str): The key to look up, e.g. a username.
+        Returns:
+            str: The name of the owning node, or None if the ring is empty.
+        '''
+        if not self._points:
+            return None
+        idx = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[idx]
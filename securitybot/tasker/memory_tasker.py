@@ -0,0 +1,185 @@
+'''
+A tasker which keeps all tasks in memory, for simulating load on the bot
+without a database or running an ephemeral bot. Tasks are lost on exit.
+'''
+import binascii
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from securitybot.tasker.tasker import Task, Tasker, STATUS_LEVELS
+from securitybot.util import NewAlert
+
+from typing import Dict, Iterable, List
+
+# Maximum number of tasks to keep waiting for verification. Nobody closes
+# them by hand in memory, so beyond this the oldest are closed automatically.
+MAX_PENDING_TASKS = 10000
+
+class MemoryTasker(Tasker):
+    '''
+    Keeps tasks in dictionaries indexed by status and then by hash, so
+    looking up or moving any single task takes constant time. Alerts can be
+    added directly with `add_alerts` or fed in at a fixed rate with `inject`.
+    '''
+
+    def __init__(self, max_pending=MAX_PENDING_TASKS):
+        # type: (int) -> None
+        '''
+        Args:
+            max_pending (int): Maximum number of tasks to keep waiting for
+                verification before closing the oldest.
+        '''
+        self._max_pending = max_pending
+        # Tasks at each status level, in the order they were created or moved
+        self._tasks = {level: OrderedDict() for level in
+                       [STATUS_LEVELS.OPEN,
+                        STATUS_LEVELS.INPROGRESS,
+                        STATUS_LEVELS.VERIFICATION]} # type: Dict[int, OrderedDict]
+        # Hashes of open tasks which haven't been returned as new yet
+        self._new = [] # type: List[str]
+        # Alerts may be injected from other threads
+        self._lock = threading.Lock()
+
+    def add_alerts(self, alerts):
+        # type: (Iterable[NewAlert]) -> List[str]
+        '''
+        Adds new alerts as open tasks.
+
+        Args:
+            alerts (Iterable[NewAlert]): The alerts to add.
+        Returns:
+            List[str]: The hashes of alerts that weren't added because a task
+                with the same hash already exists.
+        '''
+        duplicates = [] # type: List[str]
+        with self._lock:
+            for alert in alerts:
+                key = alert.key
+                if key is None:
+                    key = binascii.hexlify(os.urandom(32))
+                key = key.upper()
+                if self._find(key) is not None:
+                    duplicates.append(alert.key)
+                    continue
+                task = MemoryTask(self, key, alert.title, alert.ldap, alert.reason,
+                                  alert.description, alert.url, False, '', False,
+                                  STATUS_LEVELS.OPEN)
+                self._tasks[STATUS_LEVELS.OPEN][key] = task
+                self._new.append(key)
+        return duplicates
+
+    def inject(self, alerts, rate):
+        # type: (Iterable[NewAlert], float) -> threading.Thread
+        '''
+        Adds alerts from a background thread at a fixed rate until there are
+        none left.
+
+        Args:
+            alerts (Iterable[NewAlert]): The alerts to add. May be infinite.
+            rate (float): The number of alerts to add per second.
+        Returns:
+            Thread: The thread adding alerts.
+        '''
+        def run():
+            # type: () -> None
+            start = time.time()
+            for i, alert in enumerate(alerts):
+                # Schedule against the start time so delays don't accumulate
+                delay = start + i / float(rate) - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                self.add_alerts([alert])
+            logging.info('Finished injecting alerts.')
+
+        thread = threading.Thread(target=run, name='alert-injector')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def counts(self):
+        # type: () -> Dict[int, int]
+        '''Returns the number of tasks at each status level.'''
+        with self._lock:
+            return {level: len(tasks) for level, tasks in self._tasks.items()}
+
+    def close_pending_tasks(self):
+        # type: () -> int
+        '''
+        Removes all tasks waiting for verification, standing in for someone
+        closing them by hand.
+
+        Returns:
+            int: The number of tasks removed.
+        '''
+        with self._lock:
+            closed = len(self._tasks[STATUS_LEVELS.VERIFICATION])
+            self._tasks[STATUS_LEVELS.VERIFICATION] = OrderedDict()
+        return closed
+
+    def _find(self, key):
+        # type: (str) -> MemoryTask
+        for tasks in self._tasks.values():
+            if key in tasks:
+                return tasks[key]
+        return None
+
+    def _move(self, task, status):
+        # type: (MemoryTask, int) -> None
+        '''Moves a task to a new status level.'''
+        with self._lock:
+            self._tasks[task.status].pop(task.hash, None)
+            task.status = status
+            self._tasks[status][task.hash] = task
+            if status == STATUS_LEVELS.OPEN:
+                # Reopened tasks get picked up again as new
+                self._new.append(task.hash)
+            pending = self._tasks[STATUS_LEVELS.VERIFICATION]
+            while len(pending) > self._max_pending:
+                pending.popitem(last=False)
+
+    def get_new_tasks(self):
+        # type: () -> List[Task]
+        with self._lock:
+            new, self._new = self._new, []
+            open_tasks = self._tasks[STATUS_LEVELS.OPEN]
+            # Tasks may have moved on since they were added
+            return [open_tasks[key] for key in new if key in open_tasks]
+
+    def get_active_tasks(self):
+        # type: () -> List[Task]
+        with self._lock:
+            return list(self._tasks[STATUS_LEVELS.INPROGRESS].values())
+
+    def get_pending_tasks(self):
+        # type: () -> List[Task]
+        with self._lock:
+            return list(self._tasks[STATUS_LEVELS.VERIFICATION].values())
+
+class MemoryTask(Task):
+    def __init__(self, tasker, hsh, title, username, reason, description, url,
+                 performed, comment, authenticated, status):
+        # type: (MemoryTasker, str, str, str, str, str, str, bool, str, bool, int) -> None
+        '''
+        Args:
+            tasker (MemoryTasker): The tasker holding this task.
+            hsh (str): A unique hash identifying this task.
+        '''
+        super(MemoryTask, self).__init__(title, username, reason, description, url,
+                                         performed, comment, authenticated, status)
+        self._tasker = tasker
+        self.hash = hsh
+
+    def set_open(self):
+        # type: () -> None
+        self._tasker._move(self, STATUS_LEVELS.OPEN)
+
+    def set_in_progress(self):
+        # type: () -> None
+        self._tasker._move(self, STATUS_LEVELS.INPROGRESS)
+
+    def set_verifying(self):
+        # type: () -> None
+        self._tasker._move(self, STATUS_LEVELS.VERIFICATION)
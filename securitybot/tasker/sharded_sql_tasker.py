@@ -0,0 +1,273 @@
+'''
+A SQL tasker for running several bot workers side by side.
+
+Users are split between live workers using a consistent hash ring over
+their usernames. Each worker claims the tasks of its users by writing its
+name and a lease expiry onto their alerts. Leases are renewed every time
+the worker polls for new tasks, so if a worker dies its leases run out and
+the worker now responsible for those users picks the tasks up again.
+
+When the ring changes, a user stays with the worker already talking to them
+until all of their leased tasks are done: no other worker claims their new
+tasks or answers their messages in the meantime, so they never have two
+conversations at once.
+
+A claimed task stays open until the bot's status change for it has been
+written, which may be some time with write-behind. Tasks already handed out
+are remembered until they leave the open state so they aren't handed out
+again in the meantime.
+
+Like SQLTasker, new tasks are fetched in sequence order past a watermark,
+which is reset by a periodic rescan. Tasks passed over because another
+worker was responsible for their user are picked up by a rescan as soon as
+the ring or the set of users leased elsewhere changes.
+'''
+import logging
+from datetime import datetime, timedelta
+
+from securitybot.tasker.tasker import Task, STATUS_LEVELS
+from securitybot.tasker.sql_tasker import (SQLTasker, SQLTask, GET_ALERTS, MAX_NEW_TASKS,
+                                           NEW_TASK_BATCH_SIZE, RESCAN_TIME)
+from securitybot.tasker.hash_ring import HashRing
+from securitybot.sql import SQLEngine
+
+from typing import Iterator, List, Set
+
+# How long a claimed task stays with a worker without being renewed
+LEASE_TIME = timedelta(minutes=5)
+# How long a worker may go without a heartbeat before it's considered dead
+WORKER_TIMEOUT = timedelta(minutes=3)
+
+# Queries are formatted with the upsert clause or lease expiry expression for
+# the database in use
+
+HEARTBEAT = '''
+INSERT INTO workers (worker_id, heartbeat)
+VALUES (%s, NOW())
+{0}
+'''
+
+GET_LIVE_WORKERS = '''
+SELECT worker_id
+FROM workers
+WHERE heartbeat >= {0}
+'''
+
+RENEW_LEASES = '''
+UPDATE alerts
+SET lease_expiry={0}
+WHERE owner = %s AND status IN (%s, %s)
+'''
+
+# Users with tasks leased by other workers which are still alive
+GET_LEASED_ELSEWHERE = '''
+SELECT DISTINCT ldap
+FROM alerts
+WHERE status IN (%s, %s)
+AND owner <> %s
+AND lease_expiry >= NOW()
+'''
+
+# Conditions under which a task at some level may be claimed by a worker
+CLAIMABLE = '(owner IS NULL OR owner = %s OR lease_expiry < NOW())'
+# Only tasks held by nobody or by another worker whose lease has run out
+TAKEOVER = '(owner IS NULL OR (owner <> %s AND lease_expiry < NOW()))'
+
+GET_CLAIMABLE = '''
+SELECT HEX(alerts.hash), ldap
+FROM alerts
+WHERE status = %s
+AND {0}
+'''
+
+CLAIM = '''
+UPDATE alerts
+SET owner=%s,
+    lease_expiry={0}
+WHERE hash IN ({1})
+AND {2}
+'''
+
+# Fetches open tasks past a watermark in insertion order
+GET_NEW_CLAIMABLE = '''
+SELECT HEX(alerts.hash), ldap, alerts.seq
+FROM alerts
+WHERE status = %s
+AND alerts.seq > %s
+AND {0}
+ORDER BY alerts.seq
+LIMIT %s
+'''
+
+GET_CLAIMED_ALERTS = GET_ALERTS + '''AND owner = %s
+AND alerts.hash IN ({0})
+'''
+
+class ShardedSQLTasker(SQLTasker):
+    def __init__(self, worker_id, batch_size=NEW_TASK_BATCH_SIZE, max_new_tasks=MAX_NEW_TASKS):
+        # type: (str, int, int) -> None
+        '''
+        Args:
+            worker_id (str): A name for this worker that is unique among all
+                             workers and stable across restarts.
+            batch_size (int): Number of open alerts to fetch per query.
+            max_new_tasks (int): Maximum number of new tasks to claim per poll.
+        '''
+        super(ShardedSQLTasker, self).__init__(batch_size, max_new_tasks)
+        self.worker_id = worker_id
+        self._ring = HashRing([worker_id])
+        # Users another worker is still working on
+        self._leased_elsewhere = set() # type: Set[str]
+        # Hashes of tasks handed out as new which may still be open
+        self._handed_out = set() # type: Set[str]
+        # Whether to rescan from the beginning on the next poll
+        self._rescan = False
+        # Hashes of open tasks seen by a rescan in progress, or None if
+        # there isn't one
+        self._seen = None # type: Set[str]
+
+    def owns(self, username):
+        # type: (str) -> bool
+        return (self._ring.get_node(username) == self.worker_id and
+                username not in self._leased_elsewhere)
+
+    def heartbeat(self):
+        # type: () -> None
+        '''
+        Records that this worker is alive, renews its leases, rebuilds the
+        hash ring from the set of live workers, and finds the users other
+        workers still hold leases for.
+        '''
+        dialect = SQLEngine.dialect()
+        SQLEngine.execute(HEARTBEAT.format(dialect.on_duplicate(['worker_id'], ['heartbeat'])),
+                          (self.worker_id,), tag='tasker', idempotent=True)
+        SQLEngine.execute(RENEW_LEASES.format(dialect.add_seconds('NOW()', '%s')),
+                          (int(LEASE_TIME.total_seconds()), self.worker_id,
+                           STATUS_LEVELS.OPEN, STATUS_LEVELS.INPROGRESS), tag='tasker',
+                          idempotent=True)
+        rows = SQLEngine.execute(GET_LIVE_WORKERS.format(dialect.add_seconds('NOW()', '%s')),
+                                 (-int(WORKER_TIMEOUT.total_seconds()),), tag='tasker')
+        workers = {row[0] for row in rows}
+        workers.add(self.worker_id)
+        if sorted(workers) != self._ring.nodes:
+            logging.info('Live workers changed: {0}'.format(sorted(workers)))
+            self._ring = HashRing(workers)
+            self._rescan = True
+        rows = SQLEngine.execute(GET_LEASED_ELSEWHERE,
+                                 (STATUS_LEVELS.OPEN, STATUS_LEVELS.INPROGRESS, self.worker_id),
+                                 tag='tasker')
+        leased_elsewhere = {row[0] for row in rows}
+        if self._leased_elsewhere - leased_elsewhere:
+            # Users released by other workers may have tasks behind the watermark
+            self._rescan = True
+        self._leased_elsewhere = leased_elsewhere
+
+    def _claim(self, level, condition):
+        # type: (int, str) -> List[Task]
+        '''
+        Claims all tasks at some level that belong to this worker's users and
+        meet a claiming condition.
+
+        Args:
+            level (int): One of STATUS_LEVELS
+            condition (str): Either CLAIMABLE or TAKEOVER.
+        Returns:
+            List of SQLTasks that were successfully claimed.
+        '''
+        rows = SQLEngine.execute(GET_CLAIMABLE.format(condition), (level, self.worker_id),
+                                 tag='tasker')
+        hashes = [hsh for hsh, username in rows if self.owns(username)] # type: List[str]
+        return self._claim_hashes(level, condition, hashes)
+
+    def _claim_new(self):
+        # type: () -> List[Task]
+        '''
+        Claims open tasks for this worker's users past the watermark which
+        haven't already been handed out, oldest first.
+
+        Returns:
+            List of SQLTasks that were successfully claimed.
+        '''
+        now = datetime.now()
+        if self._rescan or now - self._last_rescan > RESCAN_TIME:
+            self._rescan = False
+            self._last_rescan = now
+            self._watermark = 0
+            self._seen = set()
+
+        tasks = [] # type: List[Task]
+        while len(tasks) < self._max_new_tasks:
+            limit = min(self._batch_size, self._max_new_tasks - len(tasks))
+            rows = SQLEngine.execute(GET_NEW_CLAIMABLE.format(CLAIMABLE),
+                                     (STATUS_LEVELS.OPEN, self._watermark, self.worker_id,
+                                      limit), tag='tasker')
+            hashes = [hsh for hsh, username, _ in rows
+                      if self.owns(username) and hsh not in self._handed_out]
+            claimed = self._claim_hashes(STATUS_LEVELS.OPEN, CLAIMABLE, hashes)
+            self._handed_out.update(task.hash for task in claimed)
+            tasks.extend(claimed)
+            if self._seen is not None:
+                self._seen.update(hsh for hsh, _, _ in rows)
+            if rows:
+                self._watermark = rows[-1][-1]
+            if len(rows) < limit:
+                if self._seen is not None:
+                    # A finished rescan has seen every open task, so those
+                    # handed out that it didn't see have been written
+                    self._handed_out &= self._seen
+                    self._seen = None
+                break
+        return tasks
+
+    def _claim_hashes(self, level, condition, hashes):
+        # type: (int, str, List[str]) -> List[Task]
+        '''
+        Claims the tasks with the given hashes which meet a claiming condition.
+
+        Args:
+            level (int): One of STATUS_LEVELS
+            condition (str): Either CLAIMABLE or TAKEOVER.
+            hashes (List[str]): Hex hashes of the tasks to claim.
+        Returns:
+            List of SQLTasks that were successfully claimed.
+        '''
+        if not hashes:
+            return []
+        hash_in = ','.join(['UNHEX(%s)' for _ in hashes])
+
+        params = [self.worker_id, int(LEASE_TIME.total_seconds())]
+        params.extend(hashes)
+        params.append(self.worker_id)
+        lease_expiry = SQLEngine.dialect().add_seconds('NOW()', '%s')
+        # Claiming twice is harmless, as the tasks won are read back below
+        SQLEngine.execute(CLAIM.format(lease_expiry, hash_in, condition), params, tag='tasker',
+                          idempotent=True)
+
+        # Another worker may have won the race for some of these
+        params = [level, self.worker_id]
+        params.extend(hashes)
+        alerts = SQLEngine.execute(GET_CLAIMED_ALERTS.format(hash_in), params, tag='tasker')
+        return [SQLTask(*alert) for alert in alerts]
+
+    def get_new_tasks(self):
+        # type: () -> List[Task]
+        '''
+        Claims and returns new tasks for this worker's users, along with any
+        in progress tasks taken over from a worker whose leases ran out.
+        '''
+        self.heartbeat()
+        taken_over = self._claim(STATUS_LEVELS.INPROGRESS, TAKEOVER)
+        for task in taken_over:
+            logging.info('Taking over task for {0}'.format(task.username))
+        return self._claim_new() + taken_over
+
+    def get_active_tasks(self):
+        # type: () -> List[Task]
+        self.heartbeat()
+        return self._claim(STATUS_LEVELS.INPROGRESS, CLAIMABLE)
+
+    def iter_active_tasks(self):
+        # type: () -> Iterator[Task]
+        # Tasks have to be claimed before they're handed out, which can't be
+        # done while streaming them
+        return iter(self.get_active_tasks())
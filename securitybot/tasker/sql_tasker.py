@@ -3,8 +3,11 @@ A tasker on top of a SQL database.
 '''
 from securitybot.tasker.tasker import Task, Tasker, STATUS_LEVELS
 from securitybot.sql import SQLEngine
+import securitybot.journal as journal
+import securitybot.write_behind as write_behind
+from datetime import datetime, timedelta
 
-from typing import List
+from typing import Any, Iterator, List, Sequence, Tuple
 
 # Note: this order is provided to match the SQLTask constructor
 GET_ALERTS = '''
@@ -19,12 +22,69 @@ SELECT HEX(alerts.hash),
        authenticated,
        status
 FROM alerts
-JOIN user_responses ON alerts.hash = user_responses.hash
-JOIN alert_status ON alerts.hash = alert_status.hash
 WHERE status = %s
 '''
 
+# Fetches new alerts past a watermark in insertion order. Also selects the
+# sequence number so the watermark can be advanced.
+GET_NEW_ALERTS = '''
+SELECT HEX(alerts.hash),
+       title,
+       ldap,
+       reason,
+       description,
+       url,
+       performed,
+       comment,
+       authenticated,
+       status,
+       alerts.seq
+FROM alerts
+WHERE status = %s
+AND alerts.seq > %s
+ORDER BY alerts.seq
+LIMIT %s
+'''
+
+# Number of new alerts to fetch per query
+NEW_TASK_BATCH_SIZE = 500
+# Maximum number of new alerts to fetch per poll
+MAX_NEW_TASKS = 5000
+# How often to rescan from the beginning. Auto-increment values are handed out
+# before transactions commit, so a row may become visible after rows with a
+# higher sequence number and would otherwise be skipped by the watermark.
+# Rescans wait until queued and journaled writes have been applied, as until
+# then tasks already handed out may still be open in the database.
+RESCAN_TIME = timedelta(minutes=10)
+
 class SQLTasker(Tasker):
+    def __init__(self, batch_size=NEW_TASK_BATCH_SIZE, max_new_tasks=MAX_NEW_TASKS):
+        # type: (int, int) -> None
+        '''
+        Args:
+            batch_size (int): Number of new alerts to fetch per query.
+            max_new_tasks (int): Maximum number of new alerts to return per poll.
+                                 Any remaining alerts are returned on the next poll.
+        '''
+        self._batch_size = batch_size
+        self._max_new_tasks = max_new_tasks
+        # Sequence number of the last new alert returned
+        self._watermark = 0
+        self._last_rescan = datetime.min
+
+    def _iter_tasks(self, level):
+        # type: (int) -> Iterator[Task]
+        '''
+        Streams all tasks of a certain level from the database.
+
+        Args:
+            level (int): One of STATUS_LEVELS
+        Returns:
+            Iterator of SQLTasks.
+        '''
+        for alert in SQLEngine.iterate(GET_ALERTS, (level,), tag='tasker'):
+            yield SQLTask(*alert)
+
     def _get_tasks(self, level):
         # type: (int) -> List[Task]
         '''
@@ -35,36 +95,142 @@ class SQLTasker(Tasker):
         Returns:
             List of SQLTasks.
         '''
-        alerts = SQLEngine.execute(GET_ALERTS, (level,))
-        return [SQLTask(*alert) for alert in alerts]
+        return list(self._iter_tasks(level))
 
     def get_new_tasks(self):
         # type: () -> List[Task]
-        return self._get_tasks(STATUS_LEVELS.OPEN)
+        '''
+        Gets new tasks which arrived since the last poll, oldest first.
+        '''
+        now = datetime.now()
+        if (now - self._last_rescan > RESCAN_TIME and not write_behind.pending() and
+                not journal.pending()):
+            self._last_rescan = now
+            self._watermark = 0
+
+        tasks = [] # type: List[Task]
+        while len(tasks) < self._max_new_tasks:
+            limit = min(self._batch_size, self._max_new_tasks - len(tasks))
+            alerts = SQLEngine.execute(GET_NEW_ALERTS,
+                                       (STATUS_LEVELS.OPEN, self._watermark, limit),
+                                       tag='tasker')
+            tasks.extend(SQLTask(*alert[:-1]) for alert in alerts)
+            if alerts:
+                self._watermark = alerts[-1][-1]
+            if len(alerts) < limit:
+                break
+        return tasks
+
 
+    def set_in_progress(self, tasks):
+        # type: (List[Task]) -> None
+        '''
+        Sets many tasks to be in progress in one transaction.
+        '''
+        statements = [] # type: List[Tuple[str, Sequence[Any]]]
+        for chunk in chunks(tasks, UPDATE_BATCH_SIZE):
+            statements.append(set_status_statement(chunk, STATUS_LEVELS.INPROGRESS))
+        if statements:
+            write_behind.submit(statements, tag='tasker', idempotent=True)
+
+    def set_verifying(self, tasks):
+        # type: (List[Task]) -> None
+        '''
+        Sets many tasks to be waiting for verification and saves their
+        responses in one transaction.
+        '''
+        statements = [] # type: List[Tuple[str, Sequence[Any]]]
+        for chunk in chunks(tasks, UPDATE_BATCH_SIZE):
+            statements.append(set_status_statement(chunk, STATUS_LEVELS.VERIFICATION))
+            statements.append(set_response_statement(chunk))
+        if statements:
+            write_behind.submit(statements, tag='tasker', idempotent=True)
 
     def get_active_tasks(self):
         # type: () -> List[Task]
         return self._get_tasks(STATUS_LEVELS.INPROGRESS)
 
+    def iter_active_tasks(self):
+        # type: () -> Iterator[Task]
+        return self._iter_tasks(STATUS_LEVELS.INPROGRESS)
+
     def get_pending_tasks(self):
         # type: () -> List[Task]
         return self._get_tasks(STATUS_LEVELS.VERIFICATION)
 
 SET_STATUS = '''
-UPDATE alert_status
+UPDATE alerts
 SET status=%s
 WHERE hash=UNHEX(%s)
 '''
 
 SET_RESPONSE = '''
-UPDATE user_responses
+UPDATE alerts
 SET comment=%s,
     performed=%s,
     authenticated=%s
 WHERE hash=UNHEX(%s)
 '''
 
+SET_STATUSES = '''
+UPDATE alerts
+SET status=%s
+WHERE hash IN ({0})
+'''
+
+# Sets each alert's response columns to its own values, picked out by hash
+SET_RESPONSES = '''
+UPDATE alerts
+SET comment=CASE hash {0} END,
+    performed=CASE hash {0} END,
+    authenticated=CASE hash {0} END
+WHERE hash IN ({1})
+'''
+
+# Maximum number of tasks to update per statement
+UPDATE_BATCH_SIZE = 500
+
+def chunks(items, size):
+    # type: (Sequence[Any], int) -> Iterator[Sequence[Any]]
+    '''Splits a sequence into consecutive chunks of at most `size` items.'''
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def set_status_statement(tasks, status):
+    # type: (Sequence[SQLTask], int) -> Tuple[str, List[Any]]
+    '''
+    Builds a single statement setting the status of many tasks.
+
+    Args:
+        tasks (List[SQLTask]): The tasks to update.
+        status (int): The new status to use.
+    Returns:
+        (str, List[Any]): The query and its parameters.
+    '''
+    query = SET_STATUSES.format(','.join(['UNHEX(%s)' for _ in tasks]))
+    params = [status] # type: List[Any]
+    params.extend(task.hash for task in tasks)
+    return query, params
+
+def set_response_statement(tasks):
+    # type: (Sequence[SQLTask]) -> Tuple[str, List[Any]]
+    '''
+    Builds a single statement saving the user responses of many tasks.
+
+    Args:
+        tasks (List[SQLTask]): The tasks to update.
+    Returns:
+        (str, List[Any]): The query and its parameters.
+    '''
+    query = SET_RESPONSES.format(' '.join(['WHEN UNHEX(%s) THEN %s' for _ in tasks]),
+                                 ','.join(['UNHEX(%s)' for _ in tasks]))
+    params = [] # type: List[Any]
+    for field in ['comment', 'performed', 'authenticated']:
+        for task in tasks:
+            params.extend([task.hash, getattr(task, field)])
+    params.extend(task.hash for task in tasks)
+    return query, params
+
 class SQLTask(Task):
     def __init__(self, hsh, title, username, reason, description, url,
                  performed, comment, authenticated, status):
@@ -77,32 +243,34 @@ class SQLTask(Task):
                                    performed, comment, authenticated, status)
         self.hash = hsh
 
-    def _set_status(self, status):
-        # type: (int) -> None
+    def _status_statement(self, status):
+        # type: (int) -> Tuple[str, Sequence[Any]]
         '''
-        Sets the status of a task in the DB.
+        Builds a statement setting the status of a task in the DB.
 
         Args:
             status (int): The new status to use.
         '''
-        SQLEngine.execute(SET_STATUS, (status, self.hash))
+        return SET_STATUS, (status, self.hash)
 
-    def _set_response(self):
-        # type: () -> None
+    def _response_statement(self):
+        # type: () -> Tuple[str, Sequence[Any]]
         '''
-        Updates the user response for this task.
+        Builds a statement updating the user response for this task.
         '''
-        SQLEngine.execute(SET_RESPONSE, (self.comment,
-                                         self.performed,
-                                         self.authenticated,
-                                         self.hash))
+        return SET_RESPONSE, (self.comment,
+                              self.performed,
+                              self.authenticated,
+                              self.hash)
 
     def set_open(self):
-        self._set_status(STATUS_LEVELS.OPEN)
+        write_behind.submit([self._status_statement(STATUS_LEVELS.OPEN)], tag='tasker',
+                            idempotent=True)
 
     def set_in_progress(self):
-        self._set_status(STATUS_LEVELS.INPROGRESS)
+        write_behind.submit([self._status_statement(STATUS_LEVELS.INPROGRESS)], tag='tasker',
+                            idempotent=True)
 
     def set_verifying(self):
-        self._set_status(STATUS_LEVELS.VERIFICATION)
-        self._set_response()
+        write_behind.submit([self._status_statement(STATUS_LEVELS.VERIFICATION),
+                             self._response_statement()], tag='tasker', idempotent=True)
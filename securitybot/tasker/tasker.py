@@ -8,7 +8,7 @@ __author__ = 'Alex Bertsch'
 __email__ = 'abertsch@dropbox.com'
 
 from abc import ABCMeta, abstractmethod
-from securitybot.util import enum
+from securitybot.util import enum, create_new_alerts
 
 class Tasker(object):
     '''
@@ -35,6 +35,14 @@ class Tasker(object):
         '''
         pass
 
+    def iter_active_tasks(self):
+        # type: () -> Iterator[Task]
+        '''
+        Yields the same tasks as `get_active_tasks`. Taskers that can stream
+        tasks without loading all of them at once should override this.
+        '''
+        return iter(self.get_active_tasks())
+
     @abstractmethod
     def get_pending_tasks(self):
         # type: () -> List[Task]
@@ -44,6 +52,56 @@ class Tasker(object):
         '''
         pass
 
+    def set_in_progress(self, tasks):
+        # type: (List[Task]) -> None
+        '''
+        Sets many tasks to be in progress at once. Taskers that can do this
+        more efficiently than one task at a time should override this.
+
+        Args:
+            tasks (List[Task]): The tasks to update.
+        '''
+        for task in tasks:
+            task.set_in_progress()
+
+    def set_verifying(self, tasks):
+        # type: (List[Task]) -> None
+        '''
+        Sets many tasks to be waiting for verification at once. Taskers that
+        can do this more efficiently than one task at a time should override
+        this.
+
+        Args:
+            tasks (List[Task]): The tasks to update.
+        '''
+        for task in tasks:
+            task.set_verifying()
+
+    def owns(self, username):
+        # type: (str) -> bool
+        '''
+        Checks if tasks for a user are handled by this tasker. Taskers which
+        split users between several bots should override this.
+
+        Args:
+            username (str): The username to check.
+        '''
+        return True
+
+    def add_alerts(self, alerts):
+        # type: (Iterable[NewAlert]) -> List[str]
+        '''
+        Creates new alerts for this tasker to hand out. By default they're
+        created in the database.
+
+        Args:
+            alerts (Iterable[NewAlert]): The alerts to create.
+        Returns:
+            List[str]: The hashes of alerts that weren't created because an
+                alert with the same hash already exists.
+        '''
+        return create_new_alerts(alerts)
+
 # Task status levels
 STATUS_LEVELS = enum('OPEN', 'INPROGRESS', 'VERIFICATION')
 
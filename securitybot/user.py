@@ -8,10 +8,12 @@ __email__ = 'abertsch@dropbox.com'
 import logging
 import pytz
 from datetime import datetime, timedelta
+import securitybot.ignore_rules as ignore_rules
 import securitybot.ignored_alerts as ignored_alerts
 from securitybot.tasker.tasker import Task
 from securitybot.auth.auth import AUTH_STATES
 from securitybot.state_machine import StateMachine
+from securitybot.sql import SQLEngineException
 from securitybot.util import tuple_builder, get_expiration_time
 
 from typing import Any, Dict, List
@@ -158,8 +160,19 @@ class User(object):
         return self._user.get(key, None)
 
     def step(self):
-        # type: () -> None
-        self._fsm.step()
+        # type: () -> bool
+        '''
+        Steps this user's state machine.
+
+        Returns:
+            (bool): Whether the user changed state.
+        '''
+        return self._fsm.step()
+
+    def waiting_on_auth(self):
+        # type: () -> bool
+        '''Checks if the user has an outstanding 2FA request to poll.'''
+        return str(self._fsm.state) == 'waiting_on_auth'
 
     def _update_auth(self):
         # type: () -> None
@@ -292,8 +305,21 @@ class User(object):
         Args:
             task (Task): The Task to add.
         '''
-        self.tasks.append(task)
-        self._update_tasks()
+        self.add_tasks([task])
+
+    def add_tasks(self, tasks, ignored=None):
+        # type: (List[Task], Dict[str, str]) -> None
+        '''
+        Adds several tasks to this user's new tasks at once.
+
+        Args:
+            tasks (List[Task]): The Tasks to add.
+            ignored (Dict[str, str]): This user's ignored alert titles and
+                reasons, if already looked up. Otherwise they're looked up here.
+        '''
+        self.tasks.extend(tasks)
+        self._update_tasks(ignored)
+        self.parent.mark_dirty(self)
 
     def _next_task(self):
         # type: () -> None
@@ -305,6 +331,7 @@ class User(object):
         self.parent.alert_user(self, self.pending_task)
         self._reset_message()
         self._escalation_time = get_expiration_time(datetime.now(tz=pytz.utc), ESCALATION_TIME)
+        self.parent.schedule_escalation(self, self._escalation_time)
         logging.info('Beginning task for {0}'.format(self['name']))
 
     def _complete_task(self):
@@ -320,6 +347,7 @@ class User(object):
                                        'auto backoff after confirmation', BACKOFF_TIME)
         self.pending_task.set_verifying()
         self.pending_task = None
+        self.parent.cancel_escalation(self)
         self._reset_message()
         self._update_tasks()
         if self.tasks:
@@ -328,21 +356,43 @@ class User(object):
             self.send_message('bye')
             self.parent.cleanup_user(self)
 
-    def _update_tasks(self):
-        # type: () -> None
-        '''
-        Updates the user's stored list of tasks, removing all of those that should be ignored.
+    def _update_tasks(self, ignored=None):
+        # type: (Dict[str, str]) -> None
         '''
-        ignored = ignored_alerts.get_ignored(self['name'])
+        Updates the user's stored list of tasks, removing all of those that should be ignored,
+        either by the user or by an ignore rule. If ignored alerts or rules can't be looked up,
+        every task they would have removed is kept.
+
+        Args:
+            ignored (Dict[str, str]): This user's ignored alert titles and
+                reasons, if already looked up.
+        '''
+        if ignored is None:
+            try:
+                ignored = ignored_alerts.get_ignored(self['name'])
+            except SQLEngineException as e:
+                logging.warn('Unable to look up ignored alerts for {0}: {1}'.format(self['name'], e))
+                ignored = {}
+        try:
+            rules = ignore_rules.get_matcher()
+        except SQLEngineException as e:
+            logging.warn('Unable to look up ignore rules: {0}'.format(e))
+            rules = ignore_rules.RuleMatcher()
         cleaned_tasks = []
+        ignored_tasks = []
         for task in self.tasks:
-            if task.title in ignored:
+            reason = ignored.get(task.title)
+            if reason is None:
+                reason = rules.match(self['name'], task.title)
+            if reason is not None:
                 logging.info('Ignoring task {0} for {1}'.format(task.title, self['name']))
-                task.comment = ignored[task.title]
-                task.set_verifying()
+                task.comment = reason
+                ignored_tasks.append(task)
             else:
                 cleaned_tasks.append(task)
         self.tasks = cleaned_tasks
+        if ignored_tasks:
+            self.parent.tasker.set_verifying(ignored_tasks)
 
     # Message methods
 
@@ -355,6 +405,7 @@ class User(object):
             text (str): Some message accompanying the response.
         '''
         self._last_message = tuple_builder(True, text)
+        self.parent.mark_dirty(self)
 
     def negative_response(self, text):
         # type: (str) -> None
@@ -365,6 +416,7 @@ class User(object):
             text (str): Some message accompanying the response.
         '''
         self._last_message = tuple_builder(False, text)
+        self.parent.mark_dirty(self)
 
     def send_message(self, key):
         # type: (str) -> None
@@ -3,11 +3,15 @@ __email__ = 'abertsch@dropbox.com'
 
 import pytz
 import binascii
+import logging
 import os
 from datetime import datetime, timedelta
 from collections import namedtuple
 
-from securitybot.sql import SQLEngine
+import securitybot.journal as journal
+from securitybot.sql import SQLEngine, SQLEngineUnavailable
+
+from typing import Any, Iterable, List, Set, Sequence, Tuple
 
 # http://stackoverflow.com/questions/36932/how-can-i-represent-an-enum-in-python
 def enum(*sequential, **named):
@@ -69,27 +73,114 @@ def get_expiration_time(start, time):
         end = next_day + delta
     return end
 
+# An alert to be created. If key is None, a random hash is used.
+NewAlert = namedtuple('NewAlert', ['title', 'ldap', 'description', 'reason', 'url', 'key'])
+NewAlert.__new__.__defaults__ = ('N/A', None)
+
+# Number of alerts to insert per statement and transaction
+ALERT_BATCH_SIZE = 500
+
+GET_EXISTING_HASHES = '''
+SELECT HEX(hash)
+FROM alerts
+WHERE hash IN ({0})
+'''
+
+# Formatted with the rows to insert and a clause leaving hashes which already
+# exist alone rather than failing the statement
+INSERT_ALERTS = '''
+INSERT INTO alerts (hash, ldap, title, description, reason, url, event_time,
+                    status, comment, performed, authenticated)
+VALUES {0}
+{1}
+'''
+
+def create_new_alerts(alerts, batch_size=ALERT_BATCH_SIZE):
+    # type: (Iterable[NewAlert], int) -> List[str]
+    '''
+    Creates many new alerts in the SQL DB. Alerts are written with one
+    multi-row INSERT per batch, each batch in its own transaction.
+
+    If the database is down and `securitybot.journal` has been started,
+    batches are journaled to be created later instead. Duplicates in those
+    batches can't be detected, and are silently skipped once replayed.
+
+    Args:
+        alerts (Iterable[NewAlert]): The alerts to create.
+        batch_size (int): The maximum number of alerts to write at a time.
+    Returns:
+        List[str]: The hashes of alerts that weren't created because an alert
+            with the same hash already exists.
+    '''
+    duplicates = [] # type: List[str]
+    batch = [] # type: List[NewAlert]
+    for alert in alerts:
+        # Generate random key if none provided
+        if alert.key is None:
+            alert = alert._replace(key=binascii.hexlify(os.urandom(32)))
+        batch.append(alert)
+        if len(batch) >= batch_size:
+            duplicates.extend(_insert_or_journal_alerts(batch))
+            batch = []
+    if batch:
+        duplicates.extend(_insert_or_journal_alerts(batch))
+    return duplicates
+
+def _insert_or_journal_alerts(alerts):
+    # type: (List[NewAlert]) -> List[str]
+    '''
+    Inserts a batch of alerts, or journals it if the database is down or
+    earlier writes are still waiting in the journal.
+    '''
+    if not journal.pending():
+        try:
+            return _insert_alerts(alerts)
+        except SQLEngineUnavailable as e:
+            if not journal.enabled():
+                raise
+            logging.warn('Journaling {0} alerts: {1}'.format(len(alerts), e))
+    journal.append([_insert_alerts_statement(alerts)], 'alerts', idempotent=True)
+    return []
+
+def _insert_alerts_statement(alerts):
+    # type: (List[NewAlert]) -> Tuple[str, Sequence[Any]]
+    '''
+    Builds a statement inserting a batch of alerts, skipping duplicates. The
+    event time is taken now rather than when the statement runs, which may be
+    much later for a journaled statement.
+    '''
+    values = ','.join(["(UNHEX(%s), %s, %s, %s, %s, %s, %s, 0, '', false, false)"
+                       for _ in alerts])
+    event_time = datetime.utcnow().replace(microsecond=0)
+    params = [] # type: List[Any]
+    for alert in alerts:
+        params.extend([alert.key, alert.ldap, alert.title, alert.description,
+                       alert.reason, alert.url, event_time])
+    return INSERT_ALERTS.format(values, SQLEngine.dialect().on_duplicate(['hash'], [])), params
+
+def _insert_alerts(alerts):
+    # type: (List[NewAlert]) -> List[str]
+    '''Inserts a batch of alerts, returning the hashes of any duplicates.'''
+    hash_in = ','.join(['UNHEX(%s)' for _ in alerts])
+    with SQLEngine.transaction(tag='alerts') as txn:
+        existing = {row[0] for row in
+                    txn.execute(GET_EXISTING_HASHES.format(hash_in),
+                                [alert.key for alert in alerts])}
+        txn.execute(*_insert_alerts_statement(alerts))
+
+    # Also catch duplicates within the batch itself
+    duplicates = [] # type: List[str]
+    seen = set() # type: Set[str]
+    for alert in alerts:
+        key = alert.key.upper()
+        if key in existing or key in seen:
+            duplicates.append(alert.key)
+        seen.add(key)
+    return duplicates
+
 def create_new_alert(title, ldap, description, reason, url='N/A', key=None):
     # type: (str, str, str, str, str, str) -> None
     '''
     Creates a new alert in the SQL DB with an optionally random hash.
     '''
-    # Generate random key if none provided
-    if key is None:
-        key = binascii.hexlify(os.urandom(32))
-
-    # Insert that into the database as a new alert
-    SQLEngine.execute('''
-    INSERT INTO alerts (hash, ldap, title, description, reason, url, event_time)
-    VALUES (UNHEX(%s), %s, %s, %s, %s, %s, NOW())
-    ''',
-    (key, ldap, title, description, reason, url))
-
-    SQLEngine.execute('''
-    INSERT INTO user_responses (hash, comment, performed, authenticated)
-    VALUES (UNHEX(%s), '', false, false)
-    ''',
-    (key,))
-
-    SQLEngine.execute('INSERT INTO alert_status (hash, status) VALUES (UNHEX(%s), 0)',
-                      (key,))
+    create_new_alerts([NewAlert(title, ldap, description, reason, url, key)])
@@ -0,0 +1,278 @@
+'''
+A write-behind queue for database writes made while handling users.
+
+Once started, writes submitted through `submit` are applied by a background
+thread instead of the caller, so a slow database doesn't hold up every
+conversation. Queued writes are applied strictly in the order they were
+submitted, so updates to any single alert are never reordered. Writes which
+queue up while a batch is being applied are grouped into a single commit.
+Until the queue is started, `submit` simply writes synchronously.
+
+If the database is down and `securitybot.journal` has been started, writes
+are journaled to be replayed later rather than waiting for the database.
+'''
+import logging
+import threading
+from collections import namedtuple
+from Queue import Queue
+
+import securitybot.journal as journal
+from securitybot.sql import SQLEngine, SQLEngineException, SQLEngineUnavailable
+
+from typing import Any, Dict, List, Sequence, Tuple
+
+# Maximum number of submissions waiting to be written. Submitting to a full
+# queue blocks until the database catches up.
+MAX_QUEUE_SIZE = 10000
+# Maximum number of submissions to group into one commit
+MAX_BATCH_SIZE = 200
+# Fraction of MAX_QUEUE_SIZE above which to warn about the queue's depth
+HIGH_WATER_MARK = 0.8
+# Query statistics tag for commits grouping writes from different callers
+MIXED_TAG = 'write_behind'
+# Shortest wait, in seconds, before trying again while the database is down
+UNAVAILABLE_WAIT = 1
+
+# Statements to apply as one transaction, the part of securitybot that
+# submitted them, and whether they're safe to apply twice
+Submission = namedtuple('Submission', ['statements', 'tag', 'idempotent'])
+
+# Sentinel telling the writer thread to exit
+_STOP = object()
+
+class WriteBehindQueue(object):
+    '''
+    A bounded FIFO of statements applied by a single writer thread.
+    '''
+
+    def __init__(self, max_size=MAX_QUEUE_SIZE, batch_size=MAX_BATCH_SIZE):
+        # type: (int, int) -> None
+        '''
+        Args:
+            max_size (int): The maximum number of queued submissions.
+            batch_size (int): The maximum number of submissions per commit.
+        '''
+        self._queue = Queue(max_size) # type: Queue
+        self._max_size = max_size
+        self._batch_size = batch_size
+        self._thread = threading.Thread(target=self._run, name='write-behind')
+        self._thread.daemon = True
+        self._warned = False
+        # Set once closing, to stop waiting for the database to come back
+        self._closing = threading.Event()
+
+        # Running totals for reporting
+        self.submitted = 0
+        self.commits = 0
+        self.failures = 0
+        self.journaled = 0
+
+    def start(self):
+        # type: () -> None
+        self._thread.start()
+
+    def submit(self, statements, tag=None, idempotent=False):
+        # type: (Sequence[Tuple[str, Sequence[Any]]], str, bool) -> None
+        '''
+        Queues statements to be applied as one transaction after everything
+        submitted before them. Blocks if the queue is full.
+
+        Args:
+            statements (List[Tuple[str, Tuple[str]]]): Pairs of queries and
+                their parameters.
+            tag (str): The part of securitybot making the writes.
+            idempotent (bool): Whether applying the statements twice has the
+                same effect as applying them once.
+        '''
+        self._queue.put(Submission(list(statements), tag, idempotent))
+        self.submitted += 1
+
+        depth = self.depth()
+        if depth > self._max_size * HIGH_WATER_MARK:
+            if not self._warned:
+                logging.warn('Write-behind queue is backed up: {0} pending writes.'.format(depth))
+                self._warned = True
+        else:
+            self._warned = False
+
+    def depth(self):
+        # type: () -> int
+        '''Returns the number of submissions waiting to be written.'''
+        return self._queue.qsize()
+
+    def pending(self):
+        # type: () -> bool
+        '''
+        Returns whether any submissions have yet to be written, including a
+        batch the writer thread is part way through.
+        '''
+        return self._queue.unfinished_tasks > 0
+
+    def stats(self):
+        # type: () -> Dict[str, int]
+        return {
+            'depth': self.depth(),
+            'submitted': self.submitted,
+            'commits': self.commits,
+            'failures': self.failures,
+            'journaled': self.journaled,
+        }
+
+    def flush(self):
+        # type: () -> None
+        '''Blocks until everything submitted so far has been written.'''
+        self._queue.join()
+
+    def close(self):
+        # type: () -> None
+        '''
+        Writes everything submitted so far and stops the writer thread. If
+        the database is down, writes still queued are dropped.
+        '''
+        self._closing.set()
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        # type: () -> None
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self._batch_size and not self._queue.empty():
+                batch.append(self._queue.get())
+
+            if _STOP in batch:
+                stopping = True
+            submissions = [item for item in batch if item is not _STOP]
+            try:
+                if submissions:
+                    self._write(submissions)
+            except Exception:
+                # Keep the writer alive, as nothing else would drain the queue
+                self.failures += len(submissions)
+                logging.exception('Dropping {0} write-behind submissions.'
+                                  .format(len(submissions)))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, submissions):
+        # type: (List[Submission]) -> None
+        '''
+        Applies a batch of submissions in one commit, journaling them or
+        waiting for the database if it's down. If that fails, applies them one
+        at a time so a single bad write can't hold up the others.
+        '''
+        if journal.pending():
+            # Keep behind writes still waiting to be replayed
+            self._journal(submissions)
+            return
+
+        tags = {submission.tag for submission in submissions}
+        tag = tags.pop() if len(tags) == 1 else MIXED_TAG
+        idempotent = all(submission.idempotent for submission in submissions)
+        statements = [s for submission in submissions for s in submission.statements]
+        while True:
+            try:
+                SQLEngine.execute_all(statements, tag, idempotent)
+                self.commits += 1
+                return
+            except SQLEngineUnavailable:
+                if journal.enabled():
+                    self._journal(submissions)
+                    return
+                if self._closing.is_set():
+                    break
+                # Hold on to the batch rather than dropping it; new writes
+                # queue up behind it until the queue is full
+                wait = max(SQLEngine.retry_after(), UNAVAILABLE_WAIT)
+                logging.warn('Database unavailable, retrying write-behind batch in {0:.0f}s.'
+                             .format(wait))
+                self._closing.wait(wait)
+            except SQLEngineException as e:
+                logging.warn('Write-behind batch failed, retrying individually: {0}'.format(e))
+                break
+
+        for statements, tag, idempotent in submissions:
+            try:
+                SQLEngine.execute_all(statements, tag, idempotent)
+                self.commits += 1
+            except SQLEngineException as e:
+                self.failures += 1
+                logging.error('Dropping failed write {0}: {1}'.format(statements, e))
+
+    def _journal(self, submissions):
+        # type: (List[Submission]) -> None
+        '''Journals submissions to be applied once the database is back.'''
+        for submission in submissions:
+            journal.append(*submission)
+            self.journaled += 1
+
+# The queue in use, if write-behind has been started
+_writer = None # type: WriteBehindQueue
+
+def start(max_size=MAX_QUEUE_SIZE, batch_size=MAX_BATCH_SIZE):
+    # type: (int, int) -> None
+    '''
+    Starts applying writes in the background.
+
+    Args:
+        max_size (int): The maximum number of queued submissions.
+        batch_size (int): The maximum number of submissions per commit.
+    '''
+    global _writer
+    if _writer is None:
+        _writer = WriteBehindQueue(max_size, batch_size)
+        _writer.start()
+
+def stop():
+    # type: () -> None
+    '''Flushes all pending writes and goes back to writing synchronously.'''
+    global _writer
+    if _writer is not None:
+        writer, _writer = _writer, None
+        writer.close()
+
+def submit(statements, tag=None, idempotent=False):
+    # type: (Sequence[Tuple[str, Sequence[Any]]], str, bool) -> None
+    '''
+    Applies statements as one transaction, either in the background if
+    write-behind has been started or immediately otherwise.
+
+    Args:
+        statements (List[Tuple[str, Tuple[str]]]): Pairs of queries and
+            their parameters.
+        tag (str): The part of securitybot making the writes, which their
+            query statistics are recorded under.
+        idempotent (bool): Whether applying the statements twice has the
+            same effect as applying them once, so they can be retried if the
+            connection is lost while committing.
+    '''
+    if _writer is not None:
+        _writer.submit(statements, tag, idempotent)
+    elif journal.pending():
+        journal.append(statements, tag, idempotent)
+    else:
+        try:
+            SQLEngine.execute_all(statements, tag, idempotent)
+        except SQLEngineUnavailable:
+            if not journal.enabled():
+                raise
+            journal.append(statements, tag, idempotent)
+
+def depth():
+    # type: () -> int
+    '''Returns the number of writes waiting to be applied.'''
+    return _writer.depth() if _writer is not None else 0
+
+def pending():
+    # type: () -> bool
+    '''Returns whether any writes have yet to be applied or journaled.'''
+    return _writer is not None and _writer.pending()
+
+def stats():
+    # type: () -> Dict[str, int]
+    '''Returns counters describing the write-behind queue.'''
+    if _writer is None:
+        return {'depth': 0, 'submitted': 0, 'commits': 0, 'failures': 0, 'journaled': 0}
+    return _writer.stats()
@@ -11,6 +11,7 @@ import securitybot.bot as bot
 import securitybot.commands as commands
 import securitybot.user
 import securitybot.chat.chat
+from securitybot.scheduler import DeadlineScheduler
 
 MAIN_CONFIG = 'config/bot.yaml'
 COMMAND_CONFIG = 'config/commands.yaml'
@@ -30,6 +31,11 @@ def fake_init(self, tasker, auth_builder, reporting_channel, client):
     self.users = {}
     self.users_by_name = {}
     self.active_users = {}
+    self.escalations = DeadlineScheduler()
+    self.dirty_users = set()
+    self.auth_users = set()
+    self.skipped_steps = 0
+    self.total_skipped_steps = 0
 
     self.commands = {}
 
@@ -70,7 +76,7 @@ class BotMessageTest(TestCase):
     Tests different kinds of message handling.
     '''
     def setUp(self):
-        self.bot = bot.SecurityBot(None, None, None)
+        self.bot = bot.SecurityBot(Mock(), None, None)
         self.bot.messages['bad_command'] = 'bad-command'
         self.bot.users = {'id': {'id': 'id', 'name': 'name'}}
 
@@ -96,6 +102,19 @@ class BotMessageTest(TestCase):
         self.bot.handle_messages()
         self.bot.chat.message_user.assert_called_with(self.bot.users['id'], 'bad-command')
 
+    def test_handle_messages_other_worker(self):
+        '''Test receiving a message from a user belonging to another worker.'''
+        self.bot.commands = {'test': None}
+        self.bot.handle_command = Mock()
+        self.bot.tasker.owns.return_value = False
+        self.bot.chat.get_messages.return_value = [{'type': 'message',
+                                                    'user': 'id',
+                                                    'channel': 'D12345',
+                                                    'text': 'test command'}]
+        self.bot.handle_messages()
+        assert not self.bot.handle_command.called
+        self.bot.tasker.owns.assert_called_with('name')
+
     def test_handle_messages_not_dm(self):
         '''Test receiving a message that's not from a DM channel.'''
         self.bot.user_lookup = Mock()
@@ -157,7 +176,15 @@ class BotTaskTest(TestCase):
         self.ignored_alerts = ignored_alerts
         ignored_alerts.__update_ignored_list = Mock()
         ignored_alerts.get_ignored = Mock(return_value={})
+        ignored_alerts.get_ignored_for_users = Mock(
+            side_effect=lambda usernames: {username: {} for username in usernames})
         ignored_alerts.ignore_task = Mock()
+        ignored_alerts.refresh = Mock()
+
+        import securitybot.ignore_rules as ignore_rules
+        self.ignore_rules = ignore_rules
+        ignore_rules.get_matcher = Mock(return_value=ignore_rules.RuleMatcher())
+        ignore_rules.refresh = Mock()
 
     def tearDown(self):
         self.patch_task.stop()
@@ -170,27 +197,55 @@ class BotTaskTest(TestCase):
         self.bot.handle_new_tasks()
         self.bot.greet_user.assert_called_with(self.user)
         assert self.user['id'] in self.bot.active_users
+        self.bot.tasker.set_in_progress.assert_called_with([self.task])
+        assert self.user.tasks == [self.task]
 
     def test_blacklisted_task(self):
         '''Tests receiving a new task that is blacklisted.'''
         self.bot.blacklist.is_present.return_value = True
         self.bot.handle_new_tasks()
         assert self.task.comment == 'blacklisted'
-        self.task.set_verifying.assert_called_with()
+        self.bot.tasker.set_verifying.assert_called_with([self.task])
+        assert not self.bot.tasker.set_in_progress.called
 
     def test_ignored_task(self):
         '''Tests receiving a new task that is ignored by the user.'''
-        self.ignored_alerts.get_ignored = Mock(return_value={'title': 'ignored'})
+        self.ignored_alerts.get_ignored_for_users = Mock(
+            return_value={'user': {'title': 'ignored'}})
         self.bot.handle_new_tasks()
         assert self.task.comment == 'ignored'
-        self.task.set_verifying.assert_called_with()
+        self.bot.tasker.set_verifying.assert_called_with([self.task])
+
+    def test_ignore_rule_task(self):
+        '''Tests receiving a new task matching an ignore rule.'''
+        rule = self.ignore_rules.IgnoreRule('*', 'ti*', 'storm', datetime.max)
+        self.ignore_rules.get_matcher.return_value = self.ignore_rules.RuleMatcher([rule])
+        self.bot.handle_new_tasks()
+        assert self.task.comment == 'storm'
+        self.bot.tasker.set_verifying.assert_called_with([self.task])
+
+    def test_ignored_looked_up_once(self):
+        '''Tests that ignored alerts are looked up once for a batch of tasks.'''
+        self.bot.tasker.get_new_tasks.return_value = [self.task, self.task]
+        self.bot.handle_new_tasks()
+        self.ignored_alerts.get_ignored_for_users.assert_called_once_with(['user'])
+        assert not self.ignored_alerts.get_ignored.called
+        assert self.user.tasks == [self.task, self.task]
 
     def test_no_user_task(self):
         '''Tests a task assigned to an unknown or invalid username.'''
         self.task.username = 'another user'
         self.bot.handle_new_tasks()
         assert self.task.comment == 'invalid user'
-        self.task.set_verifying.assert_called_with()
+        self.bot.tasker.set_verifying.assert_called_with([self.task])
+
+    @patch('securitybot.bot.RECOVERY_BATCH_SIZE', 1)
+    def test_recover_tasks_in_batches(self):
+        '''Tests that in progress tasks are recovered a batch at a time.'''
+        self.bot.tasker.iter_active_tasks.return_value = iter([self.task, self.task])
+        self.bot.recover_in_progress_tasks()
+        assert self.bot.tasker.set_in_progress.call_count == 2
+        assert self.user.tasks == [self.task, self.task]
 
 class BotUserTest(TestCase):
     def test_populate(self):
@@ -213,9 +268,78 @@ class BotUserTest(TestCase):
         '''
         sb = bot.SecurityBot(None, None, None)
         sb.active_users = {'key': user}
+        sb.dirty_users = {'key'}
         sb.handle_users()
         user.step.assert_called_with()
 
+    @patch('securitybot.user.User', autospec=True)
+    def test_step_skips_clean(self, user):
+        '''
+        Tests that users who aren't dirty are only stepped once their
+        escalation deadline passes.
+        '''
+        sb = bot.SecurityBot(None, None, None)
+        sb.active_users = {'key': user}
+        user.step.return_value = False
+        user.waiting_on_auth.return_value = False
+        sb.handle_users()
+        assert not user.step.called
+        assert sb.skipped_steps == 1
+        sb.escalations.schedule('key', datetime.min.replace(tzinfo=pytz.utc))
+        sb.handle_users()
+        user.step.assert_called_with()
+        assert sb.skipped_steps == 0
+        assert sb.total_skipped_steps == 1
+
+    @patch('securitybot.user.User', autospec=True)
+    def test_step_keeps_progressing(self, user):
+        '''
+        Tests that users stay dirty while they change state or wait on 2FA.
+        '''
+        sb = bot.SecurityBot(None, None, None)
+        sb.active_users = {'key': user}
+        sb.mark_dirty({'id': 'key'})
+        user.step.return_value = True
+        user.waiting_on_auth.return_value = True
+        sb.handle_users()
+        assert 'key' in sb.dirty_users
+        assert sb.needs_auth_poll()
+        user.step.return_value = False
+        sb.handle_users(poll_auth=False)
+        assert 'key' not in sb.dirty_users
+        user.step.reset_mock()
+        sb.handle_users(poll_auth=False)
+        assert not user.step.called
+        sb.handle_users()
+        user.step.assert_called_with()
+
+    @patch('securitybot.user.User', autospec=True)
+    def test_step_reports_change(self, user):
+        '''
+        Tests that stepping users reports whether any user changed state.
+        '''
+        sb = bot.SecurityBot(None, None, None)
+        sb.active_users = {'key': user}
+        sb.dirty_users = {'key'}
+        user.step.return_value = False
+        assert not sb.handle_users()
+        sb.dirty_users = {'key'}
+        user.step.return_value = True
+        assert sb.handle_users()
+
+    def test_next_escalation_time(self):
+        '''
+        Tests finding the earliest escalation deadline among active users.
+        '''
+        sb = bot.SecurityBot(None, None, None)
+        user = {'id': 'id', 'name': 'user'}
+        assert sb.next_escalation_time() is None
+        deadline = datetime(year=2016, month=7, day=18, tzinfo=pytz.utc)
+        sb.schedule_escalation(user, deadline)
+        assert sb.next_escalation_time() == deadline
+        sb.cleanup_user(user)
+        assert sb.next_escalation_time() is None
+
 class BotHelperTest(TestCase):
     '''
     Test cases for help functions in the bot that don't require
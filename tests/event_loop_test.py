@@ -0,0 +1,34 @@
+from unittest2 import TestCase
+from mock import Mock
+
+from datetime import timedelta
+
+from securitybot.chat.chat import ChatException
+from securitybot.event_loop import BotEventLoop
+
+class BotEventLoopTest(TestCase):
+    def setUp(self):
+        self.bot = Mock()
+        self.bot.chat.fileno.return_value = 3
+        self.io_loop = Mock()
+        self.loop = BotEventLoop(self.bot, timedelta(seconds=60), io_loop=self.io_loop)
+        self.loop._chat_fd = 3
+
+    def test_reconnect(self):
+        '''Tests that a dropped chat connection is swapped for a new one.'''
+        self.bot.handle_messages.side_effect = ChatException('gone')
+        self.bot.chat.fileno.return_value = 4
+        self.loop._on_chat_readable(3, None)
+        self.io_loop.remove_handler.assert_called_once_with(3)
+        self.bot.chat.connect.assert_called_once_with()
+        assert self.io_loop.add_handler.call_args[0][0] == 4
+        assert not self.io_loop.stop.called
+
+    def test_reconnect_failed(self):
+        '''Tests that the loop stops if chat can't be reconnected to.'''
+        self.bot.handle_messages.side_effect = ChatException('gone')
+        self.bot.chat.connect.side_effect = ChatException('still gone')
+        self.loop._on_chat_readable(3, None)
+        self.io_loop.remove_handler.assert_called_once_with(3)
+        assert not self.io_loop.add_handler.called
+        self.io_loop.stop.assert_called_once_with()
@@ -0,0 +1,30 @@
+from unittest2 import TestCase
+
+from securitybot.tasker.hash_ring import HashRing
+
+USERNAMES = ['user{0}'.format(i) for i in range(1000)]
+
+class HashRingTest(TestCase):
+    def test_empty(self):
+        '''Tests that an empty ring has no owners.'''
+        assert HashRing([]).get_node('user') is None
+
+    def test_stable(self):
+        '''Tests that keys map to the same node regardless of node order.'''
+        first = HashRing(['a', 'b', 'c'])
+        second = HashRing(['c', 'a', 'b'])
+        for name in USERNAMES:
+            assert first.get_node(name) == second.get_node(name)
+
+    def test_spread(self):
+        '''Tests that every node receives some keys.'''
+        ring = HashRing(['a', 'b', 'c'])
+        assert {ring.get_node(name) for name in USERNAMES} == {'a', 'b', 'c'}
+
+    def test_remove_node(self):
+        '''Tests that removing a node only moves the keys it owned.'''
+        before = HashRing(['a', 'b', 'c'])
+        after = HashRing(['a', 'b'])
+        for name in USERNAMES:
+            if before.get_node(name) != 'c':
+                assert before.get_node(name) == after.get_node(name)
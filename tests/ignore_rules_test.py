@@ -0,0 +1,47 @@
+from unittest2 import TestCase
+
+from datetime import datetime, timedelta
+
+from securitybot.ignore_rules import IgnoreRule, RuleMatcher, split_pattern
+
+class RuleMatcherTest(TestCase):
+    def setUp(self):
+        self.now = datetime(2016, 7, 18, 12)
+        self.until = self.now + timedelta(hours=1)
+
+    def matcher(self, *rules):
+        return RuleMatcher([IgnoreRule(users, title, reason, self.until)
+                            for users, title, reason in rules],
+                           {'oncall': {'alice', 'bob'}})
+
+    def test_split_pattern(self):
+        assert split_pattern('okta_login') == ('okta_login', '')
+        assert split_pattern('okta_*') == ('okta_', '*')
+        assert split_pattern('okta_*_login') == ('okta_', '*_login')
+
+    def test_exact(self):
+        matcher = self.matcher(('alice', 'okta_login', 'exact'))
+        assert matcher.match('alice', 'okta_login', self.now) == 'exact'
+        assert matcher.match('alice', 'okta_login_2', self.now) is None
+        assert matcher.match('alice', 'okta', self.now) is None
+        assert matcher.match('bob', 'okta_login', self.now) is None
+
+    def test_prefix_and_glob(self):
+        matcher = self.matcher(('*', 'okta_*', 'prefix'),
+                               ('*', 'duo_*_failed', 'glob'))
+        assert matcher.match('anyone', 'okta_', self.now) == 'prefix'
+        assert matcher.match('anyone', 'okta_login', self.now) == 'prefix'
+        assert matcher.match('anyone', 'duo_push_failed', self.now) == 'glob'
+        assert matcher.match('anyone', 'duo_push_passed', self.now) is None
+        assert matcher.match('anyone', 'okt', self.now) is None
+
+    def test_groups(self):
+        matcher = self.matcher(('@oncall', 'pager*', 'group'),
+                               ('@nobody', '*', 'empty group'))
+        assert matcher.match('alice', 'pager_storm', self.now) == 'group'
+        assert matcher.match('carol', 'pager_storm', self.now) is None
+
+    def test_expired(self):
+        matcher = self.matcher(('*', '*', 'everything'))
+        assert matcher.match('alice', 'title', self.now) == 'everything'
+        assert matcher.match('alice', 'title', self.until) is None
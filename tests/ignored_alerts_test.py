@@ -0,0 +1,32 @@
+from unittest2 import TestCase
+
+from datetime import datetime, timedelta
+
+from securitybot.ignored_alerts import IgnoredCache
+
+class IgnoredCacheTest(TestCase):
+    def setUp(self):
+        self.cache = IgnoredCache()
+        self.now = datetime(2016, 7, 18, 12)
+
+    def test_expire(self):
+        self.cache.put('user', 'first', 'reason', self.now + timedelta(hours=1))
+        self.cache.put('user', 'second', 'reason', self.now + timedelta(hours=2))
+        assert self.cache.expire(self.now + timedelta(hours=1)) == 1
+        assert self.cache.expire(self.now + timedelta(hours=1)) == 0
+        assert self.cache._ignored == {'user': {'second': ('reason', self.now + timedelta(hours=2))}}
+        assert self.cache.expire(self.now + timedelta(hours=3)) == 1
+        assert self.cache._ignored == {}
+
+    def test_extend(self):
+        '''Tests that extending an ignore keeps it past its first expiry.'''
+        self.cache.put('user', 'title', 'first', self.now + timedelta(hours=1))
+        self.cache.put('user', 'title', 'second', self.now + timedelta(hours=2))
+        assert self.cache.expire(self.now + timedelta(hours=1)) == 0
+        assert self.cache._ignored['user']['title'][0] == 'second'
+
+    def test_put_unchanged(self):
+        '''Tests that reloading an ignore doesn't grow the heap.'''
+        for _ in range(3):
+            self.cache.put('user', 'title', 'reason', self.now)
+        assert len(self.cache._expiry) == 1
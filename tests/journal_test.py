@@ -0,0 +1,112 @@
+from unittest2 import TestCase
+from mock import Mock, patch
+
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+import securitybot.journal as journal
+import securitybot.write_behind as write_behind
+from securitybot.sql import SQLEngineUnavailable
+
+class JournalTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'journal')
+        self.journal = journal.Journal(self.path)
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.dir)
+
+    def replay(self):
+        records = []
+        self.journal.replay(records.append)
+        return [record['statements'][0][1][0] for record in records]
+
+    def test_replay_in_order(self):
+        self.journal.append([('query', (1,))], 'tasker', True)
+        self.journal.append([('query', (datetime(2016, 7, 18),))])
+        assert self.journal.pending()
+        assert self.replay() == [1, '2016-07-18 00:00:00']
+        assert not self.journal.pending()
+        assert os.path.getsize(self.path) == 0
+
+    def test_sync_unlocked(self):
+        '''Tests that appends don't wait for the disk to be flushed.'''
+        # Keep the background syncer out of the way
+        self.journal.close()
+        self.journal = journal.Journal(self.path, sync_interval=60)
+        self.journal.append([('query', (1,))])
+
+        def fsync(fd):
+            assert self.journal._lock.acquire(False)
+            self.journal._lock.release()
+        with patch('os.fsync', side_effect=fsync) as mock_fsync:
+            self.journal.sync()
+            self.journal.sync()
+        assert mock_fsync.call_count == 1
+
+    def test_resume(self):
+        '''Tests that a failed replay picks up where it left off.'''
+        for i in range(3):
+            self.journal.append([('query', (i,))])
+        apply_fn = Mock(side_effect=[None, SQLEngineUnavailable('down')])
+        with self.assertRaises(SQLEngineUnavailable):
+            self.journal.replay(apply_fn)
+        assert self.journal.pending()
+        assert self.replay() == [1, 2]
+
+    def test_torn_record(self):
+        '''Tests that a partly written record and anything after it are dropped.'''
+        self.journal.append([('query', (1,))])
+        record = journal.encode_record([('query', (2,))], None, False)
+        with open(self.path, 'ab') as f:
+            f.write(record[:-1])
+        assert self.replay() == [1]
+        self.journal.append([('query', (3,))])
+        assert self.replay() == [3]
+
+    def test_batches(self):
+        '''Tests replaying more records than are read at once.'''
+        for i in range(5):
+            self.journal.append([('query', (i,))])
+        with patch.object(journal, 'REPLAY_BATCH_SIZE', 2):
+            with patch.object(self.journal, '_write_offset',
+                              wraps=self.journal._write_offset) as write_offset:
+                assert self.replay() == [0, 1, 2, 3, 4]
+        # Once per batch, and once more when the journal is emptied
+        assert write_offset.call_count == 4
+        assert os.path.getsize(self.path) == 0
+
+    def test_crash_during_reset(self):
+        '''Tests a crash after truncating a replayed journal but before resetting its offset.'''
+        for i in range(2):
+            self.journal.append([('query', (i,))])
+        self.journal._write_offset(os.path.getsize(self.path))
+        with open(self.path, 'r+b') as f:
+            f.truncate(0)
+        assert not self.journal.pending()
+
+        for i in range(3):
+            self.journal.append([('query', (i,))])
+        assert self.journal.pending()
+        assert self.replay() == [0, 1, 2]
+
+    @patch('securitybot.write_behind.SQLEngine')
+    def test_write_behind(self, engine):
+        '''Tests that writes are journaled while the database is down, and stay in order.'''
+        engine.execute_all.side_effect = SQLEngineUnavailable('down')
+        with patch.object(journal, '_journal', self.journal):
+            write_behind.submit([('query', (1,))])
+            engine.execute_all.side_effect = None
+            write_behind.submit([('query', (2,))])
+        assert engine.execute_all.call_count == 1
+        assert self.replay() == [1, 2]
+
+    def test_missing_directory(self):
+        '''Tests that writes aren't journaled if the journal can't be opened.'''
+        journal.start(os.path.join(self.dir, 'missing', 'journal'))
+        assert not journal.enabled()
+        journal.stop()
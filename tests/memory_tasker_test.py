@@ -0,0 +1,50 @@
+from unittest2 import TestCase
+
+from securitybot.tasker.memory_tasker import MemoryTasker
+from securitybot.tasker.tasker import STATUS_LEVELS
+from securitybot.util import NewAlert
+
+class MemoryTaskerTest(TestCase):
+    def setUp(self):
+        self.tasker = MemoryTasker()
+
+    def test_new_tasks(self):
+        '''Tests that new tasks are returned once, in order.'''
+        alerts = [NewAlert('title', 'user{0}'.format(i), 'desc', 'reason') for i in range(3)]
+        assert self.tasker.add_alerts(alerts) == []
+        tasks = self.tasker.get_new_tasks()
+        assert [task.username for task in tasks] == ['user0', 'user1', 'user2']
+        assert self.tasker.get_new_tasks() == []
+
+    def test_duplicates(self):
+        alert = NewAlert('title', 'user', 'desc', 'reason', key='ab')
+        assert self.tasker.add_alerts([alert, alert]) == ['ab']
+        assert len(self.tasker.get_new_tasks()) == 1
+
+    def test_status(self):
+        '''Tests moving tasks between status levels.'''
+        self.tasker.add_alerts([NewAlert('title', 'user', 'desc', 'reason')])
+        task = self.tasker.get_new_tasks()[0]
+        task.set_in_progress()
+        assert self.tasker.get_active_tasks() == [task]
+        task.set_verifying()
+        assert self.tasker.get_active_tasks() == []
+        assert self.tasker.get_pending_tasks() == [task]
+        assert self.tasker.counts()[STATUS_LEVELS.VERIFICATION] == 1
+        assert self.tasker.close_pending_tasks() == 1
+        assert self.tasker.get_pending_tasks() == []
+
+    def test_inject(self):
+        alerts = [NewAlert('title', 'user', 'desc', 'reason') for _ in range(5)]
+        self.tasker.inject(alerts, 1000).join()
+        assert len(self.tasker.get_new_tasks()) == 5
+
+    def test_max_pending(self):
+        '''Tests that the oldest tasks waiting for verification are closed.'''
+        tasker = MemoryTasker(max_pending=1)
+        tasker.add_alerts([NewAlert('title', 'user', 'desc', 'reason', key=key)
+                           for key in ['aa', 'bb']])
+        first, second = tasker.get_new_tasks()
+        first.set_verifying()
+        second.set_verifying()
+        assert tasker.get_pending_tasks() == [second]
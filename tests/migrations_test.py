@@ -0,0 +1,42 @@
+from unittest2 import TestCase
+from mock import Mock, patch
+
+import securitybot.migrations as migrations
+from securitybot.dialect import MySQLDialect
+
+class MigrationsTest(TestCase):
+    @patch('securitybot.migrations.SQLEngine')
+    def test_migrate_pending(self, engine):
+        '''Tests that only unapplied migrations are run, in order.'''
+        engine.execute.side_effect = lambda query, params=None: (
+            ((1,),) if query == migrations.GET_VERSIONS else ())
+        first, second = Mock(), Mock()
+        with patch.object(migrations, 'MIGRATIONS', [(1, 'first', first),
+                                                     (2, 'second', second)]):
+            migrations.migrate()
+        assert not first.called
+        second.assert_called_with()
+        assert engine.execute.call_args[0][1] == (2, 'second')
+
+    @patch('securitybot.migrations.SQLEngine')
+    def test_add_index_exists(self, engine):
+        '''Tests that existing indexes aren't added again.'''
+        engine.dialect.return_value = MySQLDialect.__new__(MySQLDialect)
+        engine.execute.return_value = ((1,),)
+        migrations.add_index('alerts', 'ldap_idx', ['ldap'])
+        engine.execute.assert_called_once_with(MySQLDialect.index_exists,
+                                               ('alerts', 'ldap_idx'))
+
+    @patch('securitybot.migrations.SQLEngine')
+    def test_add_index_online(self, engine):
+        '''Tests that new indexes are built online on MySQL.'''
+        engine.dialect.return_value = MySQLDialect.__new__(MySQLDialect)
+        engine.execute.return_value = ()
+        migrations.add_index('alerts', 'ldap_idx', ['ldap'])
+        query = engine.execute.call_args[0][0]
+        assert 'ADD INDEX ldap_idx ( ldap )' in query
+        assert 'LOCK=NONE' in query
+
+    def test_versions_ordered(self):
+        versions = [version for version, _, _ in migrations.MIGRATIONS]
+        assert versions == sorted(set(versions))
@@ -0,0 +1,41 @@
+from unittest2 import TestCase
+
+from datetime import datetime, timedelta
+
+from securitybot.scheduler import DeadlineScheduler
+
+START = datetime(year=2016, month=7, day=18)
+
+class DeadlineSchedulerTest(TestCase):
+    def test_pop_due(self):
+        '''Tests that only keys with passed deadlines are returned.'''
+        scheduler = DeadlineScheduler()
+        scheduler.schedule('late', START + timedelta(hours=2))
+        scheduler.schedule('early', START + timedelta(hours=1))
+        assert scheduler.pop_due(START) == []
+        assert scheduler.pop_due(START + timedelta(hours=3)) == ['early', 'late']
+        assert len(scheduler) == 0
+
+    def test_deadline_is_exclusive(self):
+        '''Tests that a key isn't due at exactly its deadline.'''
+        scheduler = DeadlineScheduler()
+        scheduler.schedule('key', START)
+        assert scheduler.pop_due(START) == []
+        assert scheduler.pop_due(START + timedelta(seconds=1)) == ['key']
+
+    def test_reschedule(self):
+        '''Tests that rescheduling replaces the old deadline.'''
+        scheduler = DeadlineScheduler()
+        scheduler.schedule('key', START)
+        scheduler.schedule('key', START + timedelta(hours=2))
+        assert scheduler.next_deadline() == START + timedelta(hours=2)
+        assert scheduler.pop_due(START + timedelta(hours=1)) == []
+        assert 'key' in scheduler
+
+    def test_cancel(self):
+        '''Tests that cancelled keys never come due.'''
+        scheduler = DeadlineScheduler()
+        scheduler.schedule('key', START)
+        scheduler.cancel('key')
+        assert scheduler.next_deadline() is None
+        assert scheduler.pop_due(START + timedelta(hours=1)) == []
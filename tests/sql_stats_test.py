@@ -0,0 +1,33 @@
+from unittest2 import TestCase
+
+from securitybot.sql_stats import QueryStats, fingerprint
+
+class SQLStatsTest(TestCase):
+    def test_fingerprint(self):
+        '''Tests that batches of different sizes share a fingerprint.'''
+        one = fingerprint('SELECT * FROM alerts\n    WHERE hash IN (UNHEX(%s))')
+        many = fingerprint('SELECT * FROM alerts WHERE hash IN (UNHEX(%s), UNHEX(%s),UNHEX(%s))')
+        assert many == 'SELECT * FROM alerts WHERE hash IN (...)'
+        assert one == 'SELECT * FROM alerts WHERE hash IN (UNHEX(%s))'
+        assert fingerprint('INSERT INTO t VALUES (%s, %s), (%s, %s)') == \
+            'INSERT INTO t VALUES (...)'
+
+    def test_record(self):
+        stats = QueryStats(slow_query_time=1)
+        stats.record('tasker', 'SELECT 1', 0.002, 1)
+        stats.record('tasker', 'SELECT  1', 2, 3)
+        stats.record(None, 'SELECT 2', 0.5, 0)
+
+        first, second = stats.stats()
+        assert first['tag'] == 'tasker'
+        assert first['count'] == 2
+        assert first['rows'] == 4
+        assert first['max_time'] == 2
+        assert [count for _, count in first['histogram']] == [0, 1, 0, 0, 0, 0, 0, 1, 0]
+        assert second['tag'] == 'untagged'
+
+        slow = stats.slow_queries()
+        assert [(q['tag'], q['fingerprint'], q['elapsed']) for q in slow] == \
+            [('tasker', 'SELECT 1', 2)]
+        stats.reset()
+        assert stats.stats() == []
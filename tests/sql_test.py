@@ -0,0 +1,559 @@
+from unittest2 import TestCase
+from mock import Mock, patch
+
+import calendar
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from securitybot.dialect import MySQLDialect, SQLiteDialect
+from securitybot.sql import (SQLEngine, SQLEngineException, SQLEngineUnavailable, CircuitBreaker,
+                             ConnectionPool, RetryPolicy, init_sqlite)
+from securitybot.blacklist.sql_blacklist import SQLBlacklist
+from securitybot.tasker.sql_tasker import SQLTasker
+from securitybot.tasker.sharded_sql_tasker import ShardedSQLTasker
+from securitybot.tasker.hash_ring import HashRing
+from securitybot.tasker.tasker import STATUS_LEVELS
+from securitybot.util import NewAlert, create_new_alerts
+from securitybot.ignored_alerts import (get_ignored, get_ignored_for_users, ignore_task, refresh,
+                                       reset_cache, sweep)
+from securitybot.ignore_rules import (add_rule, add_to_group, get_matcher, remove_rule,
+                                     reset as reset_rules)
+import securitybot.journal as journal
+import securitybot.write_behind as write_behind
+import securitybot.migrations as migrations
+import securitybot.archive as archive
+from frontend import securitybot_api as api
+
+class SQLiteTest(TestCase):
+    '''
+    Runs the SQL used throughout securitybot against an on-disk SQLite
+    database.
+    '''
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        init_sqlite(os.path.join(self.dir, 'securitybot.db'))
+        migrations.migrate()
+        reset_cache()
+        reset_rules()
+
+    def tearDown(self):
+        SQLEngine._pool.close()
+        SQLEngine._pool = None
+        SQLEngine._dialect = None
+        shutil.rmtree(self.dir)
+
+    def test_migrate_twice(self):
+        '''Tests that migrating an up to date database does nothing.'''
+        assert migrations.pending_migrations() == []
+        migrations.migrate()
+
+    def test_transaction_rollback(self):
+        '''Tests that a failed transaction leaves nothing behind.'''
+        with self.assertRaises(SQLEngineException):
+            with SQLEngine.transaction() as txn:
+                txn.execute('INSERT INTO blacklist (ldap) VALUES (%s)', ('user',))
+                txn.execute('INSERT INTO blacklist (ldap) VALUES (%s)', ('user',))
+        assert SQLEngine.execute('SELECT ldap FROM blacklist') == []
+
+    def test_iterate(self):
+        for name in ['a', 'b', 'c']:
+            SQLEngine.execute('INSERT INTO blacklist (ldap) VALUES (%s)', (name,))
+        rows = SQLEngine.iterate('SELECT ldap FROM blacklist ORDER BY ldap', chunk_size=2)
+        assert [row[0] for row in rows] == ['a', 'b', 'c']
+
+    def test_autocommit(self):
+        '''Tests that single statements commit at once, and transactions only at the end.'''
+        other = sqlite3.connect(os.path.join(self.dir, 'securitybot.db'))
+        try:
+            SQLEngine.execute('INSERT INTO blacklist (ldap) VALUES (%s)', ('first',))
+            assert other.execute('SELECT ldap FROM blacklist').fetchall() == [('first',)]
+            with SQLEngine.transaction() as txn:
+                txn.execute('INSERT INTO blacklist (ldap) VALUES (%s)', ('second',))
+                assert other.execute('SELECT COUNT(*) FROM blacklist').fetchall() == [(1,)]
+            assert other.execute('SELECT COUNT(*) FROM blacklist').fetchall() == [(2,)]
+        finally:
+            other.close()
+
+    def test_tasker(self):
+        '''Tests creating alerts and moving them through the tasker.'''
+        duplicates = create_new_alerts([NewAlert('title', 'user', 'desc', 'reason', key='ab'),
+                                        NewAlert('title', 'user', 'desc', 'reason', key='ab')])
+        assert duplicates == ['ab']
+
+        tasker = SQLTasker()
+        tasks = tasker.get_new_tasks()
+        assert [task.hash for task in tasks] == ['AB']
+        assert tasker.get_new_tasks() == []
+
+        tasker.set_in_progress(tasks)
+        assert [task.hash for task in tasker.iter_active_tasks()] == ['AB']
+
+        tasks[0].comment = 'comment'
+        tasks[0].performed = True
+        tasker.set_verifying(tasks)
+        pending = tasker.get_pending_tasks()
+        assert pending[0].comment == 'comment'
+        assert pending[0].performed
+        assert pending[0].status == STATUS_LEVELS.VERIFICATION
+
+    def test_new_tasks_batches(self):
+        '''Tests that new tasks are fetched in batches up to a limit per poll.'''
+        create_new_alerts([NewAlert('title', 'user', 'desc', 'reason', key='{0:02x}'.format(i))
+                           for i in range(5)])
+        tasker = SQLTasker(batch_size=2, max_new_tasks=3)
+        tasker._last_rescan = datetime.now()
+        assert [task.hash for task in tasker.get_new_tasks()] == ['00', '01', '02']
+        assert [task.hash for task in tasker.get_new_tasks()] == ['03', '04']
+        # The watermark skips tasks already returned, even while they're open
+        assert tasker.get_new_tasks() == []
+
+    def test_rescan(self):
+        '''Tests that rescans wait for writes to tasks already handed out.'''
+        create_new_alerts([NewAlert('title', 'user', 'desc', 'reason', key='ab')])
+        tasker = SQLTasker()
+        assert [task.hash for task in tasker.get_new_tasks()] == ['AB']
+
+        # Setting the task in progress is still queued
+        tasker._last_rescan = datetime.min
+        with patch('securitybot.write_behind.pending', return_value=True):
+            assert tasker.get_new_tasks() == []
+        with patch('securitybot.journal.pending', return_value=True):
+            assert tasker.get_new_tasks() == []
+
+        # Open tasks are picked up again once nothing is pending
+        assert [task.hash for task in tasker.get_new_tasks()] == ['AB']
+        assert tasker.get_new_tasks() == []
+
+    def test_sharded_claim(self):
+        '''Tests that each worker claims only the tasks of its own users.'''
+        first = ShardedSQLTasker('a')
+        second = ShardedSQLTasker('b')
+        # Both workers are alive before either claims anything
+        first.heartbeat()
+        second.heartbeat()
+        ring = HashRing(['a', 'b'])
+        users = ['user{0}'.format(i) for i in range(20)]
+        create_new_alerts([NewAlert('title', user, 'desc', 'reason', key='{0:02x}'.format(i))
+                           for i, user in enumerate(users)])
+
+        claimed = first.get_new_tasks()
+        assert {task.username for task in claimed} == {u for u in users
+                                                       if ring.get_node(u) == 'a'}
+        claimed += second.get_new_tasks()
+        assert sorted(task.username for task in claimed) == sorted(users)
+        first.set_in_progress(claimed)
+        assert first.get_new_tasks() == []
+        assert second.get_new_tasks() == []
+
+    def test_sharded_batches(self):
+        '''Tests that new tasks are claimed in batches up to a limit per poll.'''
+        create_new_alerts([NewAlert('title', 'user', 'desc', 'reason', key='{0:02x}'.format(i))
+                           for i in range(5)])
+        tasker = ShardedSQLTasker('a', batch_size=2, max_new_tasks=3)
+        assert [task.hash for task in tasker.get_new_tasks()] == ['00', '01', '02']
+        assert [task.hash for task in tasker.get_new_tasks()] == ['03', '04']
+        assert tasker.get_new_tasks() == []
+        assert tasker._watermark == 5
+
+    def test_sharded_write_behind(self):
+        '''Tests that tasks aren't handed out again while their status change is queued.'''
+        tasker = ShardedSQLTasker('a')
+        create_new_alerts([NewAlert('title', 'user', 'desc', 'reason', key='ab')])
+        written = threading.Event()
+        execute_all = SQLEngine.execute_all
+
+        def blocked(*args, **kwargs):
+            written.wait()
+            return execute_all(*args, **kwargs)
+
+        write_behind.start()
+        try:
+            with patch('securitybot.sql.SQLEngine.execute_all', side_effect=blocked):
+                tasks = tasker.get_new_tasks()
+                tasker.set_in_progress(tasks)
+                assert write_behind.pending()
+                assert tasker.get_new_tasks() == []
+                written.set()
+                write_behind._writer.flush()
+        finally:
+            written.set()
+            write_behind.stop()
+        tasker._rescan = True
+        assert tasker.get_new_tasks() == []
+        assert tasker._handed_out == set()
+
+    def test_sharded_takeover(self):
+        '''Tests that tasks of a worker whose leases ran out are taken over.'''
+        first = ShardedSQLTasker('a')
+        create_new_alerts([NewAlert('title', 'user', 'desc', 'reason', key='ab')])
+        tasks = first.get_new_tasks()
+        first.set_in_progress(tasks)
+
+        second = ShardedSQLTasker('b')
+        assert second.get_new_tasks() == []
+        # The first worker dies
+        SQLEngine.execute('UPDATE alerts SET lease_expiry = %s', (datetime(2016, 7, 18),))
+        SQLEngine.execute('DELETE FROM workers WHERE worker_id = %s', ('a',))
+        assert [task.hash for task in second.get_new_tasks()] == ['AB']
+
+    def test_sharded_ring_change(self):
+        '''Tests that a user stays with their worker until their tasks are done.'''
+        first = ShardedSQLTasker('a')
+        ring = HashRing(['a', 'b'])
+        user = next('user{0}'.format(i) for i in range(100)
+                    if ring.get_node('user{0}'.format(i)) == 'b')
+        create_new_alerts([NewAlert('first', user, 'desc', 'reason', key='aa')])
+        tasks = first.get_new_tasks()
+        first.set_in_progress(tasks)
+
+        # A second worker joins and becomes responsible for the user
+        second = ShardedSQLTasker('b')
+        second.heartbeat()
+        first.heartbeat()
+        create_new_alerts([NewAlert('second', user, 'desc', 'reason', key='bb')])
+        assert first.get_new_tasks() == []
+        assert second.get_new_tasks() == []
+        assert not first.owns(user)
+        assert not second.owns(user)
+
+        # Once the first worker is done with the user, the second takes over
+        first.set_verifying(tasks)
+        assert [task.hash for task in second.get_new_tasks()] == ['BB']
+        assert second.owns(user)
+
+    def test_ignored(self):
+        ignore_task('user', 'title', 'first', timedelta(hours=1))
+        ignore_task('user', 'title', 'second', timedelta(hours=1))
+        assert get_ignored('user') == {'title': 'second'}
+
+        # Ignores made by other processes are picked up on refresh
+        SQLEngine.execute('INSERT INTO ignored (ldap, title, reason, until, updated) ' +
+                          'VALUES (%s, %s, %s, %s, NOW())',
+                          ('user', 'other', 'reason', datetime.utcnow() + timedelta(hours=1)))
+        assert 'other' not in get_ignored('user')
+        refresh()
+        assert get_ignored('user') == {'title': 'second', 'other': 'reason'}
+        reset_cache()
+        assert get_ignored('user') == {'title': 'second', 'other': 'reason'}
+        assert get_ignored_for_users(['user', 'nobody']) == {
+            'user': {'title': 'second', 'other': 'reason'},
+            'nobody': {},
+        }
+
+    def test_sweep(self):
+        '''Tests that expired ignores are swept in batches and hidden until then.'''
+        for title in ['a', 'b', 'c']:
+            SQLEngine.execute('INSERT INTO ignored (ldap, title, reason, until, updated) ' +
+                              'VALUES (%s, %s, %s, %s, NOW())',
+                              ('user', title, 'reason', datetime.utcnow() - timedelta(hours=1)))
+        ignore_task('user', 'live', 'reason', timedelta(hours=1))
+
+        ignored = api.ignored()['content']['ignored']
+        assert [i['title'] for i in ignored] == ['live']
+        assert get_ignored('user') == {'live': 'reason'}
+
+        assert sweep(batch_size=2, pause=0) == 3
+        rows = SQLEngine.execute('SELECT title FROM ignored')
+        assert [row[0] for row in rows] == ['live']
+        assert sweep(batch_size=2, pause=0) == 0
+
+    def test_ignore_rules(self):
+        '''Tests that ignore rules are rebuilt as rules and groups change.'''
+        add_rule('@oncall', 'pager_*', 'storm', timedelta(hours=1))
+        assert get_matcher().match('user', 'pager_down') is None
+        add_to_group('oncall', 'user')
+        assert get_matcher().match('user', 'pager_down') == 'storm'
+        reset_rules()
+        assert get_matcher().match('user', 'pager_down') == 'storm'
+        remove_rule('@oncall', 'pager_*')
+        assert get_matcher().match('user', 'pager_down') is None
+
+    def test_blacklist_changes(self):
+        '''Tests that blacklist changes made elsewhere are applied as deltas.'''
+        first = SQLBlacklist()
+        second = SQLBlacklist()
+        first.add('user')
+        first.add('other')
+        SQLEngine.execute('DELETE FROM blacklist WHERE ldap = %s', ('other',))
+        assert not second.is_present('user')
+        second.refresh()
+        assert second.is_present('user')
+        assert not second.is_present('other')
+        assert second._version == 3
+
+        # Falls back to a full reload if the changes have been deleted
+        first.remove('user')
+        SQLEngine.execute('DELETE FROM blacklist_changes')
+        second.refresh()
+        assert not second.is_present('user')
+        assert second._version == 4
+
+    def test_event_time(self):
+        '''Tests that datetimes round trip through MySQL functions.'''
+        create_new_alerts([NewAlert('title', 'user', 'desc', 'reason')])
+        rows = SQLEngine.execute('SELECT event_time FROM alerts WHERE event_time >= ' +
+                                 'FROM_UNIXTIME(%s)', (time.time() - 60,))
+        assert len(rows) == 1
+        assert rows[0][0].year >= 2016
+
+    def test_utc(self):
+        '''Tests that NOW and FROM_UNIXTIME give naive UTC datetimes.'''
+        before = datetime.utcnow().replace(microsecond=0)
+        rows = SQLEngine.execute('SELECT NOW(), FROM_UNIXTIME(%s)', (0,))
+        assert before <= datetime.strptime(rows[0][0], '%Y-%m-%d %H:%M:%S') <= datetime.utcnow()
+        assert rows[0][1] == '1970-01-01 00:00:00'
+
+    def test_archive(self):
+        '''Tests archiving old closed alerts and querying them.'''
+        create_new_alerts([NewAlert('old', 'user', 'desc', 'reason', key='aa'),
+                           NewAlert('new', 'user', 'desc', 'reason', key='bb')])
+        SQLEngine.execute('UPDATE alerts SET status = %s', (STATUS_LEVELS.VERIFICATION,))
+        SQLEngine.execute('UPDATE alerts SET event_time = %s WHERE title = %s',
+                          (datetime(2016, 7, 1), 'old'))
+
+        assert archive.archive(timedelta(days=1), batch_size=1, pause=0) == 1
+        assert archive.get_archives() == ['alerts_archive_201607']
+        assert archive.get_archives(after=datetime(2016, 8, 1)) == []
+
+        titles = [alert['title'] for alert in api.query()['content']['alerts']]
+        assert titles == ['new']
+        response = api.query(include_archive=True)
+        assert [alert['title'] for alert in response['content']['alerts']] == ['new', 'old']
+        # Archives are picked in UTC, whatever the local time zone
+        before = calendar.timegm(datetime(2016, 7, 1, 3).timetuple())
+        with patch.dict(os.environ, {'TZ': 'America/Los_Angeles'}):
+            time.tzset()
+            try:
+                response = api.query(include_archive=True, before=before)
+            finally:
+                time.tzset()
+        assert [alert['title'] for alert in response['content']['alerts']] == ['old']
+
+    def test_stats(self):
+        '''Tests that statements are recorded under their caller's tag.'''
+        SQLEngine.reset_stats()
+        create_new_alerts([NewAlert('title', 'user', 'desc', 'reason', key='ab')])
+        SQLTasker().get_new_tasks()
+        tags = {(q['tag'], q['count']) for q in SQLEngine.stats()
+                if q['fingerprint'].startswith('SELECT')}
+        assert tags == {('alerts', 1), ('tasker', 1)}
+        assert api.sql_stats(tag='tasker')['content']['queries'][0]['rows'] == 1
+
+    def test_journal_replay(self):
+        '''Tests that alerts journaled during an outage are created once replayed.'''
+        path = os.path.join(self.dir, 'journal')
+        raised = datetime(2016, 7, 18, 12)
+        journal.start(path, replay=False)
+        try:
+            with patch('securitybot.util._insert_alerts',
+                       side_effect=SQLEngineUnavailable('down')), \
+                    patch('securitybot.util.datetime', Mock(utcnow=Mock(return_value=raised))):
+                assert create_new_alerts([NewAlert('title', 'user', 'desc', 'reason')]) == []
+            assert SQLEngine.execute('SELECT title FROM alerts') == []
+            assert journal.JournalReplayer(journal._journal).replay() == 1
+        finally:
+            journal.stop()
+        rows = SQLEngine.execute('SELECT title, event_time FROM alerts')
+        assert [tuple(row) for row in rows] == [('title', raised)]
+
+class LostConnection(Exception):
+    pass
+
+class Deadlock(Exception):
+    pass
+
+class PoolTest(TestCase):
+    '''Checks connections in and out of a pool whose dialect hands out mocks.'''
+
+    def setUp(self):
+        self.dialect = Mock(spec=SQLiteDialect)
+        self.dialect.name = 'Mock'
+        self.dialect.Error = LostConnection
+        self.dialect.lost_connection.side_effect = lambda e: isinstance(e, LostConnection)
+        self.dialect.connect.side_effect = lambda: Mock()
+        self.pool = ConnectionPool(self.dialect, max_size=2, max_idle_time=60, timeout=0,
+                                   ping_idle_time=5)
+
+    def idle_for(self, seconds):
+        self.pool._idle = [(conn, checked_in - seconds) for conn, checked_in in self.pool._idle]
+
+    def test_checkout_checkin(self):
+        '''Tests that a connection used moments ago is reused without a ping.'''
+        conn = self.pool.checkout()
+        self.pool.checkin(conn)
+        assert self.pool.checkout() is conn
+        assert self.dialect.connect.call_count == 1
+        assert not self.dialect.ping.called
+
+    def test_ping_idle(self):
+        '''Tests that a connection idle for a while is pinged before reuse.'''
+        conn = self.pool.checkout()
+        self.pool.checkin(conn)
+        self.idle_for(10)
+        assert self.pool.checkout() is conn
+        self.dialect.ping.assert_called_once_with(conn)
+
+    def test_idle_expiry(self):
+        '''Tests that connections idle for too long are closed instead of reused.'''
+        conn = self.pool.checkout()
+        self.pool.checkin(conn)
+        self.idle_for(120)
+        assert self.pool.checkout() is not conn
+        conn.close.assert_called_once_with()
+        assert self.pool._size == 1
+
+    def test_dead_connection(self):
+        '''Tests that a connection failing its ping is discarded.'''
+        conn = self.pool.checkout()
+        self.pool.checkin(conn)
+        self.idle_for(10)
+        self.dialect.ping.side_effect = LostConnection('gone away')
+        assert self.pool.checkout() is not conn
+        conn.close.assert_called_once_with()
+        assert self.pool._size == 1
+
+    def test_broken(self):
+        '''Tests that connections which lost their connection aren't returned.'''
+        with self.assertRaises(LostConnection):
+            with self.pool.connection() as conn:
+                raise LostConnection('gone away')
+        conn.close.assert_called_once_with()
+        assert self.pool._size == 0
+        assert self.pool._idle == []
+
+    def test_timeout(self):
+        '''Tests giving up once every connection is checked out.'''
+        first = self.pool.checkout()
+        self.pool.checkout()
+        with self.assertRaises(SQLEngineException):
+            self.pool.checkout()
+        self.pool.checkin(first)
+        assert self.pool.checkout() is first
+
+class RetryTest(TestCase):
+    '''
+    Runs statements against a database whose connection drops, using a dialect
+    whose cursors fail a set number of times.
+    '''
+
+    def setUp(self):
+        self.failures = 0
+        self.error = LostConnection
+        self.executed = []
+        dialect = Mock(spec=SQLiteDialect)
+        dialect.name = 'Flaky'
+        dialect.Error = Exception
+        dialect.lost_connection.side_effect = lambda e: isinstance(e, LostConnection)
+        dialect.deadlock.side_effect = lambda e: isinstance(e, Deadlock)
+        dialect.prepare.side_effect = lambda query: query
+        dialect.begin.return_value = 'BEGIN'
+        self.dialect = dialect
+
+        def execute(query, params):
+            if self.failures:
+                self.failures -= 1
+                raise self.error('gone away')
+            self.executed.append(query)
+        dialect.connect.return_value.cursor.return_value.execute.side_effect = execute
+        dialect.connect.return_value.cursor.return_value.fetchall.return_value = []
+        SQLEngine.configure(dialect, retry_policy=RetryPolicy(max_attempts=3, base_delay=0),
+                            breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60))
+
+    def tearDown(self):
+        SQLEngine._pool = None
+        SQLEngine._dialect = None
+        SQLEngine._breaker = CircuitBreaker()
+
+    def test_retry_read(self):
+        self.failures = 2
+        SQLEngine.execute('SELECT 1')
+        assert self.executed == ['SELECT 1']
+
+    def test_no_retry_write(self):
+        '''Tests that writes which may have been applied aren't retried.'''
+        self.failures = 1
+        with self.assertRaises(SQLEngineException):
+            SQLEngine.execute('INSERT INTO blacklist (ldap) VALUES (%s)', ('user',))
+        assert self.executed == []
+        SQLEngine.execute('DELETE FROM blacklist', idempotent=True)
+        assert self.executed == ['DELETE FROM blacklist']
+
+    def test_retry_transaction(self):
+        '''Tests that transactions lost before committing are retried.'''
+        self.failures = 1
+        SQLEngine.execute_all([('UPDATE alerts SET status = %s', (1,))])
+        assert self.executed == ['BEGIN', 'UPDATE alerts SET status = %s', 'COMMIT']
+
+    def test_circuit_breaker(self):
+        '''Tests failing fast once the database is down, then recovering.'''
+        self.failures = 3
+        with self.assertRaises(SQLEngineException):
+            SQLEngine.execute('SELECT 1')
+        assert not SQLEngine.available()
+        with self.assertRaises(SQLEngineUnavailable):
+            SQLEngine.execute('SELECT 1')
+        assert self.executed == []
+
+        # Let a trial through
+        SQLEngine._breaker._opened_at -= 60
+        SQLEngine.execute('SELECT 1')
+        assert SQLEngine.available()
+
+    def test_abandoned_trial(self):
+        '''Tests that a trial ending without reaching the database lets another through.'''
+        self.failures = 3
+        with self.assertRaises(SQLEngineException):
+            SQLEngine.execute('SELECT 1')
+        SQLEngine._breaker._opened_at -= 60
+
+        # The trial's caller raises part way through a transaction
+        self.dialect.Error = LostConnection
+        with self.assertRaises(ValueError):
+            with SQLEngine.transaction():
+                raise ValueError('not a database error')
+        assert not SQLEngine.available()
+
+        # The next trial abandons an iterator
+        self.dialect.streaming_cursor.return_value.fetchmany.side_effect = [[(1,), (2,)], []]
+        rows = SQLEngine.iterate('SELECT 1')
+        next(rows)
+        rows.close()
+        assert not SQLEngine.available()
+
+        SQLEngine.execute('SELECT 1')
+        assert SQLEngine.available()
+
+    def test_deadlock(self):
+        '''Tests that deadlocked writes are retried without opening the circuit.'''
+        self.failures = 2
+        self.error = Deadlock
+        SQLEngine.execute('INSERT INTO blacklist (ldap) VALUES (%s)', ('user',))
+        assert self.executed == ['INSERT INTO blacklist (ldap) VALUES (%s)']
+
+        self.failures = 3
+        with self.assertRaises(SQLEngineException) as e:
+            SQLEngine.execute('SELECT 1')
+        assert not isinstance(e.exception, SQLEngineUnavailable)
+        assert SQLEngine.available()
+
+class MySQLDialectTest(TestCase):
+    def test_error_codes(self):
+        '''Tests telling lost connections apart from other operational errors.'''
+        class OperationalError(Exception):
+            pass
+        dialect = MySQLDialect.__new__(MySQLDialect)
+        dialect.lost_connection_errors = (OperationalError,)
+        for code in [2003, 2006, 2013, 2055]:
+            assert dialect.lost_connection(OperationalError(code, 'gone away'))
+            assert not dialect.deadlock(OperationalError(code, 'gone away'))
+        for code in [1213, 1205]:
+            assert not dialect.lost_connection(OperationalError(code, 'deadlock'))
+            assert dialect.deadlock(OperationalError(code, 'deadlock'))
+        assert not dialect.lost_connection(OperationalError(1054, 'unknown column'))
+        assert not dialect.deadlock(ValueError(1213))
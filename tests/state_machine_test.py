@@ -183,6 +183,23 @@ class FSMTest(TestCase):
         assert(helper.y == 5)
         assert(helper.z == 10)
 
+    def test_step_reports_transition(self):
+        '''Tests that stepping reports whether a transition occurred.'''
+        helper = Helper()
+        states = ['one', 'two']
+        transitions = [
+            {'source': 'one', 'dest': 'two', 'condition': helper.x_is_five},
+        ]
+        during = {
+            'one': helper.increment
+        }
+        sm = StateMachine(states, transitions, 'one', during=during)
+        for x in range(4):
+            assert not sm.step()
+        assert sm.step()
+        assert(str(sm.state) == 'two')
+        assert not sm.step()
+
     # Invalid input error notification tests
 
     def test_duplicate_states(self):
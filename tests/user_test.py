@@ -16,6 +16,8 @@ ignored_alerts.__update_ignored_list = Mock()
 ignored_alerts.get_ignored = Mock(return_value={})
 ignored_alerts.get_ignored.return_value = {}
 ignored_alerts.ignore_task = Mock()
+import securitybot.ignore_rules as ignore_rules
+ignore_rules.get_matcher = Mock(return_value=ignore_rules.RuleMatcher())
 
 class UserTest(TestCase):
     @patch('securitybot.chat.chat.Chat', autospec=True)
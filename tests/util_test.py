@@ -1,4 +1,5 @@
 from unittest2 import TestCase
+from mock import patch
 
 from datetime import datetime, timedelta
 import securitybot.util as util
@@ -87,3 +88,24 @@ class ExpirationTimeTest(TestCase):
         after = datetime(year=2016, month=7, day=18, hour=util.OPENING_HOUR,
                          tzinfo=util.LOCAL_TZ)
         assert util.get_expiration_time(date, td) == after
+
+class CreateAlertsTest(TestCase):
+    @patch('securitybot.util.SQLEngine')
+    def test_batches(self, engine):
+        '''Tests that alerts are inserted a batch at a time.'''
+        txn = engine.transaction.return_value.__enter__.return_value
+        txn.execute.return_value = ()
+        alerts = [util.NewAlert('title', 'user', 'desc', 'reason') for _ in range(5)]
+        assert util.create_new_alerts(alerts, batch_size=2) == []
+        assert engine.transaction.call_count == 3
+        # One lookup of existing hashes and one insert per batch
+        assert txn.execute.call_count == 6
+
+    @patch('securitybot.util.SQLEngine')
+    def test_duplicates(self, engine):
+        '''Tests that existing and repeated hashes are reported.'''
+        txn = engine.transaction.return_value.__enter__.return_value
+        txn.execute.return_value = (('AA',),)
+        alerts = [util.NewAlert('title', 'user', 'desc', 'reason', key=key)
+                  for key in ['aa', 'bb', 'bb']]
+        assert util.create_new_alerts(alerts) == ['aa', 'bb']
@@ -0,0 +1,80 @@
+from unittest2 import TestCase
+from mock import patch
+
+import securitybot.write_behind as write_behind
+from securitybot.sql import SQLEngineException, SQLEngineUnavailable
+
+class WriteBehindTest(TestCase):
+    @patch('securitybot.sql.SQLEngine.execute_all')
+    def test_synchronous(self, execute_all):
+        '''Tests that writes are applied immediately when not started.'''
+        write_behind.submit([('query', ())], 'tasker', idempotent=True)
+        execute_all.assert_called_with([('query', ())], 'tasker', True)
+
+    @patch('securitybot.sql.SQLEngine.execute_all')
+    def test_order_and_flush(self, execute_all):
+        '''Tests that queued writes are all applied, in order, on close.'''
+        queue = write_behind.WriteBehindQueue(batch_size=3)
+        for i in range(10):
+            queue.submit([('query', (i,))])
+        assert queue.pending()
+        queue.start()
+        queue.close()
+        assert not queue.pending()
+        written = [s for call in execute_all.call_args_list for s in call[0][0]]
+        assert written == [('query', (i,)) for i in range(10)]
+        assert queue.depth() == 0
+        assert queue.commits == execute_all.call_count
+
+    @patch('securitybot.sql.SQLEngine.execute_all')
+    def test_failed_write(self, execute_all):
+        '''Tests that one failing write doesn't drop the rest of its batch.'''
+        def fail_on_bad(statements, tag=None, idempotent=False):
+            if ('bad', ()) in statements:
+                raise SQLEngineException('bad')
+        execute_all.side_effect = fail_on_bad
+        queue = write_behind.WriteBehindQueue()
+        queue.submit([('good', ())])
+        queue.submit([('bad', ())])
+        queue.submit([('also good', ())])
+        queue.start()
+        queue.close()
+        assert queue.failures == 1
+        assert queue.commits == 2
+
+    @patch('securitybot.sql.SQLEngine.execute_all')
+    def test_tags(self, execute_all):
+        '''Tests that batches keep their tag only if every write shares it.'''
+        queue = write_behind.WriteBehindQueue()
+        queue._write([write_behind.Submission([('first', ())], 'tasker', True),
+                      write_behind.Submission([('second', ())], 'tasker', True)])
+        assert execute_all.call_args[0][1:] == ('tasker', True)
+        queue._write([write_behind.Submission([('first', ())], 'tasker', True),
+                      write_behind.Submission([('second', ())], 'ignored', False)])
+        assert execute_all.call_args[0][1:] == (write_behind.MIXED_TAG, False)
+
+    @patch('securitybot.write_behind.SQLEngine')
+    def test_unavailable(self, engine):
+        '''Tests that writes wait for the database to come back.'''
+        engine.execute_all.side_effect = [SQLEngineUnavailable('down'), None]
+        engine.retry_after.return_value = 0
+        queue = write_behind.WriteBehindQueue()
+        with patch.object(write_behind, 'UNAVAILABLE_WAIT', 0):
+            queue._write([write_behind.Submission([('query', ())], 'tasker', True)])
+        assert engine.execute_all.call_count == 2
+        assert queue.commits == 1
+        assert queue.failures == 0
+
+    @patch('securitybot.sql.SQLEngine.execute_all')
+    def test_unexpected_error(self, execute_all):
+        '''Tests that an unexpected error doesn't stop the writer thread.'''
+        execute_all.side_effect = [TypeError('bad param'), None]
+        queue = write_behind.WriteBehindQueue(batch_size=1)
+        queue.start()
+        queue.submit([('first', ())])
+        queue.flush()
+        assert not queue.pending()
+        queue.submit([('second', ())])
+        queue.close()
+        assert queue.failures == 1
+        assert queue.commits == 1
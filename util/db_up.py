@@ -1,87 +1,42 @@
 #!/usr/bin/env python
-import MySQLdb
-import sys
+'''
+Brings the securitybot database schema up to date by applying any pending
+migrations. Existing data is left alone unless --reset is passed.
+'''
+import argparse
+import logging
+
+from securitybot.sql import SQLEngine
+import securitybot.migrations as migrations
 
 # DB CONFIG GOES HERE
 host = 'localhost'
 user = 'root'
 passwd= ''
 
-db = MySQLdb.connect(host=host,
-                     user=user,
-                     passwd=passwd,
-                     db='securitybot')
-
-cur = db.cursor()
+def reset():
+    # type: () -> None
+    '''Drops every table in the database.'''
+    print 'Removing all tables'
+    for table in SQLEngine.execute('SHOW TABLES'):
+        table = table[0]
+        print 'Dropping {0}'.format(table)
+        SQLEngine.execute('DROP TABLE `{0}`'.format(table.replace('`', '``')))
 
-# Start fresh
-print 'Removing all tables'
-cur.execute('SHOW TABLES')
-tables = cur.fetchall()
-for table in tables:
-    table = table[0]
-    print 'Dropping {0}'.format(table)
-    cur.execute('DROP TABLE {0}'.format(MySQLdb.escape_string(table)))
-
-# Create tables
-print 'Creating tables...'
-
-cur.execute(
-'''
-CREATE TABLE blacklist (
-   ldap VARCHAR(255) NOT NULL,
-   PRIMARY KEY ( ldap )
-)
-'''
-)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Set up the Securitybot DB')
+    parser.add_argument('--reset', dest='reset', action='store_true',
+                        help='Drop all tables, and all of their data, before migrating.')
+    args = parser.parse_args()
 
-cur.execute(
-'''
-CREATE TABLE ignored (
-    ldap VARCHAR(255) NOT NULL,
-    title VARCHAR(255) NOT NULL,
-    reason VARCHAR(255) NOT NULL,
-    until DATETIME NOT NULL,
-    CONSTRAINT ignored_ID PRIMARY KEY ( ldap, title )
-)
-'''
-)
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s %(levelname)s] %(message)s')
 
-cur.execute(
-'''
-CREATE TABLE alerts (
-    hash BINARY(32) NOT NULL,
-    ldap VARCHAR(255) NOT NULL,
-    title VARCHAR(255) NOT NULL,
-    description VARCHAR(255) NOT NULL,
-    reason TEXT NOT NULL,
-    url VARCHAR(511) NOT NULL,
-    event_time DATETIME NOT NULL,
-    PRIMARY KEY ( hash )
-)
-'''
-)
+    SQLEngine(host, user, passwd, 'securitybot')
 
-cur.execute(
-'''
-CREATE TABLE alert_status (
-    hash BINARY(32) NOT NULL,
-    status TINYINT UNSIGNED NOT NULL,
-    PRIMARY KEY ( hash )
-)
-'''
-)
+    if args.reset:
+        reset()
 
-cur.execute(
-'''
-CREATE TABLE user_responses(
-    hash BINARY(32) NOT NULL,
-    comment TEXT,
-    performed BOOL,
-    authenticated BOOL,
-    PRIMARY KEY ( hash )
-)
-'''
-)
+    print 'Migrating...'
+    migrations.migrate()
 
-print 'Done!'
+    print 'Done!'